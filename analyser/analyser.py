@@ -1,8 +1,15 @@
 from dataclasses import dataclass
+import bisect
+import difflib
+import itertools
+import re
 from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.nlp_engine import NlpEngineProvider
 
-from analyser.recogniser import RecognizerRegistryWrapper
+from analyser.cache import AnalysisCache, DEFAULT_CACHE_SIZE
+from analyser.nlp import create_nlp_engine
+from analyser.pattern_analyser import PatternAnalyser
+from analyser.recogniser import NER_RECOGNIZERS, RecognizerRegistryWrapper
+from ocr.matcher import WordMatcher
 import utils.logger as logger
 
 DEFAULT_ANALYSER_CONFIG = {
@@ -13,26 +20,51 @@ DEFAULT_ANALYSER_CONFIG = {
     ],
 }
 
+# Only the Spanish model is loaded unless other languages are requested
+DEFAULT_LANGUAGES = ["es"]
+
+# Unchanged lines analysed around each changed line, so context words still apply
+CONTEXT_LINES = 1
+
 DEFAULT_RECOGNIZERS = ["DOB", "DNI", "PHONE", "ADDRESS", "POSTAL_CODE_CITY", "PERSON", "LOCATION", "ORG", "EMAIL"]
 
 @dataclass
-class SensitiveText:
+class SensitiveSpan:
+    # [start, end) character offsets in the analysed text
+    start: int
+    end: int
     text_type: str
-    words: list[str]
+
+@dataclass
+class AnalysedLines:
+    lines: list[str]
+    # spans found on each line, with offsets from the start of the line
+    spans: list[list[SensitiveSpan]]
+    analysed_lines: int = 0
+
+def _line_windows(changed: list[int], context_lines: int, line_count: int) -> list[tuple[int, int]]:
+    # Merge the context windows of the changed lines into disjoint [start, end) ranges
+    windows = []
+    for i in changed:
+        start, end = max(i - context_lines, 0), min(i + context_lines + 1, line_count)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
 
 class OCRAnalyser:
     def __init__(self, 
             analyser_config: dict = DEFAULT_ANALYSER_CONFIG,
+            languages: list[str] = DEFAULT_LANGUAGES,
+            trim_pipes: bool = True,
             recognizers: list[str] = DEFAULT_RECOGNIZERS,
             excluded_recognizers: list[str] = [],
             filtered_words: list[str] = [],
-            unfiltered_words: list[str] = []):
-        # Initialise engine
-        engine = NlpEngineProvider(nlp_configuration=analyser_config).create_engine()
-
-        # Get supported languages
-        supported_languages = [model["lang_code"] for model in analyser_config["models"]]
-
+            unfiltered_words: list[str] = [],
+            cache_size: int = DEFAULT_CACHE_SIZE,
+            cache_dir: str = None,
+            pattern_fast_path: bool = True):
         # Get recognizers
         if recognizers:
             self.recognizers = recognizers
@@ -42,6 +74,23 @@ class OCRAnalyser:
         if excluded_recognizers:
             self.recognizers = [rec for rec in self.recognizers if rec not in excluded_recognizers]
 
+        # Recognizers in the registry, configure can activate any subset of them later
+        self.loaded_recognizers = list(self.recognizers)
+
+        # Pattern recognizers alone do not need spaCy at all
+        self.pattern_only = pattern_fast_path and not any(rec in NER_RECOGNIZERS for rec in self.recognizers)
+
+        if self.pattern_only:
+            engine = None
+            supported_languages = languages
+            self.load_report = {"engine": "pattern"}
+        else:
+            # Initialise engine with the models of the requested languages only
+            engine, analyser_config, self.load_report = create_nlp_engine(analyser_config, languages, trim_pipes)
+
+            # Get supported languages
+            supported_languages = [model["lang_code"] for model in analyser_config["models"]]
+
         # Initialise recogniser registry
         self.registry_wrapper = RecognizerRegistryWrapper(
             languages = supported_languages, 
@@ -58,36 +107,151 @@ class OCRAnalyser:
         if unfiltered_words:
             self.unfiltered_words = unfiltered_words            
 
+        # Automaton of the filtered words, built once per filter set
+        self._filter_matcher = WordMatcher(self.filtered_words)
+
         # Initialise analyser
-        self.analyser = AnalyzerEngine(nlp_engine=engine, registry=registry, supported_languages=supported_languages)
+        if self.pattern_only:
+            self.analyser = PatternAnalyser(self.registry_wrapper.pattern_recognizers())
+        else:
+            self.analyser = AnalyzerEngine(nlp_engine=engine, registry=registry, supported_languages=supported_languages)
+
+        # Initialise results cache
+        self.cache = None
+        if cache_size or cache_dir:
+            self.cache = AnalysisCache(max_size=cache_size, cache_dir=cache_dir)
 
-    def analyse_text(self, text: str, language: str) -> list[SensitiveText]:
-        results = self.analyser.analyze(text=text, language=language)
+    def configure(self, recognizers: list[str] = None, excluded_recognizers: list[str] = [], filtered_words: list[str] = [], unfiltered_words: list[str] = []):
+        '''
+        Change the active recognizers and the filtered/unfiltered words of the next analyses
+        without reloading the NLP engine or the registry. recognizers defaults to every loaded
+        recognizer, and only loaded recognizers can be activated
+        '''
+        recognizers = list(recognizers) if recognizers else list(self.loaded_recognizers)
+        not_loaded = [rec for rec in recognizers if rec not in self.loaded_recognizers]
+        if not_loaded:
+            raise ValueError(f"Recognizers {not_loaded} are not loaded, expected some of {self.loaded_recognizers}")
 
-        sensitive_texts = []
+        self.recognizers = [rec for rec in recognizers if rec not in (excluded_recognizers or [])]
+        self.filtered_words = list(filtered_words) if filtered_words else []
+        self.unfiltered_words = list(unfiltered_words) if unfiltered_words else []
+        if frozenset(self.filtered_words) != self._filter_matcher.words:
+            self._filter_matcher = WordMatcher(self.filtered_words)
+
+    def _detect_spans(self, text: str, language: str) -> list[SensitiveSpan]:
+        '''
+        Run the analyser engine and return the spans of the detections, unfiltered words split them
+        '''
+        results = self.analyser.analyze(text=text, language=language, entities=self.recognizers)
+
+        spans = []
         for result in results:
-            # Check if entity type is a registered recognizer
-            if self.registry_wrapper.check_recognizer(result.entity_type):
-                text_type = result.entity_type
-                words = text[result.start:result.end].split()
+            # Check if entity type is an active recognizer
+            if result.entity_type not in self.recognizers:
+                continue
 
-                # Filter out words
-                words = [word for word in words if word not in self.unfiltered_words]
+            # Filter out words, the words around them stay in spans of their own
+            start = end = None
+            for word in re.finditer(r'\S+', text[result.start:result.end]):
+                if word.group() in self.unfiltered_words:
+                    if start is not None:
+                        spans.append(SensitiveSpan(start, end, result.entity_type))
+                    start = None
+                    continue
+                if start is None:
+                    start = result.start + word.start()
+                end = result.start + word.end()
+            if start is not None:
+                spans.append(SensitiveSpan(start, end, result.entity_type))
 
-                # Check if words are not empty
-                if len(words) > 0:
-                    sensitive_texts.append(SensitiveText(text_type=text_type, words=words))
+        return spans
 
-        # Check for other sensitive words
-        if len(self.filtered_words) > 0:   
-            sensitive_texts.append(SensitiveText(text_type="OTHER", words=self.filtered_words))
-        
-        return sensitive_texts
+    def _filtered_spans(self, text: str) -> list[SensitiveSpan]:
+        '''
+        Spans of every occurrence of the filtered words, found in a single pass over the text
+        '''
+        return [SensitiveSpan(start, end, "OTHER") for start, end, _ in self._filter_matcher.find_all(text)]
+
+    def _recognizer_spans(self, text: str, language: str) -> list[SensitiveSpan]:
+        '''
+        Spans the recognizers find in the text, through the analysis cache when there is one.
+        The same text with the same settings always gives the same spans
+        '''
+        if self.cache is None:
+            return self._detect_spans(text, language)
+
+        key = self.cache.make_key(text, language, "spans", sorted(self.recognizers), sorted(self.unfiltered_words))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [SensitiveSpan(start, end, text_type) for start, end, text_type in cached]
+
+        spans = self._detect_spans(text, language)
+        self.cache.put(key, [[span.start, span.end, span.text_type] for span in spans])
+        return spans
+
+    def analyse_spans(self, text: str, language: str) -> list[SensitiveSpan]:
+        '''
+        Sensitive spans of the text, the filtered words are found again on every call in a single pass
+        '''
+        return self._recognizer_spans(text, language) + self._filtered_spans(text)
+
+    def analyse_lines(self, lines: list[str], language: str, previous: AnalysedLines = None, context_lines: int = CONTEXT_LINES) -> AnalysedLines:
+        '''
+        Analyse the lines of a text layout, reusing the spans of the lines that did not change
+        since the previous analysis. Changed lines are analysed together with
+        context_lines neighbours on each side so context words still boost scores
+        '''
+        spans = [[] for _ in lines]
 
-    def analyse_text_to_string(self, text: str, language: str, debug: bool = False) -> list[str]:
-        sensitive_texts = self.analyse_text(text, language)
+        # Carry over the spans of unchanged lines
+        changed = set(range(len(lines)))
+        if previous is not None:
+            matcher = difflib.SequenceMatcher(a=previous.lines, b=lines, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == "equal":
+                    for offset in range(i2 - i1):
+                        spans[j1 + offset] = previous.spans[i1 + offset]
+                        changed.discard(j1 + offset)
+
+        # Analyse every changed line inside a window of surrounding context
+        for start, end in _line_windows(sorted(changed), context_lines, len(lines)):
+            window_spans = [[] for _ in range(start, end)]
+            window_text = '\n'.join(lines[start:end])
+            line_offsets = list(itertools.accumulate(len(line) + 1 for line in lines[start:end]))
+            # windows go through the cache too, the same lines often come back in later frames
+            for span in self._recognizer_spans(window_text, language):
+                line = bisect.bisect_right(line_offsets, span.start)
+                line_start = line_offsets[line - 1] if line > 0 else 0
+                window_spans[line].append(SensitiveSpan(span.start - line_start, span.end - line_start, span.text_type))
+            spans[start:end] = window_spans
+
+        return AnalysedLines(lines=list(lines), spans=spans, analysed_lines=len(changed))
+
+    def analyse_lines_to_spans(self, lines: list[str], language: str, previous: AnalysedLines = None, debug: bool = False) -> tuple[list[SensitiveSpan], AnalysedLines]:
+        '''
+        Sensitive spans of the lines, with offsets in the lines joined by '\n' (the layout text)
+        '''
+        analysed = self.analyse_lines(lines, language, previous)
+        line_starts = [0, *itertools.accumulate(len(line) + 1 for line in analysed.lines)]
+        spans = [SensitiveSpan(line_start + span.start, line_start + span.end, span.text_type)
+                 for line_start, line_spans in zip(line_starts, analysed.spans) for span in line_spans]
+        text = '\n'.join(analysed.lines)
+        spans += self._filtered_spans(text)
         if debug:
             logger.log("Recognizers", self.recognizers)
-            logger.log("Sensitive texts", sensitive_texts)
-        sensitive_words = list(set(word for sublist in sensitive_texts for word in sublist.words))
-        return sensitive_words
\ No newline at end of file
+            logger.log("Changed lines", f"{analysed.analysed_lines}/{len(analysed.lines)}")
+            logger.log("Sensitive spans", [(text[span.start:span.end], span.text_type) for span in spans])
+        return spans, analysed
+
+    def analyse_text_to_spans(self, text: str, language: str, debug: bool = False) -> list[SensitiveSpan]:
+        '''
+        Sensitive spans of a layout text, the offsets map back to its word boxes
+        '''
+        spans = self.analyse_spans(text, language)
+        if debug:
+            logger.log("Recognizers", self.recognizers)
+            logger.log("Sensitive spans", [(text[span.start:span.end], span.text_type) for span in spans])
+        return spans
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import spacy
+from spacy.language import Language
+from presidio_analyzer.nlp_engine import NerModelConfiguration, NlpEngine, NlpEngineProvider, SpacyNlpEngine
+
+# spaCy components the analyser never uses, only NER output is read
+TRIMMED_PIPES = ["parser", "senter", "tagger", "morphologizer", "attribute_ruler", "lemmatizer"]
+
+LOWER_LEMMA_PIPE = "lower_lemma"
+
+
+@Language.component(LOWER_LEMMA_PIPE)
+def lower_lemma(doc):
+    # Presidio matches context words against lemmas, use the lowercase form
+    # instead of running the tagger + lemmatizer
+    for token in doc:
+        token.lemma_ = token.lower_
+    return doc
+
+
+class TrimmedSpacyNlpEngine(SpacyNlpEngine):
+    '''
+    spaCy engine that only loads the components needed for NER
+    '''
+    def load(self) -> None:
+        self.nlp = {}
+        for model in self.models:
+            self._validate_model_params(model)
+            self._download_spacy_model_if_needed(model["model_name"])
+            nlp = spacy.load(model["model_name"], exclude=TRIMMED_PIPES)
+
+            # Drop the shared tok2vec when NER does not listen to it
+            if "tok2vec" in nlp.pipe_names and not nlp.get_pipe("tok2vec").listening_components:
+                nlp.disable_pipe("tok2vec")
+            nlp.add_pipe(LOWER_LEMMA_PIPE, last=True)
+            self.nlp[model["lang_code"]] = nlp
+
+
+def _rss_mb() -> float:
+    '''
+    Resident memory of this process in MB
+    '''
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0.0
+        # Peak memory instead, reported in bytes on macOS and in KB elsewhere
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def create_nlp_engine(analyser_config: dict, languages: list[str], trim_pipes: bool = True) -> tuple[NlpEngine, dict, dict]:
+    '''
+    Load the NLP models of the requested languages only, and report the load time and memory
+    '''
+    models = [model for model in analyser_config["models"] if model["lang_code"] in languages]
+    if not models:
+        raise ValueError(f"No NLP model configured for languages {languages}")
+    config = dict(analyser_config, models=models)
+
+    start, rss = time.perf_counter(), _rss_mb()
+    if trim_pipes and config["nlp_engine_name"] == "spacy":
+        ner_model_configuration = config.get("ner_model_configuration")
+        if ner_model_configuration:
+            ner_model_configuration = NerModelConfiguration.from_dict(ner_model_configuration)
+        engine = TrimmedSpacyNlpEngine(models=models, ner_model_configuration=ner_model_configuration)
+        engine.load()
+    else:
+        engine = NlpEngineProvider(nlp_configuration=config).create_engine()
+
+    report = {
+        "models": {model["lang_code"]: model["model_name"] for model in models},
+        "pipes": {lang: nlp.pipe_names for lang, nlp in getattr(engine, "nlp", {}).items()},
+        "load_seconds": round(time.perf_counter() - start, 3),
+        "rss_mb": round(_rss_mb() - rss, 1),
+    }
+    return engine, config, report
@@ -0,0 +1,78 @@
+import re
+
+from presidio_analyzer import EntityRecognizer, PatternRecognizer, RecognizerResult
+
+# Same flags Presidio compiles the recognizer patterns with
+REGEX_FLAGS = re.DOTALL | re.MULTILINE | re.IGNORECASE
+
+# Context enhancement parameters of Presidio's LemmaContextAwareEnhancer
+CONTEXT_SIMILARITY_FACTOR = 0.35
+MIN_SCORE_WITH_CONTEXT_SIMILARITY = 0.4
+CONTEXT_PREFIX_COUNT = 5
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[./]\w+)*\.?|[^\w\s]")
+
+
+class PatternAnalyser:
+    '''
+    Regex-only analyser for jobs that only use pattern recognizers.
+
+    It reproduces the scoring of AnalyzerEngine (pattern score, validation,
+    context boost on the preceding words, duplicate removal) without loading
+    any spaCy model. All patterns are also compiled into one alternation that
+    rejects text without any candidate in a single scan.
+    '''
+    def __init__(self, recognizers: list[PatternRecognizer]):
+        self._recognizers = []
+        for recognizer in recognizers:
+            patterns = [(pattern, re.compile(pattern.regex, REGEX_FLAGS)) for pattern in recognizer.patterns]
+            context = [word.lower() for word in recognizer.context or []]
+            self._recognizers.append((recognizer, patterns, context))
+
+        regexes = [pattern.regex for recognizer in recognizers for pattern in recognizer.patterns]
+        self._any_match = re.compile("|".join(f"(?:{regex})" for regex in regexes), REGEX_FLAGS) if regexes else None
+
+    def analyze(self, text: str, language: str = None, entities: list[str] = None) -> list[RecognizerResult]:
+        '''
+        Same results as AnalyzerEngine.analyze, only the recognizers of the given entities run
+        '''
+        if self._any_match is None or not self._any_match.search(text):
+            return []
+
+        results = []
+        for recognizer, patterns, context in self._recognizers:
+            if entities is not None and recognizer.supported_entities[0] not in entities:
+                continue
+            recognizer_results = EntityRecognizer.remove_duplicates(self._match(recognizer, patterns, text))
+            if context:
+                self._enhance_using_context(text, recognizer_results, context)
+            results.extend(recognizer_results)
+
+        return EntityRecognizer.remove_duplicates(results)
+
+    def _match(self, recognizer: PatternRecognizer, patterns: list, text: str) -> list[RecognizerResult]:
+        results = []
+        for pattern, regex in patterns:
+            for match in regex.finditer(text):
+                start, end = match.span()
+                current_match = text[start:end]
+                if current_match == "":
+                    continue
+
+                score = pattern.score
+                validation_result = recognizer.validate_result(current_match)
+                if validation_result is not None:
+                    score = EntityRecognizer.MAX_SCORE if validation_result else EntityRecognizer.MIN_SCORE
+                if recognizer.invalidate_result(current_match):
+                    score = EntityRecognizer.MIN_SCORE
+
+                if score > EntityRecognizer.MIN_SCORE:
+                    results.append(RecognizerResult(entity_type=recognizer.supported_entities[0], start=start, end=end, score=score))
+        return results
+
+    def _enhance_using_context(self, text: str, results: list[RecognizerResult], context: list[str]):
+        for result in results:
+            # Lowercase words before the match stand in for spaCy lemmas
+            surrounding_words = [word.lower() for word in TOKEN_PATTERN.findall(text[:result.start])[-CONTEXT_PREFIX_COUNT:]]
+            if any(context_word in word for context_word in context for word in surrounding_words):
+                result.score = min(max(result.score + CONTEXT_SIMILARITY_FACTOR, MIN_SCORE_WITH_CONTEXT_SIMILARITY), EntityRecognizer.MAX_SCORE)
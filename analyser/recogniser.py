@@ -7,6 +7,9 @@ from analyser.recognizers.address_recognizer import AddressRecognizer
 from analyser.recognizers.postal_code_city_recognizer import PostalCodeCityRecognizer
 from presidio_analyzer.predefined_recognizers import SpacyRecognizer
 
+# Recognizers backed by the spaCy NER model, the others are pure regex
+NER_RECOGNIZERS = ["PERSON", "LOCATION", "ORG", "EMAIL"]
+
 
 class RecognizerRegistryWrapper:
     def __init__(self,
@@ -27,6 +30,9 @@ class RecognizerRegistryWrapper:
 
     def get_registry(self):
         return self._registry
+
+    def pattern_recognizers(self) -> list[PatternRecognizer]:
+        return [recognizer for recognizer in self._registry.recognizers if isinstance(recognizer, PatternRecognizer)]
     
     def __custom_recognizers(self) -> dict[str, PatternRecognizer]:
         return {
@@ -45,4 +51,4 @@ class RecognizerRegistryWrapper:
         return self.__custom_recognizers().get(name, None)
 
     def check_recognizer(self, name: str) -> bool:
-        return name in self._recognizers
\ No newline at end of file
+        return name in self._recognizers
@@ -0,0 +1,308 @@
+import cv2
+from ocr.anonymiser import Anonymiser
+from ocr.text_detector import TextRegionDetector
+from video.change_detector import ChangeDetector
+from video.encoder import EncoderSettings
+from video.tracker import TextBoxTracker
+from utils.profiler import StageProfiler
+from main2 import create_ocr_components, image_pipeline, retrieve_tesseract_path, video_pipeline
+from cli_options import analysis_options, encoder_options, frame_options, ocr_backend_options, recognizer_options, tracking_options, verbose_option
+import click
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import utils.logger as logger
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_EXTENSIONS = ('.mp4',)
+
+# Name of the summary written to the output directory when --summary is not given
+SUMMARY_NAME = 'batch-summary.json'
+
+# Per-process state, built once by the pool initializer
+_worker = {}
+
+
+def collect_inputs(source: str, output_dir: str) -> tuple[list[str], str]:
+    '''
+    Images and videos of a directory (recursively), a glob pattern or a manifest file
+    with one path per line, and the directory their output paths are relative to
+    '''
+    if os.path.isdir(source):
+        base = source
+        inputs = []
+        for directory, subdirectories, names in os.walk(source):
+            # never pick up the outputs of an earlier run
+            subdirectories[:] = sorted(name for name in subdirectories if os.path.abspath(os.path.join(directory, name)) != os.path.abspath(output_dir))
+            inputs.extend(os.path.join(directory, name) for name in sorted(names))
+    elif os.path.isfile(source) and not source.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+        # manifest, relative paths are relative to the manifest and # starts a comment
+        with open(source) as manifest:
+            lines = [line.strip() for line in manifest]
+        base = None
+        inputs = [os.path.join(os.path.dirname(source), line) for line in lines if line and not line.startswith('#')]
+    else:
+        base = None
+        inputs = sorted(glob.glob(source, recursive = True))
+
+    inputs = [os.path.normpath(input) for input in inputs if input.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS) and not is_partial(input)]
+    if base is None:
+        base = os.path.commonpath([os.path.dirname(os.path.abspath(input)) for input in inputs]) if inputs else '.'
+    return inputs, base
+
+
+def output_path(input: str, base: str, output_dir: str) -> str:
+    '''
+    Output of an input file, at the same place under output_dir as the input is under base
+    '''
+    return os.path.join(output_dir, os.path.relpath(os.path.abspath(input), os.path.abspath(base)))
+
+
+def partial_path(output: str) -> str:
+    '''
+    File an output is written to until it is complete, it keeps the extension ffmpeg and OpenCV pick the format from
+    '''
+    root, extension = os.path.splitext(output)
+    return f"{root}.partial{extension}"
+
+
+def is_partial(path: str) -> bool:
+    return os.path.splitext(os.path.splitext(path)[0])[1] == '.partial'
+
+
+def fingerprint_path(output: str) -> str:
+    '''
+    File next to an output with the fingerprint of the settings it was obfuscated with
+    '''
+    return f"{output}.fingerprint"
+
+
+def settings_fingerprint(settings: dict) -> str:
+    '''
+    Hash of the settings that change what the outputs look like
+    '''
+    return hashlib.sha1(json.dumps(settings, sort_keys = True).encode("utf-8")).hexdigest()
+
+
+def read_fingerprint(output: str) -> str:
+    try:
+        with open(fingerprint_path(output)) as fingerprint_file:
+            return fingerprint_file.read().strip()
+    except OSError:
+        return None
+
+
+def is_up_to_date(input: str, output: str, fingerprint: str) -> bool:
+    '''
+    Whether the output is newer than the input and was obfuscated with the same settings
+    '''
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(input) and read_fingerprint(output) == fingerprint
+
+
+def load_components(settings: dict) -> dict:
+    '''
+    OCR engine, preprocessor, analyser, anonymiser and text detector of a worker, loaded once and reused for every file
+    '''
+    tesseract_api, image_preprocessor, analyser = create_ocr_components(settings["ocr_backend"], settings["tesseract_path"], settings["ocr_cache_dir"], settings["ocr_cache_size"], settings["ocr_scale"],
+                                                                        settings["analyser_kwargs"], settings["verbose"])
+    return dict(tesseract_api = tesseract_api, preprocessor = image_preprocessor, analyser = analyser,
+                anonymiser = Anonymiser(mode = settings["obfuscation_mode"]), text_detector = TextRegionDetector() if settings["text_regions"] else None)
+
+
+def anonymise_file(components: dict, settings: dict, input: str, output: str) -> dict:
+    '''
+    Anonymise one image or video with warm components, the result is its line of the summary
+    '''
+    profiler = StageProfiler()
+    image_preprocessor = components["preprocessor"]
+    # the OCR scale is picked again for every input
+    image_preprocessor.reset()
+    change_detector = ChangeDetector(settings["frame_diff_threshold"], settings["change_metric"])
+    result = dict(input = input, output = output)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    partial = partial_path(output)
+    try:
+        if input.lower().endswith(IMAGE_EXTENSIONS):
+            if cv2.imread(input) is None:
+                raise IOError(f"Could not read image: {input}")
+            image_pipeline(image_preprocessor, components["tesseract_api"], components["analyser"], components["anonymiser"], input, partial, profiler, settings["verbose"])
+        elif input.lower().endswith(VIDEO_EXTENSIONS):
+            # the video pipeline exits the process when it cannot open the video, check it here so the worker survives
+            capture = cv2.VideoCapture(input)
+            opened = capture.isOpened()
+            capture.release()
+            if not opened:
+                raise IOError(f"Could not open video: {input}")
+            tracker = TextBoxTracker(min_confidence = settings["track_confidence"]) if settings["track"] else None
+            video_pipeline(image_preprocessor, components["tesseract_api"], components["analyser"], components["anonymiser"], input, partial, change_detector, settings["dirty_regions"],
+                           None, tracker, settings["incremental_analysis"], settings["encoder_settings"], None, None, 1, profiler, settings["verbose"],
+                           preview = False, text_detector = components["text_detector"], ocr_threads = settings["ocr_threads"])
+        else:
+            raise ValueError(f"Unsupported file type: {input}")
+        os.replace(partial, output)
+        result["status"] = 'done'
+    except Exception as error:
+        if os.path.exists(partial):
+            os.remove(partial)
+        result["status"] = 'failed'
+        result["error"] = f"{type(error).__name__}: {error}"
+        if settings["verbose"]:
+            traceback.print_exc()
+
+    result["seconds"] = round(profiler.elapsed(), 3)
+    result["counters"] = dict(profiler.counters)
+    result["ocr_scale"] = image_preprocessor.scaling_factor
+    return result
+
+
+def _init_worker(settings: dict):
+    _worker["settings"] = settings
+    _worker["components"] = load_components(settings)
+    _worker["files"] = 0
+
+
+def process_file(job: tuple[str, str]) -> dict:
+    input, output = job
+    _worker["files"] += 1
+    result = anonymise_file(_worker["components"], _worker["settings"], input, output)
+    if result["status"] == 'done':
+        with open(fingerprint_path(output), "w") as fingerprint_file:
+            fingerprint_file.write(_worker["settings"]["fingerprint"])
+    result.update(worker = os.getpid(), warm = _worker["files"] > 1)
+    return result
+
+
+def schedule(jobs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    '''
+    Largest files first, so a long video does not start last and keep a single worker busy at the end
+    '''
+    return sorted(jobs, key = lambda job: (job[0].lower().endswith(VIDEO_EXTENSIONS), os.path.getsize(job[0])), reverse = True)
+
+
+def run_batch(jobs: list[tuple[str, str]], settings: dict, workers: int) -> list[dict]:
+    '''
+    Process every job on workers processes, or in this process with a single worker
+    '''
+    results = []
+    if workers == 1:
+        _init_worker(settings)
+        for job in jobs:
+            results.append(process_file(job))
+            print_result(results[-1], len(results), len(jobs))
+        return results
+
+    with multiprocessing.Pool(processes = workers, initializer = _init_worker, initargs = (settings,)) as pool:
+        for result in pool.imap_unordered(process_file, jobs):
+            results.append(result)
+            print_result(result, len(results), len(jobs))
+    return results
+
+
+def print_result(result: dict, done: int, total: int):
+    line = f"[{done}/{total}] {result['status']:7} {result['input']}"
+    if result["status"] == 'done':
+        line += f" ({result['seconds']:.2f}s)"
+    elif result["status"] == 'failed':
+        line += f": {result['error']}"
+    print(line)
+
+
+def summarise(results: list[dict], seconds: float) -> dict:
+    counts = {status: sum(result["status"] == status for result in results) for status in ('done', 'skipped', 'failed')}
+    return dict(files = len(results), **counts, seconds = round(seconds, 3), results = results)
+
+
+@click.command()
+@click.option(
+    '--input', '-i',
+    help = 'Directory (searched recursively), glob pattern or manifest file (one path per line) of the images and videos to obfuscate',
+    required = True,
+    type = str
+)
+@click.option('--output-dir', '-o',
+    help = 'Directory of the obfuscated files, each one keeps its path relative to the input directory',
+    required = True,
+    type = str
+)
+@recognizer_options()
+@frame_options()
+@tracking_options()
+@analysis_options(cache_size_help = 'Number of analysis results kept in memory, shared by the files of a worker. 0 disables the cache',
+                  cache_dir_help = 'Directory of the on-disk analysis cache shared between runs and workers')
+@ocr_backend_options()
+@click.option('--workers', '-w',
+    help = 'Number of worker processes, each one loads the OCR engine and the analyser once and processes whole files',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 1
+)
+@encoder_options(codec_help = 'ffmpeg video codec of the output videos')
+@click.option('--force',
+    help = 'Process the files again even when their output is newer than the input',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@click.option('--summary',
+    help = 'Path of the JSON summary with the status, time and frame counts of every file. Defaults to batch-summary.json in the output directory',
+    required = False,
+    type = str,
+    default = None
+)
+@verbose_option()
+def main(input, output_dir, recognizer, exclude_recognizer, filter, unfilter, frame_diff_threshold, change_metric, obfuscation_mode, dirty_regions, ocr_scale, text_regions, ocr_threads, track, track_confidence, analysis_cache_size, analysis_cache_dir, incremental_analysis, full_nlp_pipeline, ocr_backend, ocr_cache_dir, ocr_cache_size, workers, codec, preset, crf, force, summary, verbose):
+    start = time.perf_counter()
+    inputs, base = collect_inputs(input, output_dir)
+    if not inputs:
+        print(f"Error: no images or videos found in {input}.")
+        os._exit(1)
+
+    # outputs obfuscated with other recognizers, words, modes or encoder settings are not up to date
+    fingerprint = settings_fingerprint(dict(recognizers = sorted(recognizer or []), excluded_recognizers = sorted(exclude_recognizer or []), filter = sorted(filter or []), unfilter = sorted(unfilter or []),
+                                            frame_diff_threshold = frame_diff_threshold, change_metric = change_metric, obfuscation_mode = obfuscation_mode, dirty_regions = dirty_regions,
+                                            ocr_scale = ocr_scale, text_regions = text_regions, track = track, track_confidence = track_confidence, incremental_analysis = incremental_analysis,
+                                            full_nlp_pipeline = full_nlp_pipeline, ocr_backend = ocr_backend, codec = codec, preset = preset, crf = crf))
+    results = []
+    jobs = []
+    for file in inputs:
+        output = output_path(file, base, output_dir)
+        if not force and is_up_to_date(file, output, fingerprint):
+            results.append(dict(input = file, output = output, status = 'skipped'))
+        else:
+            jobs.append((file, output))
+    logger.log("Batch", dict(files = len(inputs), to_process = len(jobs), skipped = len(results), workers = min(workers, len(jobs))))
+
+    if jobs:
+        # read tesseract path from env (tesserocr links libtesseract and does not need it)
+        tesseract_path = retrieve_tesseract_path() if ocr_backend == 'pytesseract' else None
+        analyser_kwargs = dict(recognizers=recognizer, excluded_recognizers=exclude_recognizer, filtered_words=filter, unfiltered_words=unfilter,
+                               cache_size=analysis_cache_size, cache_dir=analysis_cache_dir, trim_pipes=not full_nlp_pipeline)
+        settings = dict(ocr_backend = ocr_backend, tesseract_path = tesseract_path, ocr_cache_dir = ocr_cache_dir, ocr_cache_size = ocr_cache_size, ocr_scale = ocr_scale,
+                        analyser_kwargs = analyser_kwargs, obfuscation_mode = obfuscation_mode, frame_diff_threshold = frame_diff_threshold, change_metric = change_metric,
+                        dirty_regions = dirty_regions, text_regions = text_regions, ocr_threads = ocr_threads, track = track, track_confidence = track_confidence,
+                        incremental_analysis = incremental_analysis, encoder_settings = EncoderSettings(codec = codec, preset = preset, crf = crf), verbose = verbose,
+                        fingerprint = fingerprint)
+        results.extend(run_batch(schedule(jobs), settings, min(workers, len(jobs))))
+
+    # summary lines in the order of the inputs, whatever order the workers finished in
+    order = {file: i for i, file in enumerate(inputs)}
+    results.sort(key = lambda result: order[result["input"]])
+    batch_summary = summarise(results, time.perf_counter() - start)
+    summary = summary or os.path.join(output_dir, SUMMARY_NAME)
+    os.makedirs(os.path.dirname(os.path.abspath(summary)), exist_ok = True)
+    with open(summary, "w") as summary_file:
+        json.dump(batch_summary, summary_file, indent=2)
+
+    print(f"{batch_summary['done']} done, {batch_summary['skipped']} skipped, {batch_summary['failed']} failed in {batch_summary['seconds']:.2f}s, summary saved to {summary}")
+    if batch_summary["failed"]:
+        os._exit(1)
+
+
+if __name__ == '__main__':
+    main()
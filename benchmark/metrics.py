@@ -0,0 +1,52 @@
+import numpy as np
+
+# Share of a ground truth box that has to be covered by redactions to count as redacted
+MIN_COVERAGE = 0.9
+
+
+def coverage(box: tuple[int, int, int, int], rectangles: list[tuple[int, int, int, int]]) -> float:
+    '''
+    Share of the box covered by the union of the rectangles
+    '''
+    x, y, w, h = box
+    if w <= 0 or h <= 0:
+        return 1.0
+    covered = np.zeros((h, w), dtype=bool)
+    for rx, ry, rw, rh in rectangles:
+        x1, y1 = max(rx - x, 0), max(ry - y, 0)
+        x2, y2 = min(rx + rw - x, w), min(ry + rh - y, h)
+        if x2 > x1 and y2 > y1:
+            covered[y1:y2, x1:x2] = True
+    return float(covered.mean())
+
+
+def intersects(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def redaction_scores(ground_truth: list[list[tuple[int, int, int, int]]], redactions: list[list[tuple[int, int, int, int]]]) -> dict:
+    '''
+    Recall: share of the ground truth boxes of every frame that were redacted.
+    Precision: share of the redacted rectangles that hit a ground truth box.
+    leaked_frames counts the frames where at least one sensitive value stayed visible
+    '''
+    found = missed = hits = false_alarms = leaked_frames = 0
+    for frame_index, boxes in enumerate(ground_truth):
+        rectangles = redactions[frame_index] if frame_index < len(redactions) else []
+        redacted = [coverage(box, rectangles) >= MIN_COVERAGE for box in boxes]
+        found += sum(redacted)
+        missed += len(redacted) - sum(redacted)
+        leaked_frames += not all(redacted)
+        for rectangle in rectangles:
+            if any(intersects(rectangle, box) for box in boxes):
+                hits += 1
+            else:
+                false_alarms += 1
+
+    return {
+        "recall": round(found / (found + missed), 4) if found + missed else 1.0,
+        "precision": round(hits / (hits + false_alarms), 4) if hits + false_alarms else 1.0,
+        "sensitive_boxes": found + missed,
+        "missed_boxes": missed,
+        "leaked_frames": leaked_frames,
+    }
@@ -0,0 +1,178 @@
+import json
+import os
+import subprocess
+
+import click
+
+from analyser.analyser import OCRAnalyser
+from benchmark.metrics import redaction_scores
+from benchmark.synthetic import BENCHMARK_VERSION, SEED, Sample, load_or_generate
+from main2 import image_pipeline, retrieve_tesseract_path, video_pipeline
+from ocr.anonymiser import OBFUSCATION_MODES, Anonymiser
+from ocr.api import OCR_BACKENDS, create_ocr_api
+from ocr.preprocessor import OCRPreprocessor
+from ocr.text_detector import TextRegionDetector
+from utils.profiler import StageProfiler
+from video.change_detector import CHANGE_METRICS, ChangeDetector
+from video.encoder import EncoderSettings
+from video.tracker import TextBoxTracker
+
+DATA_DIR = os.path.join("benchmark", "data")
+
+
+class RecordingAnonymiser(Anonymiser):
+    '''
+    Anonymiser that keeps the rectangles redacted in every frame
+    '''
+    def __init__(self, mode: str = "blur"):
+        super().__init__(mode=mode)
+        self.frames = []
+
+    def redact(self, image, rectangles):
+        self.frames.append(list(rectangles))
+        return super().redact(image, rectangles)
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_sample(sample: Sample, output_dir: str, tesseract_api, settings: dict) -> dict:
+    analyser = OCRAnalyser()
+    image_preprocessor = OCRPreprocessor(scaling_factor=settings["ocr_scale"])
+    anonymiser = RecordingAnonymiser(mode=settings["obfuscation_mode"])
+    profiler = StageProfiler()
+    output = os.path.join(output_dir, os.path.basename(sample.path))
+
+    if sample.kind == "image":
+        image_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, sample.path, output, profiler, False)
+    else:
+        tracker = TextBoxTracker() if settings["track"] else None
+        change_detector = ChangeDetector(settings["frame_diff_threshold"], settings["change_metric"])
+        video_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, sample.path, output,
+                       change_detector, settings["dirty_regions"], None, tracker, settings["incremental_analysis"],
+                       EncoderSettings(), None, None, settings["stride"], profiler, False, preview=False,
+                       text_detector=TextRegionDetector() if settings["text_regions"] else None)
+
+    report = profiler.report()
+    return {
+        "kind": sample.kind,
+        "frames": report["counters"].get("frames", 0),
+        "fps": report["fps"],
+        "wall_seconds": report["wall_seconds"],
+        **redaction_scores(sample.frames, anonymiser.frames),
+        "counters": report["counters"],
+        "stages": report["stages"],
+    }
+
+
+@click.command()
+@click.option('--data-dir',
+    help = 'Directory of the generated samples, they are generated again if missing or outdated',
+    required = False,
+    type = str,
+    default = DATA_DIR
+)
+@click.option('--output', '-o',
+    help = 'Path of the JSON results, named after the current commit by default',
+    required = False,
+    type = str,
+    default = None
+)
+@click.option('--seed',
+    help = 'Seed of the generated samples',
+    required = False,
+    type = int,
+    default = SEED
+)
+@click.option('--ocr-backend', '-b',
+    help = 'OCR backend: pytesseract runs a tesseract process per call, tesserocr keeps a warm in-process engine',
+    required = False,
+    type = click.Choice(OCR_BACKENDS),
+    default = 'pytesseract'
+)
+@click.option('--frame-diff-threshold', '-t',
+    help = 'Threshold for frame change percentage (of pixels, blocks or hash bits, see --change-metric)',
+    required = False,
+    type = int,
+    default = 2
+)
+@click.option('--change-metric',
+    help = 'How frames are compared with the last OCR\'d frame: percentage of changed pixels, of changed 8x8 blocks, or of differing perceptual hash bits',
+    required = False,
+    type = click.Choice(CHANGE_METRICS),
+    default = 'pixel'
+)
+@click.option('--obfuscation-mode', '-m',
+    help = 'How sensitive text is hidden: Gaussian blur, pixelate or solid fill (cheapest)',
+    required = False,
+    type = click.Choice(OBFUSCATION_MODES),
+    default = 'blur'
+)
+@click.option('--dirty-regions', '-d',
+    help = 'Only OCR again the regions of the frame that changed instead of the whole frame',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@click.option('--text-regions',
+    help = 'Only OCR the text regions found by a morphological-gradient detector instead of the whole frame',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@click.option('--ocr-scale',
+    help = 'Fixed scale factor of the images sent to OCR. By default it is picked per sample from the estimated text height',
+    required = False,
+    type = float,
+    default = None
+)
+@click.option('--track',
+    help = 'Track the sensitive text boxes between OCR runs and only OCR again when tracking is lost',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@click.option('--incremental-analysis',
+    help = 'Only analyse the OCR lines that changed since the previous OCR, plus a line of context around them',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@click.option('--stride',
+    help = 'Only consider every n-th frame of the videos for OCR and analysis, the others reuse the last detections',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 1
+)
+def main(data_dir, output, seed, ocr_backend, frame_diff_threshold, change_metric, obfuscation_mode, dirty_regions, text_regions, ocr_scale, track, incremental_analysis, stride):
+    settings = dict(ocr_backend=ocr_backend, frame_diff_threshold=frame_diff_threshold, change_metric=change_metric, obfuscation_mode=obfuscation_mode,
+                    dirty_regions=dirty_regions, text_regions=text_regions, ocr_scale=ocr_scale, track=track, incremental_analysis=incremental_analysis, stride=stride)
+    samples = load_or_generate(data_dir, seed)
+
+    tesseract_path = retrieve_tesseract_path() if ocr_backend == 'pytesseract' else None
+    tesseract_api = create_ocr_api(ocr_backend, tesseract_path = tesseract_path)
+
+    output_dir = os.path.join(data_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    commit = current_commit()
+    results = {"version": BENCHMARK_VERSION, "seed": seed, "commit": commit, "settings": settings, "samples": {}}
+    for sample in samples:
+        results["samples"][sample.name] = run_sample(sample, output_dir, tesseract_api, settings)
+
+    print(f"{'sample':<10} {'frames':>6} {'fps':>8} {'recall':>7} {'precision':>9} {'leaked':>6}")
+    for name, result in results["samples"].items():
+        print(f"{name:<10} {result['frames']:>6} {result['fps']:>8.2f} {result['recall']:>7.3f} {result['precision']:>9.3f} {result['leaked_frames']:>6}")
+
+    output = output or os.path.join("benchmark", "results", f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+from dataclasses import asdict, dataclass, field
+
+import cv2
+import numpy as np
+
+# Bump when the generated data changes, results are only comparable within a version
+BENCHMARK_VERSION = 1
+
+SEED = 1234
+
+FRAME_WIDTH = 960
+FRAME_HEIGHT = 540
+FRAME_RATE = 10
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+FONT_SCALE = 0.8
+FONT_THICKNESS = 2
+LINE_HEIGHT = 48
+MARGIN = 40
+BACKGROUND = (250, 250, 250)
+TEXT_COLOR = (20, 20, 20)
+
+# Frames each slide is shown in the slides video, slides change with a hard cut
+SLIDE_FRAMES = 30
+
+# Pixels the page moves up every frame in the scroll video
+SCROLL_SPEED = 4
+SCROLL_FRAMES = 80
+
+# Share of a ground truth box that has to be visible to count in a frame
+MIN_VISIBLE = 0.5
+
+DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+STREETS = ["Mayor", "Alcala", "Serrano", "Princesa", "Toledo", "Atocha", "Goya", "Velazquez"]
+TOWNS = [("28001", "Madrid", "Madrid"), ("08002", "Barcelona", "Barcelona"), ("41001", "Sevilla", "Sevilla"),
+         ("46001", "Valencia", "Valencia"), ("50001", "Zaragoza", "Zaragoza"), ("29001", "Malaga", "Malaga")]
+FILLER = ["Tema 3: Introduccion a la estadistica", "Ejercicio resuelto en clase", "Entrega antes del viernes",
+          "Revision de la practica 2", "Notas del primer parcial", "Consultas en el despacho 2.14"]
+
+
+@dataclass
+class Sample:
+    '''
+    A generated image or video, with the ground truth (x, y, w, h) boxes of
+    the sensitive values visible in every frame
+    '''
+    name: str
+    kind: str
+    path: str
+    frames: list[list[tuple[int, int, int, int]]] = field(default_factory=list)
+
+
+def fake_dni(rng: random.Random) -> str:
+    number = rng.randrange(10000000, 100000000)
+    return f"{number}{DNI_LETTERS[number % 23]}"
+
+
+def fake_phone(rng: random.Random) -> str:
+    return f"{rng.choice('67')}{rng.randrange(10000000, 100000000)}"
+
+
+def fake_date(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1950, 2005)}"
+
+
+def fake_address(rng: random.Random) -> str:
+    return f"Calle {rng.choice(STREETS)} {rng.randint(1, 150)}, Esc:{rng.randint(1, 4)} {rng.randint(1, 9)}"
+
+
+def fake_postal_code_city(rng: random.Random) -> str:
+    postal_code, town, province = rng.choice(TOWNS)
+    return f"{postal_code} {town} ({province})"
+
+
+# Label of the line and generator of the sensitive value that follows it
+FIELDS = [("DNI", fake_dni), ("Telefono", fake_phone), ("Fecha de nacimiento", fake_date),
+          ("Domicilio", fake_address), ("CP", fake_postal_code_city)]
+
+
+def fake_lines(rng: random.Random, records: int) -> list[tuple[str, str]]:
+    '''
+    Lines of a slide as (plain text, sensitive value) pairs, value is empty for filler lines
+    '''
+    lines = [(rng.choice(FILLER), "")]
+    for _ in range(records):
+        for label, generator in rng.sample(FIELDS, 3):
+            lines.append((f"{label}: ", generator(rng)))
+        lines.append((rng.choice(FILLER), ""))
+    return lines
+
+
+def render_page(lines: list[tuple[str, str]], height: int) -> tuple[np.ndarray, list[tuple[int, int, int, int]]]:
+    '''
+    Draw the lines with cv2.putText and return the page with the boxes of the sensitive values
+    '''
+    page = np.full((height, FRAME_WIDTH, 3), BACKGROUND, dtype=np.uint8)
+    boxes = []
+    y = MARGIN + LINE_HEIGHT
+    for text, value in lines:
+        cv2.putText(page, text + value, (MARGIN, y), FONT, FONT_SCALE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+        if value:
+            (prefix_width, _), _ = cv2.getTextSize(text, FONT, FONT_SCALE, FONT_THICKNESS)
+            (value_width, value_height), baseline = cv2.getTextSize(value, FONT, FONT_SCALE, FONT_THICKNESS)
+            boxes.append((MARGIN + prefix_width, y - value_height, value_width, value_height + baseline))
+        y += LINE_HEIGHT
+    return page, boxes
+
+
+def visible_boxes(boxes: list[tuple[int, int, int, int]], offset: int) -> list[tuple[int, int, int, int]]:
+    '''
+    Boxes of the page seen through a frame scrolled down by offset pixels, clipped to the frame
+    '''
+    visible = []
+    for x, y, w, h in boxes:
+        y1, y2 = max(y - offset, 0), min(y - offset + h, FRAME_HEIGHT)
+        if y2 > y1 and (y2 - y1) >= MIN_VISIBLE * h:
+            visible.append((x, y1, w, y2 - y1))
+    return visible
+
+
+def write_video(path: str, frames: list[np.ndarray]):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), FRAME_RATE, (FRAME_WIDTH, FRAME_HEIGHT))
+    for frame in frames:
+        out.write(frame)
+    out.release()
+
+
+def generate_images(rng: random.Random, data_dir: str, count: int = 3) -> list[Sample]:
+    samples = []
+    for i in range(count):
+        page, boxes = render_page(fake_lines(rng, 2), FRAME_HEIGHT)
+        sample = Sample(name=f"image_{i}", kind="image", path=os.path.join(data_dir, f"image_{i}.png"), frames=[boxes])
+        cv2.imwrite(sample.path, page)
+        samples.append(sample)
+    return samples
+
+
+def generate_slides(rng: random.Random, data_dir: str, slides: int = 4) -> Sample:
+    '''
+    Static slides separated by scene cuts
+    '''
+    sample = Sample(name="slides", kind="video", path=os.path.join(data_dir, "slides.mp4"))
+    frames = []
+    for _ in range(slides):
+        page, boxes = render_page(fake_lines(rng, 2), FRAME_HEIGHT)
+        frames += [page] * SLIDE_FRAMES
+        sample.frames += [boxes] * SLIDE_FRAMES
+    write_video(sample.path, frames)
+    return sample
+
+
+def generate_scroll(rng: random.Random, data_dir: str) -> Sample:
+    '''
+    A long page scrolling up at constant speed
+    '''
+    sample = Sample(name="scroll", kind="video", path=os.path.join(data_dir, "scroll.mp4"))
+    lines = fake_lines(rng, 4)
+    page, boxes = render_page(lines, max(len(lines) * LINE_HEIGHT + 2 * MARGIN, FRAME_HEIGHT + SCROLL_SPEED * SCROLL_FRAMES))
+    frames = []
+    for i in range(SCROLL_FRAMES):
+        offset = i * SCROLL_SPEED
+        frames.append(page[offset:offset + FRAME_HEIGHT])
+        sample.frames.append(visible_boxes(boxes, offset))
+    write_video(sample.path, frames)
+    return sample
+
+
+def generate(data_dir: str, seed: int = SEED) -> list[Sample]:
+    '''
+    Generate the benchmark samples into data_dir and save their ground truth
+    '''
+    os.makedirs(data_dir, exist_ok=True)
+    rng = random.Random(seed)
+    samples = generate_images(rng, data_dir) + [generate_slides(rng, data_dir), generate_scroll(rng, data_dir)]
+    with open(os.path.join(data_dir, "ground_truth.json"), "w") as ground_truth_file:
+        json.dump({"version": BENCHMARK_VERSION, "seed": seed, "samples": [asdict(sample) for sample in samples]}, ground_truth_file)
+    return samples
+
+
+def load_or_generate(data_dir: str, seed: int = SEED) -> list[Sample]:
+    '''
+    Reuse the samples in data_dir when they were generated by this version with the same seed
+    '''
+    path = os.path.join(data_dir, "ground_truth.json")
+    if os.path.exists(path):
+        with open(path) as ground_truth_file:
+            ground_truth = json.load(ground_truth_file)
+        if ground_truth["version"] == BENCHMARK_VERSION and ground_truth["seed"] == seed:
+            samples = [Sample(**sample) for sample in ground_truth["samples"]]
+            if all(os.path.exists(sample.path) for sample in samples):
+                return samples
+    return generate(data_dir, seed)
@@ -0,0 +1,210 @@
+from analyser.analyser import DEFAULT_RECOGNIZERS
+from analyser.cache import DEFAULT_CACHE_SIZE
+from ocr.anonymiser import OBFUSCATION_MODES
+from ocr.api import OCR_BACKENDS
+from ocr.cache import DEFAULT_OCR_CACHE_MB
+from video.change_detector import CHANGE_METRICS
+from video.encoder import DEFAULT_CODEC, DEFAULT_CRF, DEFAULT_PRESET
+from video.tracker import MIN_CONFIDENCE
+import click
+
+# Options shared by the main2, batch and service commands. Each function returns a
+# decorator adding a group of options, in the order they are listed in --help
+
+
+def _options(options: list):
+    def decorator(function):
+        for option in reversed(options):
+            function = option(function)
+        return function
+    return decorator
+
+
+def _filtered_words(ctx, param, words):
+    # an empty word would be found in every text
+    if any(not word.strip() for word in words or ()):
+        raise click.BadParameter('the words to obfuscate cannot be empty')
+    return words
+
+
+def recognizer_options(recognizer_help: str = 'Recognizers to register. Default includes all recognizers'):
+    return _options([
+        click.option('--recognizer', '-r',
+            help = recognizer_help,
+            required = False,
+            multiple = True,
+            type = click.Choice(DEFAULT_RECOGNIZERS),
+            default = None
+        ),
+        click.option('--exclude-recognizer', '-e',
+            help = 'Recognizers to exclude. Default includes all recognizers',
+            required = False,
+            multiple = True,
+            type = click.Choice(DEFAULT_RECOGNIZERS),
+            default = None
+        ),
+        click.option('--filter', '-f',
+            help = 'obfuscate a given word',
+            required = False,
+            multiple = True,
+            type = str,
+            default = None,
+            callback = _filtered_words
+        ),
+        click.option('--unfilter', '-u',
+            help = 'un-obfuscate a given word',
+            required = False,
+            multiple = True,
+            type = str,
+            default = None
+        ),
+    ])
+
+
+def frame_options():
+    return _options([
+        click.option('--frame-diff-threshold', '-t',
+            help = 'Threshold for frame change percentage (of pixels, blocks or hash bits, see --change-metric)',
+            required = False,
+            type = int,
+            default = 2
+        ),
+        click.option('--change-metric',
+            help = 'How frames are compared with the last OCR\'d frame: percentage of changed pixels, of changed 8x8 blocks, or of differing perceptual hash bits',
+            required = False,
+            type = click.Choice(CHANGE_METRICS),
+            default = 'pixel'
+        ),
+        click.option('--obfuscation-mode', '-m',
+            help = 'How sensitive text is hidden: Gaussian blur, pixelate or solid fill (cheapest)',
+            required = False,
+            type = click.Choice(OBFUSCATION_MODES),
+            default = 'blur'
+        ),
+        click.option('--dirty-regions', '-d',
+            help = 'Only OCR again the regions of the frame that changed instead of the whole frame',
+            required = False,
+            is_flag = True,
+            default = False
+        ),
+        click.option('--ocr-scale',
+            help = 'Fixed scale factor of the images sent to OCR. By default it is picked per input from the estimated text height',
+            required = False,
+            type = click.FloatRange(min = 0.1, max = 4.0),
+            default = None
+        ),
+        click.option('--text-regions',
+            help = 'Only OCR the text regions found by a morphological-gradient detector instead of the whole frame',
+            required = False,
+            is_flag = True,
+            default = False
+        ),
+        click.option('--ocr-threads',
+            help = 'Number of threads that OCR the regions of a frame at the same time',
+            required = False,
+            type = click.IntRange(min = 1),
+            default = 1
+        ),
+    ])
+
+
+def tracking_options():
+    return _options([
+        click.option('--track',
+            help = 'Track the sensitive text boxes between OCR runs and only OCR again when tracking is lost',
+            required = False,
+            is_flag = True,
+            default = False
+        ),
+        click.option('--track-confidence',
+            help = 'Minimum template matching score to keep tracking the boxes',
+            required = False,
+            type = float,
+            default = MIN_CONFIDENCE
+        ),
+    ])
+
+
+def analysis_options(cache_size_help: str = 'Number of analysis results kept in memory. 0 disables the cache',
+                     cache_dir_help: str = 'Directory of the on-disk analysis cache shared between runs'):
+    return _options([
+        click.option('--analysis-cache-size',
+            help = cache_size_help,
+            required = False,
+            type = click.IntRange(min = 0),
+            default = DEFAULT_CACHE_SIZE
+        ),
+        click.option('--analysis-cache-dir',
+            help = cache_dir_help,
+            required = False,
+            type = str,
+            default = None
+        ),
+        click.option('--incremental-analysis',
+            help = 'Only analyse the OCR lines that changed since the previous OCR, plus a line of context around them',
+            required = False,
+            is_flag = True,
+            default = False
+        ),
+        click.option('--full-nlp-pipeline',
+            help = 'Load every spaCy component instead of only the ones NER needs',
+            required = False,
+            is_flag = True,
+            default = False
+        ),
+    ])
+
+
+def ocr_backend_options():
+    return _options([
+        click.option('--ocr-backend', '-b',
+            help = 'OCR backend: pytesseract runs a tesseract process per call, tesserocr keeps a warm in-process engine',
+            required = False,
+            type = click.Choice(OCR_BACKENDS),
+            default = 'pytesseract'
+        ),
+        click.option('--ocr-cache-dir',
+            help = 'Directory of the on-disk OCR cache, frames with the same pixels are not OCR\'d again in later runs',
+            required = False,
+            type = str,
+            default = None
+        ),
+        click.option('--ocr-cache-size',
+            help = 'Size cap of the OCR cache in MB, the least recently used results are evicted',
+            required = False,
+            type = click.IntRange(min = 1),
+            default = DEFAULT_OCR_CACHE_MB
+        ),
+    ])
+
+
+def encoder_options(codec_help: str = 'ffmpeg video codec of the output video'):
+    return _options([
+        click.option('--codec',
+            help = codec_help,
+            required = False,
+            type = str,
+            default = DEFAULT_CODEC
+        ),
+        click.option('--preset',
+            help = 'Encoder preset, slower presets compress better',
+            required = False,
+            type = str,
+            default = DEFAULT_PRESET
+        ),
+        click.option('--crf',
+            help = 'Constant rate factor of the encoder, lower is better quality',
+            required = False,
+            type = click.IntRange(min = 0, max = 63),
+            default = DEFAULT_CRF
+        ),
+    ])
+
+
+def verbose_option():
+    return click.option('--verbose', '-v',
+        help = 'Enable verbose mode for additional logging',
+        required = False,
+        is_flag = True,
+        default = False
+    )
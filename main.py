@@ -4,6 +4,7 @@ from ocr.anonymiser import Anonymiser
 from ocr.api import PyTesseractAPI
 from ocr.preprocessor import OCRPreprocessor
 from ocr.api import TextBox
+from ocr.layout import TextLayout
 import click
 import os
 
@@ -92,13 +93,14 @@ def image_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTessera
     preprocessed_image = image_preprocessor.preprocess_image(img)
 
     # extract text
-    ocr_text, text_boxes = tesseract_api.recognise_text_to_data(img, lang="spa", debug=verbose)
+    _, text_boxes = tesseract_api.recognise_text_to_data(img, lang="spa", debug=verbose)
     # text_boxes = translate_image_scale(text_boxes, SCALING_FACTOR)
+    layout = TextLayout(text_boxes)
 
     # analyse text
-    sensitive_words = analyser.analyse_text_to_string(ocr_text, "es", debug=verbose)
+    spans = analyser.analyse_text_to_spans(layout.text, "es", debug=verbose)
     # anonymise image
-    img = anonymiser.anonymise(img, text_boxes, sensitive_words)
+    img = anonymiser.anonymise(img, layout.entity_boxes(spans))
 
     # save image
     cv2.imwrite(output, img)
@@ -131,12 +133,13 @@ def video_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTessera
         preprocessed_image = image_preprocessor.preprocess_image(frame)
 
         # extract text
-        ocr_text, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+        _, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+        layout = TextLayout(text_boxes)
 
         # analyse text
-        sensitive_words = analyser.analyse_text_to_string(ocr_text, "es", debug=verbose)
+        spans = analyser.analyse_text_to_spans(layout.text, "es", debug=verbose)
         # anonymise image
-        frame = anonymiser.anonymise(frame, text_boxes, sensitive_words)
+        frame = anonymiser.anonymise(frame, layout.entity_boxes(spans))
 
         cv2.imshow("preview", frame)
 
@@ -164,4 +167,4 @@ def translate_image_scale(text_boxes: list[TextBox], scaling_factor: float) -> l
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
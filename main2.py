@@ -1,18 +1,38 @@
 import cv2
 from analyser.analyser import OCRAnalyser
 from ocr.anonymiser import Anonymiser
-from ocr.api import PyTesseractAPI
+from ocr.api import PyTesseractAPI, create_ocr_api
+from ocr.cache import CachedOCRAPI, OCRCache
 from ocr.preprocessor import OCRPreprocessor
 from ocr.api import TextBox
+from ocr.layout import TextLayout
+from ocr.regions import RegionOCR, change_mask, dirty_rectangles, merge_text_boxes, rectangles_area, scale_rectangles, shift_boxes
+from ocr.text_detector import TextRegionDetector
+from video.change_detector import ChangeDetector, shift_image
+from video.keyframes import KeyframeIndex, load_or_build_keyframe_index
+from video.tracker import TextBoxTracker, tracking_image
+from video.encoder import EncoderSettings, FFmpegVideoWriter, concat_videos
+from video.segments import Segment, plan_segments, run_segments, segment_paths
+from video.live import DEFAULT_MAX_LATENCY_MS, LatestFrameAnalyser, LiveSource, live_output_format
+from video.source import FrameSource
+from video.track import DetectionTrack
+from utils.profiler import ProgressLine, StageProfiler
+from video.pool import OCRWorkerPool, OrderedFrameWriter, QUEUE_FRAMES_PER_WORKER
+from cli_options import analysis_options, encoder_options, frame_options, ocr_backend_options, recognizer_options, tracking_options, verbose_option
 import click
+import dataclasses
+import functools
+import itertools
+import json
 import os
-import numpy as np
+import shutil
+import tempfile
 import time
-import ffmpeg
+import numpy as np
+import utils.logger as logger
 
-start = time.time()
 
-SCALING_FACTOR = 1.0
+PHASES = ['all', 'analyse', 'render']
 
 
 def retrieve_tesseract_path() -> str:
@@ -38,103 +58,236 @@ def retrieve_tesseract_path() -> str:
     type = str, 
     default = 'obfuscated_image.png'
 )
-@click.option('--recognizer', '-r',
-    help = 'Recognizers to register. Default includes all recognizers' , 
+@recognizer_options()
+@frame_options()
+@click.option('--keyframe-index', '-k',
+    help = 'Path of the keyframe index file. It is built with a fast pre-pass if missing or stale, and OCR only runs on its keyframes',
     required = False,
-    multiple = True, 
-    type = click.Choice(["DOB", "DNI", "PHONE", "ADDRESS", "POSTAL_CODE_CITY", "PERSON", "LOCATION", "ORG", "EMAIL"]), 
+    type = str,
     default = None
 )
-@click.option('--exclude-recognizer', '-e', 
-    help = 'Recognizers to exclude. Default includes all recognizers' , 
-    required = False, 
-    multiple = True, 
-    type = click.Choice(["DOB", "DNI", "PHONE", "ADDRESS", "POSTAL_CODE_CITY", "PERSON", "LOCATION", "ORG", "EMAIL"]), 
+@click.option('--index-only',
+    help = 'Only build the keyframe index and print the cost estimate',
+    required = False,
+    is_flag = True,
+    default = False
+)
+@tracking_options()
+@analysis_options()
+@ocr_backend_options()
+@click.option('--workers', '-w',
+    help = 'Number of OCR + analysis worker processes for videos. More than 1 enables the pipelined mode',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 1
+)
+@click.option('--segments',
+    help = 'Split a video into this many segments at keyframes and process each one in its own process, the encoded segments are joined without re-encoding',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 1
+)
+@click.option('--start', 'start_time',
+    help = 'Second of the video to start processing at',
+    required = False,
+    type = click.FloatRange(min = 0),
     default = None
 )
-@click.option('--filter', '-f', 
-    help = 'obfuscate a given word', 
-    required = False, 
-    multiple = True,
-    type = str, 
+@click.option('--end', 'end_time',
+    help = 'Second of the video to stop processing at',
+    required = False,
+    type = click.FloatRange(min = 0),
     default = None
 )
-@click.option('--unfilter', '-u', 
-    help = 'un-obfuscate a given word', 
+@click.option('--stride',
+    help = 'Only analyse every n-th frame, the frames in between reuse the last detections',
     required = False,
-    multiple = True, 
-    type = str, 
+    type = click.IntRange(min = 1),
+    default = 1
+)
+@encoder_options()
+@click.option('--detections',
+    help = 'Path of the detection track of a video (.npz, or .json to review and edit it by hand)',
+    required = False,
+    type = str,
     default = None
 )
-@click.option('--frame-diff-threshold', '-t',
-    help = 'Threshold for frame change percentage',
+@click.option('--phase',
+    help = 'analyse only writes the detection track, render only redacts the video from an existing track, all does both at once',
     required = False,
-    type = int,
-    default = 2
+    type = click.Choice(PHASES),
+    default = 'all'
 )
-@click.option('--verbose', '-v', 
-    help = 'Enable verbose mode for additional logging', 
+@click.option('--live',
+    help = 'Redact a live stream (URL, pipe:0 or camera index) with bounded delay: OCR runs on a background thread on the newest frame and every frame is written with the latest detections',
     required = False,
     is_flag = True,
     default = False
 )
-def main(input, output, recognizer, exclude_recognizer, filter, unfilter, frame_diff_threshold, verbose):
-    # read tesseract path from env
-    tesseract_path = retrieve_tesseract_path()
-    tesseract_api = PyTesseractAPI(tesseract_path = tesseract_path)
-
-    # Initialise image preprocessor
-    image_preprocessor = OCRPreprocessor(scaling_factor=SCALING_FACTOR)
-
-    # Initialize OCR analyser and anonymiser
-    analyser = OCRAnalyser(recognizers=recognizer, excluded_recognizers=exclude_recognizer, filtered_words=filter, unfiltered_words=unfilter)
-    anonymiser = Anonymiser()
+@click.option('--max-latency',
+    help = 'Target end-to-end latency of the live mode in milliseconds, frames written later are counted as late in the report',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = DEFAULT_MAX_LATENCY_MS
+)
+@click.option('--report',
+    help = 'Path of a JSON report with the latency of every stage and the OCR / reuse frame counts',
+    required = False,
+    type = str,
+    default = None
+)
+@verbose_option()
+def main(input, output, recognizer, exclude_recognizer, filter, unfilter, frame_diff_threshold, change_metric, obfuscation_mode, dirty_regions, ocr_scale, text_regions, ocr_threads, keyframe_index, index_only, track, track_confidence, analysis_cache_size, analysis_cache_dir, incremental_analysis, full_nlp_pipeline, ocr_backend, ocr_cache_dir, ocr_cache_size, workers, segments, start_time, end_time, stride, codec, preset, crf, detections, phase, live, max_latency, report, verbose):
+    profiler = StageProfiler()
+    if index_only and (not keyframe_index or live or not input.endswith(('.mp4'))):
+        raise click.UsageError("--index-only builds the keyframe index of a video, it needs -k and an .mp4 input.")
+    if phase != 'all' and not detections:
+        raise click.UsageError(f"--phase {phase} needs the path of the detection track in --detections.")
+    if live and (phase != 'all' or segments > 1 or workers > 1):
+        raise click.UsageError("--live runs in a single process and cannot be combined with --phase, --segments or -w.")
+    if phase != 'all' and not live and not input.endswith(('.mp4')):
+        raise click.UsageError(f"--phase {phase} splits video jobs, images are always processed in one pass.")
+    if workers > 1 and segments == 1 and phase != 'render':
+        # the worker processes OCR every keyframe from scratch, no state crosses keyframes
+        stateful = [name for name, enabled in (('--dirty-regions', dirty_regions), ('--track', track), ('--incremental-analysis', incremental_analysis), ('--ocr-threads', ocr_threads > 1)) if enabled]
+        if stateful:
+            raise click.UsageError(f"-w analyses every keyframe on its own and cannot be combined with {', '.join(stateful)}.")
+
+    # read tesseract path from env (tesserocr links libtesseract and does not need it)
+    tesseract_path = retrieve_tesseract_path() if ocr_backend == 'pytesseract' and phase != 'render' else None
+    analyser_kwargs = dict(recognizers=recognizer, excluded_recognizers=exclude_recognizer, filtered_words=filter, unfiltered_words=unfilter,
+                           cache_size=analysis_cache_size, cache_dir=analysis_cache_dir, trim_pipes=not full_nlp_pipeline)
+    anonymiser = Anonymiser(mode = obfuscation_mode)
+    encoder_settings = EncoderSettings(codec = codec, preset = preset, crf = crf)
+
+    if phase == 'render' and segments == 1:
+        # only decode, redact the rectangles of the detection track and encode, no OCR or analysis
+        render_pipeline(anonymiser, input, output, DetectionTrack.load(detections), encoder_settings, profiler)
+        print(f'time taken: ', profiler.elapsed())
+        if report:
+            profiler.save(report, dict(input = input, output = output, phase = phase))
+        return
+
+    if live:
+        # redact a live stream, OCR and analysis run on a background thread on the newest frame
+        tesseract_api, image_preprocessor, analyser = create_ocr_components(ocr_backend, tesseract_path, ocr_cache_dir, ocr_cache_size, ocr_scale, analyser_kwargs, verbose)
+        tracker = TextBoxTracker(min_confidence=track_confidence) if track else None
+        change_detector = ChangeDetector(frame_diff_threshold, change_metric)
+        text_detector = TextRegionDetector() if text_regions else None
+        live_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, input, output, change_detector, tracker, text_detector, encoder_settings, end_time, max_latency, profiler, verbose)
+        print(f'time taken: ', profiler.elapsed())
+        if report:
+            profiler.save(report, dict(input = input, output = output, live = True, max_latency_ms = max_latency, analysis_cache = analyser.cache_stats(),
+                                       change_detector = change_detector.stats(), ocr_scale = image_preprocessor.scaling_factor))
+        return
+
+    keyframes = None
+    if keyframe_index and input.endswith(('.mp4')):
+        # plan the keyframes with a fast pre-pass, or reuse the stored index
+        with profiler.stage("keyframe_index"):
+            keyframes = load_or_build_keyframe_index(keyframe_index, input, frame_diff_threshold)
+        logger.log("Keyframe index", keyframes.estimate())
+        if index_only:
+            return
+
+    if input.endswith(('.mp4')) and segments > 1:
+        # run segment-parallel video mode, each segment process loads its own OCR engine and analyser
+        settings = dict(input = input, ocr_backend = ocr_backend, tesseract_path = tesseract_path, ocr_cache_dir = ocr_cache_dir, ocr_cache_size = ocr_cache_size,
+                        analyser_kwargs = analyser_kwargs, obfuscation_mode = obfuscation_mode, frame_diff_threshold = frame_diff_threshold, change_metric = change_metric, dirty_regions = dirty_regions, ocr_scale = ocr_scale, text_regions = text_regions, ocr_threads = ocr_threads,
+                        keyframe_index = keyframes, track = track, track_confidence = track_confidence, incremental_analysis = incremental_analysis,
+                        encoder_settings = encoder_settings, stride = stride, detections = detections, phase = phase, verbose = verbose)
+        try:
+            segment_reports = segmented_video_pipeline(settings, output, segments, start_time, end_time, profiler)
+        except RuntimeError as error:
+            print(f"Error: {error}")
+            os._exit(1)
+        print(f'time taken: ', profiler.elapsed())
+        if report:
+            profiler.save(report, dict(input = input, output = output, segments = segment_reports, phase = phase))
+        return
+
+    if input.endswith(('.mp4')) and workers > 1:
+        # run pipelined video mode, each worker process loads its own OCR engine and analyser
+        pool = OCRWorkerPool(workers, ocr_backend, tesseract_path, ocr_scale, analyser_kwargs, verbose, ocr_cache_dir, ocr_cache_size, text_regions)
+        change_detector = ChangeDetector(frame_diff_threshold, change_metric)
+        parallel_video_pipeline(pool, anonymiser, input, output, change_detector, keyframes, encoder_settings, start_time, end_time, stride, profiler, detections, render = phase == 'all')
+        if verbose:
+            logger.log("Change detector", change_detector.stats())
+        print(f'time taken: ', profiler.elapsed())
+        if report:
+            profiler.save(report, dict(input = input, output = output, workers = workers, phase = phase, change_detector = change_detector.stats()))
+        return
+
+    tesseract_api, image_preprocessor, analyser = create_ocr_components(ocr_backend, tesseract_path, ocr_cache_dir, ocr_cache_size, ocr_scale, analyser_kwargs, verbose)
+
+    # Initialise text box tracker
+    tracker = TextBoxTracker(min_confidence=track_confidence) if track else None
+
+    # Initialise the detector of frame changes that need a new OCR
+    change_detector = ChangeDetector(frame_diff_threshold, change_metric)
+
+    # Initialise the detector of the text regions to OCR
+    text_detector = TextRegionDetector() if text_regions else None
 
     if input.endswith(('.jpg', '.jpeg', '.png')):
         # run image pipeline
-        image_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, input, output, verbose)
+        image_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, input, output, profiler, verbose)
     elif input.endswith(('.mp4')):
         # run video pipeline
-        video_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, input, output, frame_diff_threshold, verbose)
-    end = time.time()
-    print(f'time taken: ',end-start)
+        video_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, input, output, change_detector, dirty_regions, keyframes, tracker, incremental_analysis, encoder_settings, start_time, end_time, stride, profiler, verbose,
+                       detections = detections, render = phase == 'all', text_detector = text_detector, ocr_threads = ocr_threads)
+    ocr_cache_stats = tesseract_api.cache.stats() if ocr_cache_dir else None
+    if verbose:
+        logger.log("Analysis cache", analyser.cache_stats())
+        logger.log("Change detector", change_detector.stats())
+        logger.log("OCR scale", dict(scale = image_preprocessor.scaling_factor, text_height = image_preprocessor.text_height))
+        if ocr_cache_stats:
+            logger.log("OCR cache", ocr_cache_stats)
+    print(f'time taken: ', profiler.elapsed())
+    if report:
+        profiler.save(report, dict(input = input, output = output, workers = workers, phase = phase, analysis_cache = analyser.cache_stats(), ocr_cache = ocr_cache_stats,
+                                    change_detector = change_detector.stats(), ocr_scale = image_preprocessor.scaling_factor))
+
+def create_ocr_components(ocr_backend: str, tesseract_path: str, ocr_cache_dir: str, ocr_cache_size: int, ocr_scale: float, analyser_kwargs: dict, verbose: bool) -> tuple[PyTesseractAPI, OCRPreprocessor, OCRAnalyser]:
+    tesseract_api = create_ocr_api(ocr_backend, tesseract_path = tesseract_path)
+    if ocr_cache_dir:
+        # reuse the OCR of frames seen in earlier runs
+        tesseract_api = CachedOCRAPI(tesseract_api, OCRCache(ocr_cache_dir, ocr_cache_size))
+
+    # Initialise image preprocessor
+    image_preprocessor = OCRPreprocessor(scaling_factor=ocr_scale)
+
+    # Initialize OCR analyser
+    analyser = OCRAnalyser(**analyser_kwargs)
+    if verbose:
+        logger.log("NLP load", analyser.load_report)
+    return tesseract_api, image_preprocessor, analyser
 
-def image_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, anonymiser: Anonymiser, input: str, output: str, verbose: bool):
+
+def image_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, anonymiser: Anonymiser, input: str, output: str, profiler: StageProfiler, verbose: bool):
     # read image and extract text
     img = cv2.imread(input)
-    preprocessed_image = image_preprocessor.preprocess_image(img)
+    with profiler.stage("preprocess"):
+        preprocessed_image = image_preprocessor.preprocess_image(img)
 
     # extract text
-    ocr_text, text_boxes = tesseract_api.recognise_text_to_data(img, lang="spa", debug=verbose)
-    # text_boxes = translate_image_scale(text_boxes, SCALING_FACTOR)
-
-    # analyse text
-    sensitive_words = analyser.analyse_text_to_string(ocr_text, "es", debug=verbose)
-    # anonymise image
-    img = anonymiser.anonymise(img, text_boxes, sensitive_words)
+    with profiler.stage("ocr"):
+        _, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+    layout = TextLayout(image_preprocessor.project_boxes(text_boxes))
+
+    # analyse the text lines, the spans found map back to their boxes
+    with profiler.stage("analysis"):
+        spans = analyser.analyse_text_to_spans(layout.text, "es", debug=verbose)
+    # anonymise image, one rectangle per sensitive span and line
+    with profiler.stage("anonymise"):
+        img = anonymiser.anonymise(img, layout.entity_boxes(spans))
+    profiler.count("frames")
+    profiler.count("ocr_frames")
 
     # save image
     cv2.imwrite(output, img)
 
 
-def frame_difference(prev_frame, curr_frame, threshold=30):
-    # Convert frames to grayscale
-    gray_prev = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    gray_curr = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
-    
-    # Compute the absolute difference between the current frame and the previous frame
-    frame_diff = cv2.absdiff(gray_prev, gray_curr)
-    
-    # Threshold the difference
-    _, thresh = cv2.threshold(frame_diff, threshold, 255, cv2.THRESH_BINARY)
-    
-    # Calculate the percentage of changed pixels
-    non_zero_count = np.count_nonzero(thresh)
-    changed_percentage = (non_zero_count * 100) / thresh.size
-    
-    return changed_percentage
-
-
 def apply_obfuscation_to_background(frame, prev_obfuscated_frame, mask):
     # Apply the obfuscation only to the background
     obfuscated_frame = frame.copy()
@@ -142,98 +295,456 @@ def apply_obfuscation_to_background(frame, prev_obfuscated_frame, mask):
     return obfuscated_frame
 
 
-def video_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, anonymiser: Anonymiser, input: str, output: str, frame_diff_threshold: int, verbose: bool):
-    # read video
-    cv2.namedWindow('preview', cv2.WINDOW_NORMAL)
-    cap = cv2.VideoCapture(input)
-
-    # check if video is opened
-    if not cap.isOpened():
+def open_frame_source(input: str, start: float, end: float, stride: int, profiler: StageProfiler) -> FrameSource:
+    try:
+        return FrameSource(input, start = start, end = end, stride = stride, profiler = profiler)
+    except IOError:
         print("Error: Could not open video.")
         os._exit(1)
 
-    # get video properties
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    frame_rate = int(cap.get(5))
-
-    # create video writer
-    tmp_output = "tmp_" + output
-    out = cv2.VideoWriter(tmp_output, cv2.VideoWriter_fourcc(*'mp4v'), frame_rate, (frame_width, frame_height))
-
-    prev_frame = None
-    frame_change_threshold = frame_diff_threshold  # Set the threshold for frame change percentage (antes: 5)
-    previous_text_boxes = None
-    previous_sensitive_words = None
-
-    # Create background subtractor
-    back_sub = cv2.createBackgroundSubtractorMOG2()
 
-    while True:
-        ret, frame = cap.read()
+def video_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, anonymiser: Anonymiser, input: str, output: str, change_detector: ChangeDetector, dirty_regions: bool, keyframe_index: KeyframeIndex, tracker: TextBoxTracker, incremental_analysis: bool, encoder_settings: EncoderSettings, start: float, end: float, stride: int, profiler: StageProfiler, verbose: bool, preview: bool = True, detections: str = None, render: bool = True, audio: bool = True,
+                   text_detector: TextRegionDetector = None, ocr_threads: int = 1):
+    # read video, frames are decoded ahead on a background thread
+    preview = preview and render
+    if preview:
+        cv2.namedWindow('preview', cv2.WINDOW_NORMAL)
+    source = open_frame_source(input, start, end, stride, profiler)
+    progress = ProgressLine(profiler, source.total_frames)
 
-        if frame is None:
-            print("End of video")
-            break
+    # create video writer, encodes the frames and copies the input audio in one pass
+    out = FFmpegVideoWriter(output, input, source.frame_width, source.frame_height, source.frame_rate, encoder_settings, source.start_time, source.duration, audio) if render else None
+    detection_track = DetectionTrack.for_input(input, source.frame_rate, source.frame_width, source.frame_height, start, end) if detections else None
 
-        # Apply background subtraction
-        fg_mask = back_sub.apply(frame)
+    region_ocr = RegionOCR(tesseract_api, ocr_threads)
+    previous_text_boxes = None
+    entity_boxes = []
+    analysed_lines = None
+    ocr_pixels = 0
+    last_ocr_index = -1
+    tracking_lost = False
+    # grayscale frame of the last OCR, the dirty regions are the ones that changed since then
+    ocr_reference = None
+
+    try:
+        for frame_index, frame, analyse in source:
+            # One grayscale conversion of the raw frame, shared by change detection, tracking and OCR preprocessing
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if tracker is not None or analyse else None
+            if tracker is not None:
+                tracking_gray = tracking_image(gray)
+
+            if tracker is not None and last_ocr_index >= 0:
+                # Move the sensitive boxes with the content, OCR again on the next analysed frame once tracking is lost
+                with profiler.stage("tracking"):
+                    tracking_lost = not tracker.update(tracking_gray) or tracking_lost
+
+            if last_ocr_index < 0:
+                # For the first frame, run OCR and Presidio
+                is_keyframe = True
+            elif not analyse:
+                # Frames between two analysed frames reuse the detections
+                is_keyframe = False
+            elif tracking_lost:
+                is_keyframe = True
+            elif keyframe_index is not None:
+                # Keyframes were planned by the index pre-pass, the ones skipped by the stride are OCR'd on the next analysed frame
+                is_keyframe = keyframe_index.keyframe_of(frame_index) > last_ocr_index
+            else:
+                with profiler.stage("frame_difference"):
+                    # content that only scrolled along with the tracked boxes is not a change, what scrolled into view is
+                    is_keyframe = change_detector.check(gray, tracker.displacement() if tracker is not None else None)
 
-        if prev_frame is not None:
-            change_percentage = frame_difference(prev_frame, frame)
-            if change_percentage < frame_change_threshold:
-                frame = anonymiser.anonymise(frame, previous_text_boxes, previous_sensitive_words)
+            if not is_keyframe:
+                profiler.count("reuse_frames")
             else:
                 # If change is significant, run OCR and Presidio
-                preprocessed_image = image_preprocessor.preprocess_image(frame)
-                ocr_text, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
-                sensitive_words = analyser.analyse_text_to_string(ocr_text, "es", debug=verbose)
-                frame = anonymiser.anonymise(frame, text_boxes, sensitive_words)
+                profiler.count("ocr_frames")
+                if gray is None:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                with profiler.stage("preprocess"):
+                    preprocessed_image = image_preprocessor.preprocess_image(gray)
+                rectangles = None
+                if dirty_regions and previous_text_boxes is not None:
+                    # the cached boxes and the last OCR'd frame move along with the tracked content,
+                    # what scrolled into view and what moved differently are the dirty regions
+                    shift = tracker.displacement() if tracker is not None else (0, 0)
+                    with profiler.stage("change_mask"):
+                        cached_boxes = shift_boxes(previous_text_boxes, shift, gray.shape)
+                        rectangles = dirty_rectangles(change_mask(shift_image(ocr_reference, shift), gray), cached_boxes)
+                text_rectangles = None
+                if rectangles is None and text_detector is not None:
+                    with profiler.stage("text_detection"):
+                        text_rectangles = text_detector.detect(preprocessed_image)
+                with profiler.stage("ocr"):
+                    if rectangles is not None:
+                        # Only OCR the regions that changed and keep the cached boxes everywhere else
+                        scaled_rectangles = scale_rectangles(rectangles, image_preprocessor.scaling_factor)
+                        _, region_boxes = region_ocr.recognise(preprocessed_image, scaled_rectangles, lang="spa", debug=verbose)
+                        text_boxes = merge_text_boxes(cached_boxes, image_preprocessor.project_boxes(region_boxes), rectangles)
+                        ocr_pixels += rectangles_area(scaled_rectangles)
+                    elif text_rectangles is not None:
+                        # Only OCR the text regions, the boxes are mapped back to frame coordinates
+                        _, text_boxes = region_ocr.recognise(preprocessed_image, text_rectangles, lang="spa", debug=verbose)
+                        text_boxes = image_preprocessor.project_boxes(text_boxes)
+                        ocr_pixels += rectangles_area(text_rectangles)
+                    else:
+                        _, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+                        # boxes are found at the OCR scale, redaction and tracking work on the full frame
+                        text_boxes = image_preprocessor.project_boxes(text_boxes)
+                        ocr_pixels += preprocessed_image.shape[0] * preprocessed_image.shape[1]
+
+                # the analysis runs on the text lines, its spans map back to one box per line
+                layout = TextLayout(text_boxes)
+                with profiler.stage("analysis"):
+                    if incremental_analysis:
+                        # Only analyse again the lines that changed since the last OCR
+                        spans, analysed_lines = analyser.analyse_lines_to_spans(layout.line_texts, "es", analysed_lines, debug=verbose)
+                    else:
+                        spans = analyser.analyse_text_to_spans(layout.text, "es", debug=verbose)
+                entity_boxes = layout.entity_boxes(spans)
                 previous_text_boxes = text_boxes
-                previous_sensitive_words = sensitive_words
+                ocr_reference = gray
+                last_ocr_index = frame_index
+                # later frames are compared with the raw frame that was OCR'd
+                change_detector.set_reference(gray)
+                if tracker is not None:
+                    tracker.reset(tracking_gray, [text_box for text_box, _ in entity_boxes])
+                    tracking_lost = False
+
+            with profiler.stage("anonymise"):
+                # the tracker keeps the boxes in the order of the entities
+                frame_boxes = list(zip(tracker.text_boxes, [entity for _, entity in entity_boxes])) if tracker is not None else entity_boxes
+                rectangles = anonymiser.entity_rectangles(frame.shape, frame_boxes)
+                if render:
+                    frame = anonymiser.redact(frame, [rectangle for rectangle, _ in rectangles])
+            if detection_track is not None:
+                detection_track.add(frame_index, [(*rectangle, entity) for rectangle, entity in rectangles])
+
+            if preview:
+                cv2.imshow("preview", frame)
+
+                # Wait for a key event for 1 ms
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            # write frame to video
+            if out is not None:
+                with profiler.stage("encode"):
+                    out.write(frame)
+            profiler.count("frames")
+            progress.update()
         else:
-            # For the first frame, run OCR and Presidio
-            preprocessed_image = image_preprocessor.preprocess_image(frame)
-            ocr_text, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
-            sensitive_words = analyser.analyse_text_to_string(ocr_text, "es", debug=verbose)
-            frame = anonymiser.anonymise(frame, text_boxes, sensitive_words)
-            previous_text_boxes = text_boxes
-            previous_sensitive_words = sensitive_words
-
-        prev_frame = frame.copy()
-
-        cv2.imshow("preview", frame)
-
-        # Wait for a key event for 1 ms
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-        # write frame to video
-        out.write(frame)
-
-    # release video capture and writer
-    cap.release()
-    out.release()
-
-    input_video = ffmpeg.input(tmp_output)
-    input_audio = ffmpeg.input(input)
-
-    ffmpeg.concat(input_video, input_audio, v=1, a=1).output(output).overwrite_output().run()
+            print("End of video")
+    except BaseException:
+        # stop ffmpeg instead of finishing a truncated output
+        if out is not None:
+            out.abort()
+        raise
+    finally:
+        # release the decode thread and the OCR threads, also when a frame failed
+        source.close()
+        region_ocr.close()
+
+    # ffmpeg finishes encoding and muxes the audio
+    if out is not None:
+        with profiler.stage("mux"):
+            out.release()
+    if detection_track is not None:
+        detection_track.save(detections)
+
+    profiler.count("ocr_pixels", ocr_pixels)
+    if verbose:
+        logger.log("OCR pixels", ocr_pixels)
 
-    # remove temporary file
-    os.remove(tmp_output)
 
     # close all windows
-    cv2.destroyAllWindows()
+    if preview:
+        cv2.destroyAllWindows()
+
+def parallel_video_pipeline(pool: OCRWorkerPool, anonymiser: Anonymiser, input: str, output: str, change_detector: ChangeDetector, keyframe_index: KeyframeIndex, encoder_settings: EncoderSettings, start: float, end: float, stride: int, profiler: StageProfiler, detections: str = None, render: bool = True):
+    # read video, frames are decoded ahead on a background thread
+    source = open_frame_source(input, start, end, stride, profiler)
+    progress = ProgressLine(profiler, source.total_frames)
+
+    # create video writer, encodes the frames and copies the input audio in one pass
+    out = FFmpegVideoWriter(output, input, source.frame_width, source.frame_height, source.frame_rate, encoder_settings, source.start_time, source.duration) if render else None
+    detection_track = DetectionTrack.for_input(input, source.frame_rate, source.frame_width, source.frame_height, start, end) if detections else None
+    # the writer gets the frames in order, from the first one of the source
+    frame_indexes = itertools.count(source.start_frame)
+
+    def write_frame(frame, entity_boxes):
+        frame_index = next(frame_indexes)
+        with profiler.stage("anonymise"):
+            rectangles = anonymiser.entity_rectangles(frame.shape, entity_boxes)
+            if render:
+                frame = anonymiser.redact(frame, [rectangle for rectangle, _ in rectangles])
+        if detection_track is not None:
+            detection_track.add(frame_index, [(*rectangle, entity) for rectangle, entity in rectangles])
+        if out is not None:
+            with profiler.stage("encode"):
+                out.write(frame)
+
+    # writer stage, puts frames back in order and caps the number of frames in flight
+    writer = OrderedFrameWriter(write_frame, max_pending = pool.workers * QUEUE_FRAMES_PER_WORKER, profiler = profiler)
+
+    frame_detections = None
+    last_ocr_index = -1
+    try:
+        with pool:
+            # decode stage
+            for frame_index, frame, analyse in source:
+                # Keyframes go to the OCR workers, the other frames reuse the detections of their keyframe
+                # the change detector keeps its own small copy of the raw frames, the writer anonymises frames in place
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if analyse and keyframe_index is None else None
+                if last_ocr_index < 0:
+                    is_keyframe = True
+                elif not analyse:
+                    is_keyframe = False
+                elif keyframe_index is not None:
+                    is_keyframe = keyframe_index.keyframe_of(frame_index) > last_ocr_index
+                else:
+                    with profiler.stage("frame_difference"):
+                        is_keyframe = change_detector.check(gray)
+                if is_keyframe:
+                    frame_detections = pool.submit(frame)
+                    last_ocr_index = frame_index
+                    if gray is not None:
+                        change_detector.set_reference(gray)
+                profiler.count("ocr_frames" if is_keyframe else "reuse_frames")
+
+                writer.put(frame, frame_detections)
+                profiler.count("frames")
+                progress.update()
+            else:
+                print("End of video")
+
+            writer.close()
+    except BaseException:
+        # the writer stops waiting for the terminated workers, ffmpeg is stopped
+        writer.abort()
+        if out is not None:
+            out.abort()
+        raise
+    finally:
+        source.close()
+
+    # ffmpeg finishes encoding and muxes the audio
+    if out is not None:
+        with profiler.stage("mux"):
+            out.release()
+    if detection_track is not None:
+        detection_track.save(detections)
+
+
+def render_pipeline(anonymiser: Anonymiser, input: str, output: str, detection_track: DetectionTrack, encoder_settings: EncoderSettings, profiler: StageProfiler,
+                    start: float = None, end: float = None, audio: bool = True):
+    # read the part of the video the track was analysed on, or the given part of it
+    start = detection_track.start_time if start is None else start
+    end = detection_track.end_time if end is None else end
+    source = open_frame_source(input, start, end, 1, profiler)
+    if (source.frame_width, source.frame_height) != (detection_track.frame_width, detection_track.frame_height):
+        print("Error: The detection track was built for a video of another size.")
+        os._exit(1)
+    progress = ProgressLine(profiler, source.total_frames)
+
+    # create video writer, encodes the frames and copies the input audio in one pass
+    out = FFmpegVideoWriter(output, input, source.frame_width, source.frame_height, source.frame_rate, encoder_settings, source.start_time, source.duration, audio)
+
+    try:
+        for frame_index, frame, _ in source:
+            with profiler.stage("anonymise"):
+                frame = anonymiser.redact(frame, detection_track.rectangles_at(frame_index))
+            with profiler.stage("encode"):
+                out.write(frame)
+            profiler.count("frames")
+            progress.update()
+        else:
+            print("End of video")
+    except BaseException:
+        out.abort()
+        raise
+    finally:
+        source.close()
+
+    # ffmpeg finishes encoding and muxes the audio
+    with profiler.stage("mux"):
+        out.release()
+
+
+def analyse_live_frame(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, text_detector: TextRegionDetector, region_ocr: RegionOCR, profiler: StageProfiler, verbose: bool,
+                       gray: np.ndarray) -> list[tuple[TextBox, str]]:
+    # runs on the analysis thread of the live mode
+    with profiler.stage("preprocess"):
+        preprocessed_image = image_preprocessor.preprocess_image(gray)
+    text_rectangles = None
+    if text_detector is not None:
+        with profiler.stage("text_detection"):
+            text_rectangles = text_detector.detect(preprocessed_image)
+    with profiler.stage("ocr"):
+        if text_rectangles is not None:
+            _, text_boxes = region_ocr.recognise(preprocessed_image, text_rectangles, lang="spa", debug=verbose)
+        else:
+            _, text_boxes = tesseract_api.recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+    layout = TextLayout(image_preprocessor.project_boxes(text_boxes))
+    with profiler.stage("analysis"):
+        spans = analyser.analyse_text_to_spans(layout.text, "es", debug=verbose)
+    return layout.entity_boxes(spans)
+
+
+def live_pipeline(image_preprocessor: OCRPreprocessor, tesseract_api: PyTesseractAPI, analyser: OCRAnalyser, anonymiser: Anonymiser, input: str, output: str, change_detector: ChangeDetector, tracker: TextBoxTracker, text_detector: TextRegionDetector,
+                  encoder_settings: EncoderSettings, duration: float, max_latency: int, profiler: StageProfiler, verbose: bool):
+    try:
+        source = LiveSource(input)
+    except IOError:
+        print("Error: Could not open stream.")
+        os._exit(1)
 
-def translate_image_scale(text_boxes: list[TextBox], scaling_factor: float) -> list[TextBox]:
-    for text_box in text_boxes:
-        text_box.x = int(text_box.x / scaling_factor)
-        text_box.y = int(text_box.y / scaling_factor)
-        text_box.w = int(text_box.w / scaling_factor)
-        text_box.h = int(text_box.h / scaling_factor)
-    return text_boxes
+    # the encoder must not buffer frames, the output is only as late as the slowest frame
+    out = FFmpegVideoWriter(output, input, source.frame_width, source.frame_height, source.frame_rate, dataclasses.replace(encoder_settings, tune = "zerolatency"),
+                            audio = False, format = live_output_format(output))
+    region_ocr = RegionOCR(tesseract_api, 1)
+    live_analyser = LatestFrameAnalyser(functools.partial(analyse_live_frame, image_preprocessor, tesseract_api, analyser, text_detector, region_ocr, profiler, verbose), profiler)
+    progress = ProgressLine(profiler, 0)
+
+    version = 0
+    entity_boxes = []
+    try:
+        for live_frame in source:
+            frame = live_frame.frame
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            # the newest changed frame replaces the one waiting for OCR, the output never waits for it
+            tracking_lost = tracker is not None and version > 0 and not tracker.update(gray)
+            with profiler.stage("frame_difference"):
+                changed = change_detector.check(gray)
+            if changed or tracking_lost:
+                live_analyser.submit(live_frame.index, gray, live_frame.captured)
+                change_detector.set_reference()
+            if version == 0:
+                # no frame leaves unredacted: the stream starts once the first frame is analysed
+                if live_analyser.wait() is None:
+                    print("Error: The first frame of the stream could not be analysed.")
+                    break
+
+            detections = live_analyser.latest
+            if detections.version != version:
+                version = detections.version
+                entity_boxes = detections.entity_boxes
+                if tracker is not None:
+                    # templates come from the analysed frame, then the boxes catch up with the current one
+                    tracker.reset(detections.gray, [text_box for text_box, _ in entity_boxes])
+                    tracker.update(gray)
+            frame_boxes = list(zip(tracker.text_boxes, [entity for _, entity in entity_boxes])) if tracker is not None else entity_boxes
+
+            with profiler.stage("anonymise"):
+                rectangles = anonymiser.entity_rectangles(frame.shape, frame_boxes)
+                frame = anonymiser.redact(frame, [rectangle for rectangle, _ in rectangles])
+            with profiler.stage("encode"):
+                out.write(frame)
+
+            # end-to-end latency of the frame, and how old the detections applied to it are
+            now = time.perf_counter()
+            latency = now - live_frame.captured
+            profiler.record("latency", latency)
+            profiler.record("detection_age", now - detections.captured)
+            if latency * 1000 > max_latency:
+                profiler.count("late_frames")
+            profiler.count("frames")
+            progress.update()
+            if duration is not None and live_frame.index + 1 >= duration * source.frame_rate:
+                break
+        else:
+            print("End of stream")
+    except KeyboardInterrupt:
+        print("Stream stopped")
+    finally:
+        live_analyser.close()
+        source.close()
+        region_ocr.close()
+        with profiler.stage("mux"):
+            out.release()
+
+    latency = profiler.report()["stages"].get("latency")
+    if latency is not None:
+        counters = profiler.counters
+        logger.log("Live latency", dict(p50_ms = latency["p50_ms"], p95_ms = latency["p95_ms"], p99_ms = latency["p99_ms"], late_frames = counters["late_frames"],
+                                        frames = counters["frames"], ocr_frames = counters["ocr_frames"], dropped_analysis_frames = counters["dropped_analysis_frames"]))
+
+
+def segmented_video_pipeline(settings: dict, output: str, segments: int, start: float, end: float, profiler: StageProfiler) -> list[dict]:
+    # plan the segments on the part of the video being processed, at keyframes when there is an index
+    input = settings["input"]
+    if settings["phase"] == 'render':
+        detection_track = DetectionTrack.load(settings["detections"])
+        start, end = detection_track.start_time, detection_track.end_time
+    source = open_frame_source(input, start, end, 1, profiler)
+    frame_rate, frame_width, frame_height = source.frame_rate, source.frame_width, source.frame_height
+    start_frame, end_frame = source.start_frame, source.end_frame
+    last_frame = source.frame_count if end_frame is None else min(end_frame, source.frame_count)
+    source.close()
+    settings = dict(settings, frame_rate = frame_rate)
+    ranges = plan_segments(start_frame, last_frame, segments, settings["keyframe_index"])
+
+    render = settings["phase"] != 'analyse'
+    write_detections = settings["detections"] and settings["phase"] != 'render'
+    directory = tempfile.mkdtemp(prefix = ".segments-", dir = os.path.dirname(os.path.abspath(output)))
+    try:
+        jobs = []
+        for i, (segment_start, segment_end) in enumerate(ranges):
+            paths = segment_paths(directory, i)
+            # the cached frame count can be short, the last segment runs to the end of the video
+            if i == len(ranges) - 1 and end_frame is None:
+                segment_end = None
+            jobs.append(Segment(i, segment_start, segment_end, paths["output"] if render else None, paths["detections"] if write_detections else None, paths["report"]))
+        logger.log("Segments", [(segment.start_frame, segment.end_frame) for segment in jobs])
+
+        with profiler.stage("segments"):
+            run_segments(functools.partial(process_segment, settings), jobs, len(jobs))
+
+        segment_reports = []
+        for segment in jobs:
+            with open(segment.report) as report_file:
+                segment_reports.append(json.load(report_file))
+            for name, n in segment_reports[-1]["counters"].items():
+                profiler.count(name, n)
+
+        if render:
+            # join the segments without re-encoding them and add the audio back
+            with profiler.stage("concat"):
+                concat_videos([segment.output for segment in jobs], output, input, start_frame / frame_rate, None if end_frame is None else (end_frame - start_frame) / frame_rate)
+        if write_detections:
+            detection_track = DetectionTrack.for_input(input, frame_rate, frame_width, frame_height, start, end)
+            for segment in jobs:
+                detection_track.ranges.extend(DetectionTrack.load(segment.detections).ranges)
+            detection_track.save(settings["detections"])
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    return segment_reports
+
+
+def process_segment(settings: dict, segment: Segment):
+    # runs in its own process, the first frame of the segment is always OCR'd as no state crosses segments
+    profiler = StageProfiler()
+    frame_rate = settings["frame_rate"]
+    start = segment.start_frame / frame_rate
+    end = None if segment.end_frame is None else segment.end_frame / frame_rate
+    anonymiser = Anonymiser(mode = settings["obfuscation_mode"])
+    if settings["phase"] == 'render':
+        render_pipeline(anonymiser, settings["input"], segment.output, DetectionTrack.load(settings["detections"]), settings["encoder_settings"], profiler, start, end, audio = False)
+    else:
+        tesseract_api, image_preprocessor, analyser = create_ocr_components(settings["ocr_backend"], settings["tesseract_path"], settings["ocr_cache_dir"], settings["ocr_cache_size"], settings["ocr_scale"],
+                                                                            settings["analyser_kwargs"], settings["verbose"])
+        tracker = TextBoxTracker(min_confidence=settings["track_confidence"]) if settings["track"] else None
+        change_detector = ChangeDetector(settings["frame_diff_threshold"], settings["change_metric"])
+        video_pipeline(image_preprocessor, tesseract_api, analyser, anonymiser, settings["input"], segment.output, change_detector, settings["dirty_regions"],
+                       settings["keyframe_index"], tracker, settings["incremental_analysis"], settings["encoder_settings"], start, end, settings["stride"], profiler, settings["verbose"],
+                       preview = False, detections = segment.detections, render = segment.output is not None, audio = False,
+                       text_detector = TextRegionDetector() if settings["text_regions"] else None, ocr_threads = settings["ocr_threads"])
+    metadata = dict(segment = segment.index, start_frame = segment.start_frame, end_frame = segment.end_frame)
+    if settings["phase"] != 'render':
+        metadata["change_detector"] = change_detector.stats()
+    profiler.save(segment.report, metadata)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
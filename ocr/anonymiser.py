@@ -1,20 +1,76 @@
 import numpy as np
 import cv2
 from ocr.api import TextBox
+from ocr.regions import merge_rectangles, rectangles_overlap
+
+OBFUSCATION_MODES = ["blur", "pixelate", "fill"]
+
+BLUR_KERNEL = (15, 15)
+BLUR_SIGMA = 30
+
+# Side in pixels of the blocks of the pixelate mode
+PIXEL_SIZE = 12
+
+# BGR colour of the fill mode
+FILL_COLOR = (0, 0, 0)
 
 class Anonymiser:
-    def anonymise(self, image: np.array, text_boxes: list[TextBox], sensitive_words: list[str], margin: int = 10) -> np.array:
-        for text_box in text_boxes:
-            if any(sensitive_word in text_box.text for sensitive_word in sensitive_words):
-                # Calculate the new coordinates with margin
-                x1 = max(text_box.x - margin, 0)
-                y1 = max(text_box.y - margin, 0)
-                x2 = min(text_box.x + text_box.w + margin, image.shape[1])
-                y2 = min(text_box.y + text_box.h + margin, image.shape[0])
-
-                # Extract the region of interest (ROI) with the margin
-                roi = image[y1:y2, x1:x2]
-                blurred_roi = cv2.GaussianBlur(roi, (15, 15), 30)
-                image[y1:y2, x1:x2] = blurred_roi
-        
-        return image
\ No newline at end of file
+    def __init__(self, mode: str = "blur", pixel_size: int = PIXEL_SIZE, fill_color: tuple[int, int, int] = FILL_COLOR):
+        if mode not in OBFUSCATION_MODES:
+            raise ValueError(f"Unknown obfuscation mode: {mode}")
+        self.mode = mode
+        self.pixel_size = pixel_size
+        self.fill_color = fill_color
+
+    def entity_rectangles(self, image_shape: tuple, entity_boxes: list[tuple[TextBox, str]], margin: int = 10) -> list[tuple[tuple[int, int, int, int], str]]:
+        '''
+        (x, y, w, h) rectangles to redact around the boxes of the sensitive spans, with their label
+        '''
+        rectangles = []
+        for text_box, label in entity_boxes:
+            # Calculate the new coordinates with margin
+            x1 = max(text_box.x - margin, 0)
+            y1 = max(text_box.y - margin, 0)
+            x2 = min(text_box.x + text_box.w + margin, image_shape[1])
+            y2 = min(text_box.y + text_box.h + margin, image_shape[0])
+            if x2 > x1 and y2 > y1:
+                rectangles.append(((x1, y1, x2 - x1, y2 - y1), label))
+        return rectangles
+
+    def anonymise(self, image: np.array, entity_boxes: list[tuple[TextBox, str]], margin: int = 10) -> np.array:
+        rectangles = self.entity_rectangles(image.shape, entity_boxes, margin)
+        return self.redact(image, [rectangle for rectangle, _ in rectangles])
+
+    def redact(self, image: np.array, rectangles: list[tuple[int, int, int, int]]) -> np.array:
+        '''
+        Obfuscate the union of the (x, y, w, h) rectangles in place.
+        Overlapping rectangles are obfuscated once, through a mask over their common region
+        '''
+        if self.mode == "fill":
+            for x, y, w, h in rectangles:
+                cv2.rectangle(image, (x, y), (x + w - 1, y + h - 1), self.fill_color, thickness=cv2.FILLED)
+            return image
+
+        for gx, gy, gw, gh in merge_rectangles(rectangles):
+            # Extract the region of interest (ROI) covering the overlapping rectangles
+            roi = image[gy:gy+gh, gx:gx+gw]
+            obfuscated = self._obfuscate(roi)
+
+            members = [rect for rect in rectangles if rectangles_overlap(rect, (gx, gy, gw, gh))]
+            if len(members) == 1:
+                roi[...] = obfuscated
+                continue
+
+            mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+            for x, y, w, h in members:
+                mask[y-gy:y-gy+h, x-gx:x-gx+w] = 255
+            cv2.copyTo(obfuscated, mask, roi)
+
+        return image
+
+    def _obfuscate(self, roi: np.array) -> np.array:
+        if self.mode == "pixelate":
+            h, w = roi.shape[:2]
+            small = cv2.resize(roi, (max(w // self.pixel_size, 1), max(h // self.pixel_size, 1)), interpolation=cv2.INTER_AREA)
+            return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+        return cv2.GaussianBlur(roi, BLUR_KERNEL, BLUR_SIGMA)
@@ -1,23 +1,48 @@
-from dataclasses import dataclass
 import pytesseract
 import numpy as np
 import utils.logger as logger
+from ocr.layout import WORD_LEVEL, TextBox, TextLayout
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 TESSERACT_CONFIG = r'--oem 3 --psm 6 -l spa'
 
-@dataclass
-class TextBox:
-    text: str
-    x: int
-    y: int
-    w: int
-    h: int
+OCR_BACKENDS = ["pytesseract", "tesserocr"]
+
+TSV_COLUMNS = ["level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text"]
 
-    def __str__(self):
-        return f"Text: {self.text}, x: {self.x}, y: {self.y}, w: {self.w}, h: {self.h}"
 
-    def __repr__(self):
-        return self.__str__()
+def text_boxes_from_data(data: dict) -> tuple[str, list[TextBox]]:
+    '''
+    Build the text and the word boxes from an image_to_data dictionary.
+    Only the words are kept, the text has one line per Tesseract line
+    '''
+    text_boxes = []
+    for i in range(len(data['level'])):
+        text = str(data['text'][i]).strip()
+        if int(data['level'][i]) != WORD_LEVEL or not text:
+            continue
+        text_boxes.append(
+            TextBox(
+                text,
+                data['left'][i],
+                data['top'][i],
+                data['width'][i],
+                data['height'][i],
+                data['block_num'][i],
+                data['par_num'][i],
+                data['line_num'][i],
+                float(data['conf'][i]),
+                data['level'][i]
+            )
+        )
+
+    full_text = TextLayout(text_boxes).text
+    return full_text, text_boxes
 
 
 class PyTesseractAPI:
@@ -29,27 +54,127 @@ class PyTesseractAPI:
         full_text = pytesseract.image_to_string(image, lang=lang, config=self.config)
         if debug:
             logger.log("OCR text", full_text)
-        
+
         return full_text
-    
+
     def recognise_text_to_data(self, image: np.ndarray, lang: str = "spa", debug: bool = False) -> tuple[str, list[TextBox]]:
         data =  pytesseract.image_to_data(image, lang=lang, config=self.config, output_type=pytesseract.Output.DICT)
 
-        full_text = ' '.join(data['text'])
+        full_text, text_boxes = text_boxes_from_data(data)
         if debug:
             logger.log("OCR text", full_text)
 
-        text_boxes = []
-        for i in range(len(data['level'])):
-            text_boxes.append(
-                TextBox(
-                    data['text'][i], 
-                    data['left'][i], 
-                    data['top'][i], 
-                    data['width'][i], 
-                    data['height'][i]
-                )
-            )
+        return full_text, text_boxes
+
+    def clone(self) -> "PyTesseractAPI":
+        '''
+        Instance for another thread, pytesseract runs a tesseract process per call so it is shared
+        '''
+        return self
+
+
+class TesserocrAPI(PyTesseractAPI):
+    '''
+    In-process OCR backend that keeps a warm Tesseract engine in memory.
+
+    Frames are handed to Tesseract as raw numpy buffers, so there is no temporary
+    image file, subprocess or traineddata reload per call. The engine is not
+    thread-safe: create one instance per worker.
+    '''
+    def __init__(self, tesseract_path: str = None, config: str = TESSERACT_CONFIG, tessdata_path: str = None):
+        if tesserocr is None:
+            raise ImportError("The tesserocr backend requires the tesserocr package: pip install tesserocr")
+
+        self.config = config
+        self.tessdata_path = tessdata_path
+        self._lang, self._oem, self._psm, self._variables = self._parse_config(config)
+        self._api = None
+
+    def _parse_config(self, config: str) -> tuple[str, int, int, dict[str, str]]:
+        '''
+        Translate a tesseract command line config into engine parameters
+        '''
+        lang, oem, psm, variables = "eng", tesserocr.OEM.DEFAULT, tesserocr.PSM.AUTO, {}
+        tokens = config.split()
+        for token, value in zip(tokens, tokens[1:]):
+            if token == "-l":
+                lang = value
+            elif token == "--oem":
+                oem = int(value)
+            elif token == "--psm":
+                psm = int(value)
+            elif token == "-c" and "=" in value:
+                name, variable = value.split("=", 1)
+                variables[name] = variable
+        return lang, oem, psm, variables
+
+    def _engine(self, lang: str):
+        '''
+        Return the warm engine, initialising it again only when the language changes
+        '''
+        if self._api is None or lang != self._lang:
+            if self._api is not None:
+                self._api.End()
+            kwargs = {"lang": lang, "oem": self._oem, "psm": self._psm}
+            if self.tessdata_path:
+                kwargs["path"] = self.tessdata_path
+            self._api = tesserocr.PyTessBaseAPI(**kwargs)
+            for name, value in self._variables.items():
+                self._api.SetVariable(name, value)
+            self._lang = lang
+        return self._api
+
+    def _set_image(self, image: np.ndarray, lang: str):
+        '''
+        Hand the numpy buffer straight to the engine
+        '''
+        api = self._engine(lang)
+        image = np.ascontiguousarray(image)
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        api.SetImageBytes(image.tobytes(), image.shape[1], image.shape[0], bytes_per_pixel, image.shape[1] * bytes_per_pixel)
+        return api
+
+    def recognize_text(self, image: np.ndarray, lang: str = "spa", debug : bool = False) -> str:
+        full_text = self._set_image(image, lang).GetUTF8Text()
+        if debug:
+            logger.log("OCR text", full_text)
+
+        return full_text
+
+    def recognise_text_to_data(self, image: np.ndarray, lang: str = "spa", debug: bool = False) -> tuple[str, list[TextBox]]:
+        tsv = self._set_image(image, lang).GetTSVText(0)
+
+        # Same columns image_to_data parses from the tesseract tsv output
+        data = {column: [] for column in TSV_COLUMNS}
+        for row in tsv.splitlines():
+            values = row.split('\t', len(TSV_COLUMNS) - 1)
+            if len(values) < len(TSV_COLUMNS):
+                continue
+            for column, value in zip(TSV_COLUMNS[:-1], values[:-1]):
+                data[column].append(float(value) if column == "conf" else int(value))
+            data['text'].append(values[-1])
+
+        full_text, text_boxes = text_boxes_from_data(data)
+        if debug:
+            logger.log("OCR text", full_text)
 
         return full_text, text_boxes
-    
\ No newline at end of file
+
+    def clone(self) -> "TesserocrAPI":
+        '''
+        Instance with its own engine for another thread, the engine releases the GIL while recognising
+        '''
+        return TesserocrAPI(config=self.config, tessdata_path=self.tessdata_path)
+
+    def __del__(self):
+        if getattr(self, "_api", None) is not None:
+            self._api.End()
+
+
+def create_ocr_api(backend: str = "pytesseract", tesseract_path: str = None, config: str = TESSERACT_CONFIG) -> PyTesseractAPI:
+    '''
+    Instantiate the OCR backend with the given name
+    '''
+    if backend == "tesserocr":
+        return TesserocrAPI(tesseract_path=tesseract_path, config=config)
+    return PyTesseractAPI(tesseract_path=tesseract_path, config=config)
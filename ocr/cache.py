@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+from typing import Any
+
+import numpy as np
+
+import utils.logger as logger
+from ocr.api import PyTesseractAPI, TextBox
+
+DEFAULT_OCR_CACHE_MB = 512
+
+OCR_CACHE_FILE = "ocr_cache.sqlite"
+
+# Version of the stored results, results of older versions are never read back
+OCR_RESULT_VERSION = 2
+
+
+class OCRCache:
+    '''
+    On-disk LRU cache of OCR results keyed by the content of the OCR'd image.
+
+    Results live in a sqlite database inside cache_dir, so they are shared by
+    the runs (and worker processes) that use the same directory. Once the stored
+    results go over max_size_mb the least recently used ones are evicted.
+    The threads that OCR the regions of a frame share one cache.
+    '''
+    def __init__(self, cache_dir: str, max_size_mb: int = DEFAULT_OCR_CACHE_MB):
+        self.max_bytes = max_size_mb * 2 ** 20
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, OCR_CACHE_FILE), timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+        self._bytes = self._stored_bytes()
+
+    @staticmethod
+    def make_key(image: np.ndarray, *parts: Any) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([image.shape, str(image.dtype), *parts]).encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        text = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)", (key, text, len(text), time.time()))
+            self._bytes += len(text)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _stored_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def _evict(self):
+        # other processes may share the database, start from the real size
+        self._bytes = self._stored_bytes()
+        excess = self._bytes - self.max_bytes
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+            self._bytes -= size
+        self._db.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0],
+            "size_mb": round(self._bytes / 2 ** 20, 2),
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedOCRAPI:
+    '''
+    OCR backend wrapper that reuses the results of images OCR'd before.
+
+    The key covers the image pixels, the backend, its Tesseract config and the
+    language, so re-running a video with other analysis settings skips the OCR.
+    '''
+    def __init__(self, ocr_api: PyTesseractAPI, cache: OCRCache):
+        self.ocr_api = ocr_api
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.ocr_api, name)
+
+    def clone(self) -> "CachedOCRAPI":
+        return CachedOCRAPI(self.ocr_api.clone(), self.cache)
+
+    def recognise_text_to_data(self, image: np.ndarray, lang: str = "spa", debug: bool = False) -> tuple[str, list[TextBox]]:
+        key = self.cache.make_key(image, type(self.ocr_api).__name__, self.ocr_api.config, lang, OCR_RESULT_VERSION)
+        value = self.cache.get(key)
+        if value is not None:
+            full_text = value["text"]
+            if debug:
+                logger.log("OCR text", full_text)
+            return full_text, [TextBox(**text_box) for text_box in value["boxes"]]
+
+        full_text, text_boxes = self.ocr_api.recognise_text_to_data(image, lang=lang, debug=debug)
+        self.cache.put(key, {"text": full_text, "boxes": [asdict(text_box) for text_box in text_boxes]})
+        return full_text, text_boxes
@@ -0,0 +1,125 @@
+import bisect
+from dataclasses import dataclass
+
+# level of the word rows of image_to_data, the page, block, paragraph and line rows have no text
+WORD_LEVEL = 5
+
+@dataclass
+class TextBox:
+    text: str
+    x: int
+    y: int
+    w: int
+    h: int
+    block_num: int = 0
+    par_num: int = 0
+    line_num: int = 0
+    # recognition confidence of the word, -1 when Tesseract gives none
+    conf: float = -1.0
+    level: int = WORD_LEVEL
+
+    def __str__(self):
+        return f"Text: {self.text}, x: {self.x}, y: {self.y}, w: {self.w}, h: {self.h}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+@dataclass
+class TextLine:
+    text: str
+    # character offset of the line in the layout text
+    start: int
+    text_boxes: list[TextBox]
+
+
+class TextLayout:
+    '''
+    Word boxes of an OCR result grouped into the lines Tesseract found them on.
+
+    text holds one line per row, words joined with a single space, and the
+    character offsets of every word are kept so a span of text (an entity found
+    by the analyser) maps straight back to the boxes it covers.
+    '''
+    def __init__(self, text_boxes: list[TextBox]):
+        self.lines = []
+        self._word_starts = []
+        self._word_ends = []
+        self._word_lines = []
+        self._word_boxes = []
+
+        current_key = None
+        offset = 0
+        for text_box in text_boxes:
+            word = text_box.text.strip()
+            if not word:
+                continue
+            key = line_key(text_box)
+            if key != current_key:
+                # lines are separated by '\n'
+                offset += 1 if self.lines else 0
+                self.lines.append(TextLine("", offset, []))
+                current_key = key
+            else:
+                # words by a space
+                offset += 1
+
+            line = self.lines[-1]
+            line.text += (' ' if line.text_boxes else '') + word
+            line.text_boxes.append(text_box)
+            self._word_starts.append(offset)
+            self._word_ends.append(offset + len(word))
+            self._word_lines.append(len(self.lines) - 1)
+            self._word_boxes.append(text_box)
+            offset += len(word)
+
+        self.text = '\n'.join(line.text for line in self.lines)
+
+    @property
+    def line_texts(self) -> list[str]:
+        return [line.text for line in self.lines]
+
+    def span_boxes(self, start: int, end: int) -> list[TextBox]:
+        '''
+        One box per line covering the words of the text span [start, end),
+        a span crossing line breaks gives a box on every line
+        '''
+        # words ending after start and starting before end overlap the span
+        first = bisect.bisect_right(self._word_ends, start)
+        last = bisect.bisect_left(self._word_starts, end)
+
+        boxes = []
+        for i in range(first, last):
+            if boxes and boxes[-1][0] == self._word_lines[i]:
+                boxes[-1][1].append(self._word_boxes[i])
+            else:
+                boxes.append((self._word_lines[i], [self._word_boxes[i]]))
+        return [union_box(words) for _, words in boxes]
+
+    def entity_boxes(self, spans: list) -> list[tuple[TextBox, str]]:
+        '''
+        Boxes of the sensitive spans (anything with start, end and text_type) with their entity type.
+        A box found by several spans keeps the first entity type
+        '''
+        entity_boxes = {}
+        for span in spans:
+            for text_box in self.span_boxes(span.start, span.end):
+                entity_boxes.setdefault((text_box.x, text_box.y, text_box.w, text_box.h), (text_box, span.text_type))
+        return list(entity_boxes.values())
+
+
+def line_key(text_box: TextBox) -> tuple[int, int, int]:
+    return text_box.block_num, text_box.par_num, text_box.line_num
+
+
+def union_box(text_boxes: list[TextBox]) -> TextBox:
+    '''
+    Box covering the word boxes of one line, with their text
+    '''
+    x1 = min(text_box.x for text_box in text_boxes)
+    y1 = min(text_box.y for text_box in text_boxes)
+    x2 = max(text_box.x + text_box.w for text_box in text_boxes)
+    y2 = max(text_box.y + text_box.h for text_box in text_boxes)
+    first = text_boxes[0]
+    return TextBox(' '.join(text_box.text.strip() for text_box in text_boxes), x1, y1, x2 - x1, y2 - y1,
+                   first.block_num, first.par_num, first.line_num, min(text_box.conf for text_box in text_boxes), first.level)
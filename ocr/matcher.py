@@ -0,0 +1,82 @@
+from collections import deque
+from typing import Iterator
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class WordMatcher:
+    '''
+    Finds the occurrences of a set of words in a text.
+
+    The words are compiled once into an Aho-Corasick automaton, so each text is
+    scanned a single time whatever the number of words. The C implementation of
+    pyahocorasick is used when it is installed.
+    '''
+    def __init__(self, words: list[str]):
+        self.words = frozenset(words)
+        self._automaton = None
+        self._goto = [{}]
+        self._fail = [0]
+        # word ending at each state, including the ones reached through failure links
+        self._output = [None]
+
+        words = [word for word in self.words if word]
+        if not words:
+            return
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in words:
+                self._automaton.add_word(word, word)
+            self._automaton.make_automaton()
+        else:
+            self._build(words)
+
+    def _build(self, words: list[str]):
+        for word in words:
+            state = 0
+            for char in word:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state] = word
+
+        # Breadth first to set the failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] or self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> Iterator[tuple[int, int, str]]:
+        '''
+        (start, end, word) of the words found in the text, in the order they end.
+        The empty word is never reported, and the pure Python automaton only gives
+        the longest word ending at each offset
+        '''
+        if self._automaton is not None:
+            for end, word in self._automaton.iter(text):
+                yield end + 1 - len(word), end + 1, word
+            return
+
+        goto, fail, output = self._goto, self._fail, self._output
+        if len(goto) == 1:
+            return
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                yield end - len(output[state]), end, output[state]
@@ -1,21 +1,102 @@
+import math
+
 from PIL import Image, ImageFilter, ImageOps
 import numpy as np
 import cv2
 
+from ocr.api import TextBox
+
+# Glyph height in pixels the OCR runs at, Tesseract reads it as well as larger text
+TARGET_TEXT_HEIGHT = 24
+
+# Text smaller than this is upscaled to the target height, Tesseract starts missing glyphs below it
+MIN_TEXT_HEIGHT = 12
+
+# Text is downscaled once it is this many times taller than the target, smaller resizes are not worth it
+SCALE_TOLERANCE = 1.25
+
+# Limits of the adaptive scale
+MIN_SCALE = 0.25
+MAX_SCALE = 3.0
+
+# The text height is measured on a copy of the frame at most this wide
+ESTIMATE_WIDTH = 1920
+
+# Minimum number of glyph-like components for the text height estimate to be trusted
+MIN_GLYPHS = 10
+
+
+def estimate_text_height(image: np.array, max_width: int = ESTIMATE_WIDTH) -> float:
+    '''
+    Median height in pixels of the text of a grayscale image, or None when it has no text.
+    Connected components of the morphological gradient edges are glyphs or words, their
+    height does not depend on how many glyphs merged together
+    '''
+    factor = min(1.0, max_width / image.shape[1])
+    small = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1.0 else image
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+
+    widths, heights, areas = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT], stats[1:, cv2.CC_STAT_AREA]
+    glyphs = (heights >= 5) & (heights <= small.shape[0] / 10) & (areas >= 10) & (widths >= heights / 4)
+    if np.count_nonzero(glyphs) < MIN_GLYPHS:
+        return None
+    # the gradient adds about a pixel on each side of the glyph
+    return (float(np.median(heights[glyphs])) - 2) / factor
+
 
 class OCRPreprocessor:
-    def __init__(self, scaling_factor: float = 1.0):
-        self.scaling_factor = scaling_factor
+    '''
+    Prepares frames for OCR at the resolution their text needs.
+
+    With a fixed scaling_factor every image is resized by it. Without one, the
+    scale is picked once per input from the estimated text height of the first
+    image with text, so large frames with large text are downscaled and tiny text
+    is upscaled. project_boxes maps the OCR boxes back to the input resolution.
+    '''
+    def __init__(self, scaling_factor: float = None, target_text_height: float = TARGET_TEXT_HEIGHT):
+        self.adaptive = scaling_factor is None
+        self.scaling_factor = 1.0 if scaling_factor is None else scaling_factor
+        self.target_text_height = target_text_height
+        self.text_height = None
+
+    def reset(self):
+        '''
+        Forget the adaptive scale, the next image is from another input
+        '''
+        if self.adaptive:
+            self.scaling_factor = 1.0
+            self.text_height = None
+
+    def calibrate(self, image: np.array) -> float:
+        '''
+        Pick the scale from the text height of the image, until an image with text is seen
+        '''
+        if not self.adaptive or self.text_height is not None:
+            return self.scaling_factor
+        text_height = estimate_text_height(self._grayscale(image))
+        if text_height is None or text_height <= 0:
+            return self.scaling_factor
+
+        self.text_height = text_height
+        if MIN_TEXT_HEIGHT <= text_height <= self.target_text_height * SCALE_TOLERANCE:
+            self.scaling_factor = 1.0
+        else:
+            self.scaling_factor = round(min(max(self.target_text_height / text_height, MIN_SCALE), MAX_SCALE), 3)
+        return self.scaling_factor
 
     def preprocess_image(self, image: np.array) -> np.array:
         '''
         Preprocess the image before passing it to the OCR API
         '''
-        # Resize the image
-        processed_img = self._resize(image, self.scaling_factor)
+        self.calibrate(image)
 
         # Convert the image to grayscale
-        processed_img = self._grayscale(processed_img)
+        processed_img = self._grayscale(image)
+
+        # Resize the image
+        processed_img = self._resize(processed_img, self.scaling_factor)
 
         # Apply adaptive thresholding
         # processed_img = self._adaptive_threshold(processed_img, 11, 2)
@@ -29,18 +110,38 @@ class OCRPreprocessor:
         return processed_img
 
 
+    def project_boxes(self, text_boxes: list[TextBox]) -> list[TextBox]:
+        '''
+        Map boxes found on the preprocessed image back to the input resolution,
+        rounding outwards so the projected box still covers the whole word
+        '''
+        if self.scaling_factor == 1.0:
+            return text_boxes
+        for text_box in text_boxes:
+            x1, y1 = math.floor(text_box.x / self.scaling_factor), math.floor(text_box.y / self.scaling_factor)
+            x2 = math.ceil((text_box.x + text_box.w) / self.scaling_factor)
+            y2 = math.ceil((text_box.y + text_box.h) / self.scaling_factor)
+            text_box.x, text_box.y, text_box.w, text_box.h = x1, y1, x2 - x1, y2 - y1
+        return text_boxes
+
     def _resize(self, image: np.array, scaling_factor: float) -> np.array:
         '''
         Resize the given image by the given scaling factor
         '''
+        if scaling_factor == 1.0:
+            return image
         new_width = int(image.shape[1] * scaling_factor)
         new_height = int(image.shape[0] * scaling_factor)
-        return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        # area averaging keeps thin strokes when shrinking
+        interpolation = cv2.INTER_AREA if scaling_factor < 1.0 else cv2.INTER_LINEAR
+        return cv2.resize(image, (new_width, new_height), interpolation=interpolation)
 
     def _grayscale(self, image: Image.Image) -> Image.Image:
         '''
-        Convert the given image to grayscale
+        Convert the given image to grayscale, images that are already grayscale are kept
         '''
+        if image.ndim == 2:
+            return image
         return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
     def _adaptive_threshold(self, image: np.array, block_size: int, C: int) -> np.array:
@@ -68,4 +169,4 @@ class OCRPreprocessor:
         # Apply the sharpening kernel to the image
         sharpened_image = cv2.filter2D(image, -1, kernel)
         
-        return sharpened_image
\ No newline at end of file
+        return sharpened_image
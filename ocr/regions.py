@@ -0,0 +1,259 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import cv2
+import numpy as np
+
+from ocr.api import PyTesseractAPI, TextBox
+from ocr.layout import line_key
+
+# Value of the changed pixels in the change mask
+FOREGROUND_VALUE = 255
+
+# Minimum grey level difference with the last OCR'd frame for a pixel to count as changed
+PIXEL_THRESHOLD = 30
+
+# Kernel used to join changed pixels of the same text line into one region
+DILATE_KERNEL = (25, 9)
+
+# Regions smaller than this (in pixels) are treated as noise
+MIN_REGION_AREA = 64
+
+# Extra pixels added around each region so Tesseract sees whole glyphs
+REGION_PADDING = 8
+
+# Above this share of the frame a single full OCR is cheaper than OCR'ing the regions
+MAX_DIRTY_RATIO = 0.5
+
+# Share of the smaller height a new word must overlap a kept line vertically to join it
+LINE_OVERLAP = 0.5
+
+
+def change_mask(reference: np.ndarray, gray: np.ndarray, threshold: int = PIXEL_THRESHOLD) -> np.ndarray:
+    '''
+    Pixels of the grayscale frame that differ from the reference, the last OCR'd frame.
+    Everything that changed since that OCR is marked, however slowly it appeared
+    '''
+    return np.where(cv2.absdiff(reference, gray) > threshold, FOREGROUND_VALUE, 0).astype(np.uint8)
+
+
+def dirty_rectangles(mask: np.ndarray, cached_boxes: list[TextBox], scaling_factor: float = 1.0, max_ratio: float = MAX_DIRTY_RATIO) -> list[tuple[int, int, int, int]]:
+    '''
+    Regions of the preprocessed frame to OCR again, or None when the whole frame should be OCR'd
+    '''
+    rectangles = scale_rectangles(mask_to_rectangles(mask), scaling_factor)
+    rectangles = expand_rectangles(rectangles, cached_boxes)
+
+    frame_area = mask.shape[0] * mask.shape[1] * scaling_factor ** 2
+    if rectangles_area(rectangles) > max_ratio * frame_area:
+        return None
+    return rectangles
+
+
+def mask_to_rectangles(mask: np.ndarray, min_area: int = MIN_REGION_AREA, padding: int = REGION_PADDING) -> list[tuple[int, int, int, int]]:
+    '''
+    Split a change mask into merged (x, y, w, h) bounding rectangles
+    '''
+    binary = np.where(mask >= FOREGROUND_VALUE, 255, 0).astype(np.uint8)
+    binary = cv2.dilate(binary, cv2.getStructuringElement(cv2.MORPH_RECT, DILATE_KERNEL))
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    height, width = mask.shape[:2]
+    rectangles = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < min_area:
+            continue
+        x1, y1 = max(x - padding, 0), max(y - padding, 0)
+        x2, y2 = min(x + w + padding, width), min(y + h + padding, height)
+        rectangles.append((x1, y1, x2 - x1, y2 - y1))
+
+    return merge_rectangles(rectangles)
+
+
+def merge_rectangles(rectangles: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
+    '''
+    Merge overlapping rectangles until none of them overlap
+    '''
+    merged = list(rectangles)
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for rect in merged:
+            for i, other in enumerate(result):
+                if rectangles_overlap(rect, other):
+                    x1, y1 = min(rect[0], other[0]), min(rect[1], other[1])
+                    x2 = max(rect[0] + rect[2], other[0] + other[2])
+                    y2 = max(rect[1] + rect[3], other[1] + other[3])
+                    result[i] = (x1, y1, x2 - x1, y2 - y1)
+                    changed = True
+                    break
+            else:
+                result.append(rect)
+        merged = result
+    return merged
+
+
+def expand_rectangles(rectangles: list[tuple[int, int, int, int]], text_boxes: list[TextBox]) -> list[tuple[int, int, int, int]]:
+    '''
+    Grow the rectangles to fully include the cached words they cut through
+    '''
+    word_rects = [(box.x, box.y, box.w, box.h) for box in text_boxes if box.text.strip()]
+    expanded = []
+    for rect in rectangles:
+        for word_rect in word_rects:
+            if rectangles_overlap(rect, word_rect):
+                x1, y1 = min(rect[0], word_rect[0]), min(rect[1], word_rect[1])
+                x2 = max(rect[0] + rect[2], word_rect[0] + word_rect[2])
+                y2 = max(rect[1] + rect[3], word_rect[1] + word_rect[3])
+                rect = (x1, y1, x2 - x1, y2 - y1)
+        expanded.append(rect)
+    return merge_rectangles(expanded)
+
+
+def shift_boxes(text_boxes: list[TextBox], shift: tuple[int, int], shape: tuple[int, int]) -> list[TextBox]:
+    '''
+    Copies of the boxes moved by (dx, dy) pixels along with the content, the ones moved out of a frame of this shape are dropped
+    '''
+    height, width = shape[:2]
+    moved = [replace(text_box, x=text_box.x + shift[0], y=text_box.y + shift[1]) for text_box in text_boxes]
+    return [text_box for text_box in moved if text_box.x + text_box.w > 0 and text_box.y + text_box.h > 0 and text_box.x < width and text_box.y < height]
+
+
+def rectangles_overlap(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def scale_rectangles(rectangles: list[tuple[int, int, int, int]], scaling_factor: float) -> list[tuple[int, int, int, int]]:
+    return [tuple(int(value * scaling_factor) for value in rect) for rect in rectangles]
+
+
+def rectangles_area(rectangles: list[tuple[int, int, int, int]]) -> int:
+    return sum(w * h for _, _, w, h in rectangles)
+
+
+def recognise_regions(tesseract_api: PyTesseractAPI, image: np.ndarray, rectangles: list[tuple[int, int, int, int]], lang: str = "spa", debug: bool = False) -> tuple[str, list[TextBox]]:
+    '''
+    OCR only the given regions of the image and return the boxes in image coordinates
+    '''
+    texts = []
+    region_boxes = []
+    for x, y, w, h in rectangles:
+        crop_text, crop_boxes = tesseract_api.recognise_text_to_data(image[y:y+h, x:x+w], lang=lang, debug=debug)
+        texts.append(crop_text)
+        for text_box in crop_boxes:
+            text_box.x += x
+            text_box.y += y
+        region_boxes.append(crop_boxes)
+
+    return join_texts(texts), number_blocks(region_boxes)
+
+
+def join_texts(texts: list[str]) -> str:
+    return '\n'.join(text for text in texts if text)
+
+
+def number_blocks(region_boxes: list[list[TextBox]]) -> list[TextBox]:
+    '''
+    Concatenate the boxes of several OCR runs, every run numbers its blocks from 1
+    so the blocks of the later runs are shifted to keep their lines apart
+    '''
+    text_boxes = []
+    offset = 0
+    for boxes in region_boxes:
+        for text_box in boxes:
+            text_box.block_num += offset
+        offset = max((text_box.block_num for text_box in boxes), default=offset)
+        text_boxes.extend(boxes)
+    return text_boxes
+
+
+class RegionOCR:
+    '''
+    OCRs the regions of an image on a pool of threads, with one OCR engine per thread.
+
+    pytesseract starts a tesseract process per call and tesserocr releases the GIL
+    while it recognises, so the regions of a frame are recognised at the same time.
+    With one thread the regions are OCR'd in order on the given engine.
+    '''
+    def __init__(self, tesseract_api: PyTesseractAPI, threads: int = 1):
+        self.tesseract_api = tesseract_api
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="ocr") if threads > 1 else None
+        self._local = threading.local()
+
+    def _thread_api(self) -> PyTesseractAPI:
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self._local.api = self.tesseract_api.clone()
+        return api
+
+    def _recognise_region(self, image: np.ndarray, rectangle: tuple[int, int, int, int], lang: str, debug: bool) -> tuple[str, list[TextBox]]:
+        return recognise_regions(self._thread_api(), image, [rectangle], lang=lang, debug=debug)
+
+    def recognise(self, image: np.ndarray, rectangles: list[tuple[int, int, int, int]], lang: str = "spa", debug: bool = False) -> tuple[str, list[TextBox]]:
+        '''
+        Same result as recognise_regions, texts and boxes stay in the order of the rectangles
+        '''
+        if self._executor is None or len(rectangles) < 2:
+            return recognise_regions(self.tesseract_api, image, rectangles, lang=lang, debug=debug)
+
+        results = list(self._executor.map(lambda rectangle: self._recognise_region(image, rectangle, lang, debug), rectangles))
+        return join_texts([text for text, _ in results]), number_blocks([text_boxes for _, text_boxes in results])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def merge_text_boxes(cached_boxes: list[TextBox], new_boxes: list[TextBox], rectangles: list[tuple[int, int, int, int]]) -> list[TextBox]:
+    '''
+    Replace the cached boxes that overlap a re-OCR'd region with the new boxes found there.
+    New words aligned with a kept line join it in x order, the other new lines are
+    inserted among the kept ones by their top, so the text keeps its reading order
+    '''
+    kept_boxes = [
+        text_box for text_box in cached_boxes
+        if not any(rectangles_overlap((text_box.x, text_box.y, text_box.w, text_box.h), rect) for rect in rectangles)
+    ]
+    new_boxes = number_blocks([kept_boxes, new_boxes])[len(kept_boxes):]
+
+    lines = {}
+    for text_box in kept_boxes:
+        lines.setdefault(line_key(text_box), []).append(text_box)
+    kept_extents = {key: (min(box.y for box in boxes), max(box.y + box.h for box in boxes)) for key, boxes in lines.items()}
+    order = list(lines)
+
+    joined = set()
+    for text_box in new_boxes:
+        key = aligned_line(text_box, kept_extents)
+        if key is not None:
+            text_box.block_num, text_box.par_num, text_box.line_num = key
+            joined.add(key)
+        else:
+            key = line_key(text_box)
+            if key not in lines:
+                # before the first kept line that starts below it
+                below = [i for i, other in enumerate(order) if other in kept_extents and kept_extents[other][0] > text_box.y]
+                order.insert(below[0] if below else len(order), key)
+        lines.setdefault(key, []).append(text_box)
+
+    return [
+        text_box for key in order
+        for text_box in (sorted(lines[key], key=lambda box: box.x) if key in joined else lines[key])
+    ]
+
+
+def aligned_line(text_box: TextBox, extents: dict[tuple[int, int, int], tuple[int, int]]) -> tuple[int, int, int]:
+    '''
+    Key of the line the box overlaps most vertically, None when it overlaps none by LINE_OVERLAP
+    '''
+    best, best_overlap = None, 0
+    for key, (y1, y2) in extents.items():
+        overlap = min(y2, text_box.y + text_box.h) - max(y1, text_box.y)
+        if overlap >= LINE_OVERLAP * min(y2 - y1, text_box.h) and overlap > best_overlap:
+            best, best_overlap = key, overlap
+    return best
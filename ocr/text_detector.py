@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+
+from ocr.regions import merge_rectangles, rectangles_area
+
+# Kernel that joins the characters of a word and the words of a line
+LINE_KERNEL = (15, 3)
+
+# Size limits in pixels of a text line, and the share of the frame height above which it is a picture
+MIN_TEXT_HEIGHT = 6
+MIN_TEXT_WIDTH = 8
+MAX_TEXT_HEIGHT_RATIO = 0.2
+
+# Minimum share of a line's bounding box covered once closed, text lines are solid
+MIN_FILL_RATIO = 0.45
+
+# Extra pixels added around each region so Tesseract sees whole glyphs, close lines merge into one block
+REGION_PADDING = 16
+
+# Above this share of the frame a single full OCR is cheaper than OCR'ing the regions
+MAX_TEXT_RATIO = 0.5
+
+
+class TextRegionDetector:
+    '''
+    CPU-only proposal of the text regions of a preprocessed (grayscale) frame.
+
+    Edges of the morphological gradient are thresholded with Otsu and closed into
+    lines, the line-shaped ones are padded and merged into blocks. Flat or smooth
+    areas (photographs, camera footage, empty backgrounds) have no strong edges
+    and are left out of the OCR.
+    '''
+    def __init__(self, max_ratio: float = MAX_TEXT_RATIO, padding: int = REGION_PADDING):
+        self.max_ratio = max_ratio
+        self.padding = padding
+
+    def detect(self, image: np.ndarray) -> list[tuple[int, int, int, int]]:
+        '''
+        (x, y, w, h) text regions of the image, or None when they cover so much of it
+        that the whole image should be OCR'd
+        '''
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        rectangles = self._line_rectangles(edges)
+
+        height, width = gray.shape[:2]
+        if rectangles_area(rectangles) > self.max_ratio * height * width:
+            return None
+        return rectangles
+
+    def _line_rectangles(self, edges: np.ndarray) -> list[tuple[int, int, int, int]]:
+        '''
+        Close the edges into text lines and keep the padded boxes of the ones shaped like text
+        '''
+        lines = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, LINE_KERNEL))
+        # every contour and not only the outer ones, text inside a framed caption box is nested in the frame
+        contours, _ = cv2.findContours(lines, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        height, width = edges.shape[:2]
+        max_height = MAX_TEXT_HEIGHT_RATIO * height
+        rectangles = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if h < MIN_TEXT_HEIGHT or w < MIN_TEXT_WIDTH or h > max_height:
+                continue
+            if cv2.countNonZero(lines[y:y+h, x:x+w]) < MIN_FILL_RATIO * w * h:
+                continue
+            x1, y1 = max(x - self.padding, 0), max(y - self.padding, 0)
+            x2, y2 = min(x + w + self.padding, width), min(y + h + self.padding, height)
+            rectangles.append((x1, y1, x2 - x1, y2 - y1))
+
+        return merge_rectangles(rectangles)
@@ -0,0 +1,481 @@
+from analyser.analyser import DEFAULT_RECOGNIZERS
+from ocr.anonymiser import OBFUSCATION_MODES, Anonymiser
+from video.change_detector import CHANGE_METRICS
+from video.encoder import EncoderSettings
+from batch import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, anonymise_file, load_components, partial_path
+from main2 import retrieve_tesseract_path
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection, wait
+from cli_options import analysis_options, encoder_options, frame_options, ocr_backend_options, recognizer_options, tracking_options, verbose_option
+import click
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import threading
+import time
+import uuid
+import utils.logger as logger
+
+
+JOB_STATUSES = ['queued', 'running', 'done', 'failed', 'cancelled']
+
+# Per-job settings a submitted job can override, the models stay loaded whatever they are
+JOB_OPTIONS = ['recognizers', 'excluded_recognizers', 'filter', 'unfilter', 'obfuscation_mode', 'frame_diff_threshold', 'change_metric']
+
+# Seconds between checks for a cancelled job while a worker runs it
+CANCEL_POLL_INTERVAL = 0.2
+
+# Seconds a worker process gets to exit on shutdown before it is terminated
+STOP_TIMEOUT = 5
+
+
+@dataclass
+class Job:
+    '''
+    One file to anonymise, with the per-job options applied on top of the service settings
+    '''
+    id: str
+    input: str
+    output: str
+    options: dict = field(default_factory=dict)
+    status: str = 'queued'
+    submitted: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    error: str = None
+    result: dict = None
+    cancel_requested: bool = False
+
+    def to_dict(self) -> dict:
+        job = asdict(self)
+        del job["cancel_requested"]
+        # time spent waiting in the queue and end-to-end latency of the request
+        job["queued_seconds"] = round(self.started - self.submitted, 3) if self.started else None
+        job["latency_seconds"] = round(self.finished - self.submitted, 3) if self.finished else None
+        return job
+
+
+def validate_options(options: dict, loaded_recognizers: list[str]) -> dict:
+    '''
+    Per-job options of a submitted job, raises ValueError for the ones the loaded service cannot apply
+    '''
+    unknown = [name for name in options if name not in JOB_OPTIONS]
+    if unknown:
+        raise ValueError(f"Unknown job options {unknown}, expected some of {JOB_OPTIONS}")
+    for name in ('recognizers', 'excluded_recognizers', 'filter', 'unfilter'):
+        if name in options and not (isinstance(options[name], list) and all(isinstance(value, str) for value in options[name])):
+            raise ValueError(f"{name} must be a list of strings")
+    if any(not word.strip() for word in options.get('filter', [])):
+        raise ValueError("filter words cannot be empty")
+    not_loaded = [rec for rec in options.get('recognizers', []) if rec not in loaded_recognizers]
+    if not_loaded:
+        raise ValueError(f"Recognizers {not_loaded} are not loaded by the service, expected some of {loaded_recognizers}")
+    if options.get('obfuscation_mode', OBFUSCATION_MODES[0]) not in OBFUSCATION_MODES:
+        raise ValueError(f"obfuscation_mode must be one of {OBFUSCATION_MODES}")
+    if options.get('change_metric', CHANGE_METRICS[0]) not in CHANGE_METRICS:
+        raise ValueError(f"change_metric must be one of {CHANGE_METRICS}")
+    if not isinstance(options.get('frame_diff_threshold', 0), (int, float)):
+        raise ValueError("frame_diff_threshold must be a number")
+    return options
+
+
+def _serve_jobs(connection: Connection, settings: dict):
+    # runs in a worker process: the OCR engine, the NLP models and the analyser are loaded once for every job
+    # the service stops its workers itself, they must not inherit its SIGTERM handler nor get the Ctrl+C of the terminal
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    components = load_components(settings)
+    analyser = components["analyser"]
+    defaults = settings["analyser_kwargs"]
+    connection.send(dict(ready = True, pid = os.getpid()))
+
+    parent = multiprocessing.parent_process()
+    while True:
+        # forked siblings keep the pipe open, so the end of the service is noticed on the parent process instead
+        if not connection.poll(CANCEL_POLL_INTERVAL):
+            if not parent.is_alive():
+                break
+            continue
+        job = connection.recv()
+        if job is None:
+            break
+        options = job["options"]
+        job_settings = dict(settings, **{name: options[name] for name in ('frame_diff_threshold', 'change_metric') if name in options})
+        try:
+            # the recognizers of the job are a subset of the loaded ones, nothing is reloaded
+            analyser.configure(options.get("recognizers"), options.get("excluded_recognizers", []),
+                               options.get("filter", defaults["filtered_words"]), options.get("unfilter", defaults["unfiltered_words"]))
+        except ValueError as error:
+            connection.send(dict(status = 'failed', error = f"ValueError: {error}"))
+            continue
+        components["anonymiser"] = Anonymiser(mode = options.get("obfuscation_mode", settings["obfuscation_mode"]))
+        connection.send(anonymise_file(components, job_settings, job["input"], job["output"]))
+
+
+class ServiceWorker(threading.Thread):
+    '''
+    Takes jobs from the service queue and runs them on its own warm worker process.
+
+    A running job that is cancelled, or whose process crashes, costs a restart of
+    the process (and a reload of the models), every other job reuses it.
+    '''
+    def __init__(self, service: "ObfuscationService", index: int):
+        super().__init__(name = f"service-worker-{index}", daemon = True)
+        self.service = service
+        self.index = index
+        self.ready = threading.Event()
+        self._process = None
+        self._connection = None
+
+    def _start_process(self):
+        self.ready.clear()
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target = _serve_jobs, args = (child_connection, self.service.settings), name = f"service-process-{self.index}", daemon = True)
+        self._process.start()
+        child_connection.close()
+
+    def _wait_ready(self) -> bool:
+        ready = wait([self._connection, self._process.sentinel])
+        if self._connection not in ready:
+            return False
+        try:
+            self._connection.recv()
+        except EOFError:
+            return False
+        if self.service.settings["verbose"]:
+            logger.log("Worker ready", dict(worker = self.index, pid = self._process.pid))
+        self.ready.set()
+        return True
+
+    def _restart(self, job: Job) -> bool:
+        self._process.terminate()
+        self._process.join()
+        # the job was stopped halfway, drop what it had written
+        if os.path.exists(partial_path(job.output)):
+            os.remove(partial_path(job.output))
+        self._start_process()
+        return self._wait_ready()
+
+    def run(self):
+        self._start_process()
+        if not self._wait_ready():
+            print(f"Error: worker {self.index} could not load the OCR engine and the analyser.")
+            return
+        while True:
+            job = self.service.next_job()
+            if job is None:
+                break
+            if not self._run_job(job) and not self._restart(job):
+                print(f"Error: worker {self.index} could not be restarted.")
+                return
+        self.stop()
+
+    def _run_job(self, job: Job) -> bool:
+        '''
+        Run a job on the worker process, returns False when the process has to be restarted
+        '''
+        self._connection.send(dict(input = job.input, output = job.output, options = job.options))
+        while True:
+            ready = wait([self._connection, self._process.sentinel], timeout = CANCEL_POLL_INTERVAL)
+            if job.cancel_requested:
+                self.service.finish(job, 'cancelled')
+                return False
+            if self._connection in ready:
+                try:
+                    result = self._connection.recv()
+                except EOFError:
+                    continue
+                self.service.finish(job, result["status"], result)
+                return True
+            if self._process.sentinel in ready:
+                self.service.finish(job, 'failed', dict(error = f"Worker process exited with code {self._process.exitcode}"))
+                return False
+
+    def stop(self):
+        if self._process is None or not self._process.is_alive():
+            return
+        try:
+            self._connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
+
+class ObfuscationService:
+    '''
+    Bounded queue of anonymisation jobs served by a fixed number of warm workers.
+
+    Jobs reference files on the local filesystem. Their output goes to the given
+    path, or to the jobs directory, and can be fetched once the job is done.
+    '''
+    def __init__(self, settings: dict, workers: int, queue_size: int, jobs_dir: str):
+        self.settings = settings
+        self.jobs_dir = jobs_dir
+        analyser_kwargs = settings["analyser_kwargs"]
+        self.loaded_recognizers = [rec for rec in (analyser_kwargs["recognizers"] or DEFAULT_RECOGNIZERS) if rec not in analyser_kwargs["excluded_recognizers"]]
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._stopping = threading.Event()
+        self._workers = [ServiceWorker(self, i) for i in range(workers)]
+
+    def start(self):
+        os.makedirs(self.jobs_dir, exist_ok = True)
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, input: str, output: str = None, options: dict = None) -> Job:
+        '''
+        Queue a job, raises ValueError for an invalid job and queue.Full when the queue is full
+        '''
+        input = os.path.abspath(input)
+        if not input.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+            raise ValueError(f"Unsupported file type: {input}")
+        if not os.path.isfile(input):
+            raise ValueError(f"Input not found: {input}")
+        options = validate_options(options or {}, self.loaded_recognizers)
+
+        job_id = uuid.uuid4().hex
+        output = os.path.abspath(output) if output else os.path.join(self.jobs_dir, job_id + os.path.splitext(input)[1])
+        job = Job(id = job_id, input = input, output = output, options = options)
+        with self._lock:
+            self._queue.put_nowait(job)
+            self.jobs[job.id] = job
+        return job
+
+    def next_job(self) -> Job:
+        '''
+        Block until there is a job to run and mark it running, None once the service stops
+        '''
+        while True:
+            job = self._queue.get()
+            if job is None or self._stopping.is_set():
+                return None
+            with self._lock:
+                if job.status == 'queued':
+                    job.status = 'running'
+                    job.started = time.time()
+                    return job
+
+    def finish(self, job: Job, status: str, result: dict = None):
+        with self._lock:
+            job.status = status
+            job.finished = time.time()
+            if result is not None:
+                job.error = result.pop("error", None)
+                job.result = result
+
+    def cancel(self, job_id: str) -> Job:
+        '''
+        Cancel a queued or running job, finished jobs are left as they are
+        '''
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finished = time.time()
+            elif job.status == 'running':
+                # the worker notices it and restarts its process
+                job.cancel_requested = True
+            return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return dict(
+            workers = len(self._workers),
+            ready_workers = sum(worker.ready.is_set() for worker in self._workers),
+            queue_size = self._queue.maxsize,
+            recognizers = self.loaded_recognizers,
+            **{status: statuses.count(status) for status in JOB_STATUSES})
+
+    def stop(self):
+        '''
+        Stop taking jobs, the running ones get STOP_TIMEOUT seconds to finish
+        '''
+        self._stopping.set()
+        for _ in self._workers:
+            try:
+                # wakes up the workers waiting for a job
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(STOP_TIMEOUT)
+            worker.stop()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    '''
+    JSON API of the service:
+        POST /jobs                  submit {"input": path, "output": path, "options": {...}}
+        GET  /jobs                  every job
+        GET  /jobs/<id>             status of a job
+        POST /jobs/<id>/cancel      cancel a queued or running job
+        GET  /jobs/<id>/result      anonymised file of a finished job
+        GET  /health                workers and job counts
+    '''
+    @property
+    def service(self) -> ObfuscationService:
+        return self.server.service
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            self._send_json(200, self.service.stats())
+        elif parts == ['jobs']:
+            self._send_json(200, self.service.list())
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send_json(404, dict(error = f"Unknown job {parts[1]}"))
+            else:
+                self._send_json(200, job.to_dict())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+            self._send_result(parts[1])
+        else:
+            self._send_json(404, dict(error = f"Unknown path {self.path}"))
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self._submit()
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            job = self.service.cancel(parts[1])
+            if job is None:
+                self._send_json(404, dict(error = f"Unknown job {parts[1]}"))
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, dict(error = f"Unknown path {self.path}"))
+
+    def _submit(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(body, dict) or not isinstance(body.get('input'), str):
+                raise ValueError("The job needs the path of its input")
+            job = self.service.submit(body['input'], body.get('output'), body.get('options'))
+        except (ValueError, json.JSONDecodeError) as error:
+            self._send_json(400, dict(error = str(error)))
+        except queue.Full:
+            self._send_json(503, dict(error = "The job queue is full, try again later"))
+        else:
+            self._send_json(202, job.to_dict())
+
+    def _send_result(self, job_id: str):
+        job = self.service.get(job_id)
+        if job is None:
+            self._send_json(404, dict(error = f"Unknown job {job_id}"))
+            return
+        if job.status != 'done':
+            self._send_json(409, dict(error = f"Job {job_id} is {job.status}"))
+            return
+        with open(job.output, 'rb') as output_file:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(output_file.fileno()).st_size))
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(job.output)}"')
+            self.end_headers()
+            shutil.copyfileobj(output_file, self.wfile)
+
+    def _send_json(self, code: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args):
+        if self.service.settings["verbose"]:
+            super().log_message(format, *args)
+
+
+@click.command()
+@recognizer_options(recognizer_help = 'Recognizers loaded by the service, jobs can use any subset of them. Default includes all recognizers')
+@frame_options()
+@tracking_options()
+@analysis_options(cache_size_help = 'Number of analysis results kept in memory, shared by the files of a worker. 0 disables the cache',
+                  cache_dir_help = 'Directory of the on-disk analysis cache shared between runs and workers')
+@ocr_backend_options()
+@click.option('--workers', '-w',
+    help = 'Number of worker processes, each one loads the OCR engine and the analyser once and runs one job at a time',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 1
+)
+@click.option('--queue-size',
+    help = 'Maximum number of queued jobs, further submissions are rejected until the queue drains',
+    required = False,
+    type = click.IntRange(min = 1),
+    default = 64
+)
+@click.option('--jobs-dir',
+    help = 'Directory of the outputs of the jobs submitted without an output path',
+    required = False,
+    type = str,
+    default = 'service-jobs'
+)
+@click.option('--host',
+    help = 'Address the HTTP API listens on, only local by default',
+    required = False,
+    type = str,
+    default = '127.0.0.1'
+)
+@click.option('--port',
+    help = 'Port of the HTTP API',
+    required = False,
+    type = click.IntRange(min = 0, max = 65535),
+    default = 8765
+)
+@encoder_options(codec_help = 'ffmpeg video codec of the output videos')
+@verbose_option()
+def main(recognizer, exclude_recognizer, filter, unfilter, frame_diff_threshold, change_metric, obfuscation_mode, dirty_regions, ocr_scale, text_regions, ocr_threads, track, track_confidence, analysis_cache_size, analysis_cache_dir, incremental_analysis, full_nlp_pipeline, ocr_backend, ocr_cache_dir, ocr_cache_size, workers, queue_size, jobs_dir, host, port, codec, preset, crf, verbose):
+    # read tesseract path from env (tesserocr links libtesseract and does not need it)
+    tesseract_path = retrieve_tesseract_path() if ocr_backend == 'pytesseract' else None
+    analyser_kwargs = dict(recognizers=recognizer, excluded_recognizers=exclude_recognizer, filtered_words=filter, unfiltered_words=unfilter,
+                           cache_size=analysis_cache_size, cache_dir=analysis_cache_dir, trim_pipes=not full_nlp_pipeline)
+    settings = dict(ocr_backend = ocr_backend, tesseract_path = tesseract_path, ocr_cache_dir = ocr_cache_dir, ocr_cache_size = ocr_cache_size, ocr_scale = ocr_scale,
+                    analyser_kwargs = analyser_kwargs, obfuscation_mode = obfuscation_mode, frame_diff_threshold = frame_diff_threshold, change_metric = change_metric,
+                    dirty_regions = dirty_regions, text_regions = text_regions, ocr_threads = ocr_threads, track = track, track_confidence = track_confidence,
+                    incremental_analysis = incremental_analysis, encoder_settings = EncoderSettings(codec = codec, preset = preset, crf = crf), verbose = verbose)
+
+    service = ObfuscationService(settings, workers, queue_size, jobs_dir)
+    try:
+        server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    except OSError as error:
+        print(f"Error: could not listen on {host}:{port}: {error}")
+        os._exit(1)
+    server.service = service
+    # a service manager stops the daemon with SIGTERM, shut down as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target = server.shutdown).start())
+    service.start()
+    logger.log("Service", dict(address = f"http://{host}:{server.server_port}", workers = workers, queue_size = queue_size, jobs_dir = os.path.abspath(jobs_dir)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
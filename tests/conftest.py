@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import pytest
+
+from ocr.api import create_ocr_api
+from video.encoder import EncoderSettings
+
+
+@pytest.fixture(scope="session")
+def ocr_backend() -> str:
+    '''
+    tesserocr backend, the tests that run OCR are skipped when it or the spa language is missing
+    '''
+    try:
+        create_ocr_api("tesserocr").recognise_text_to_data(np.full((40, 120), 255, np.uint8), lang="spa")
+    except Exception as error:
+        pytest.skip(f"tesserocr with the spa language is not available: {error}")
+    return "tesserocr"
+
+
+@pytest.fixture
+def pipeline_settings(ocr_backend: str) -> dict:
+    '''
+    Settings of a batch or service worker, with the pattern-only DNI recognizer so no spaCy model is loaded
+    '''
+    analyser_kwargs = dict(recognizers=("DNI",), excluded_recognizers=(), filtered_words=(), unfiltered_words=(), cache_size=0, cache_dir=None)
+    return dict(ocr_backend = ocr_backend, tesseract_path = None, ocr_cache_dir = None, ocr_cache_size = 64, ocr_scale = None,
+                analyser_kwargs = analyser_kwargs, obfuscation_mode = 'fill', frame_diff_threshold = 2, change_metric = 'pixel',
+                dirty_regions = False, text_regions = False, ocr_threads = 1, track = False, track_confidence = 0.5,
+                incremental_analysis = False, encoder_settings = EncoderSettings(preset = "ultrafast"), verbose = False)
+
+
+@pytest.fixture
+def text_video(tmp_path) -> str:
+    '''
+    Short video of a text page whose second line appears halfway
+    '''
+    path = str(tmp_path / "text.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (320, 160))
+    for frame_index in range(20):
+        frame = np.full((160, 320, 3), 255, np.uint8)
+        cv2.putText(frame, "Informe de ventas", (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        if frame_index >= 10:
+            cv2.putText(frame, "DNI 12345678Z", (10, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        writer.write(frame)
+    writer.release()
+    return path
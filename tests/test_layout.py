@@ -0,0 +1,41 @@
+from analyser.analyser import SensitiveSpan
+from ocr.layout import TextBox, TextLayout
+
+
+def word(text, x, y, line_num, block_num=1):
+    return TextBox(text, x, y, 10 * len(text), 20, block_num, 1, line_num)
+
+
+def test_text_keeps_one_line_per_row_and_the_word_offsets():
+    layout = TextLayout([word("DNI:", 0, 0, 1), word("12345678Z", 50, 0, 1), word("", 200, 0, 1),
+                         word("Telefono", 0, 30, 2), word("612345678", 90, 30, 2)])
+
+    assert layout.text == "DNI: 12345678Z\nTelefono 612345678"
+    assert layout.line_texts == ["DNI: 12345678Z", "Telefono 612345678"]
+    assert [line.start for line in layout.lines] == [0, 15]
+    start = layout.text.index("612345678")
+    assert [box.text for box in layout.span_boxes(start, start + 9)] == ["612345678"]
+
+
+def test_span_boxes_give_one_box_per_line():
+    layout = TextLayout([word("Calle", 0, 0, 1), word("Mayor", 60, 0, 1), word("7,", 0, 30, 2), word("Madrid", 30, 30, 2)])
+
+    boxes = layout.span_boxes(0, len("Calle Mayor\n7,"))
+
+    assert [(box.text, box.x, box.y, box.w, box.h) for box in boxes] == [("Calle Mayor", 0, 0, 110, 20), ("7,", 0, 30, 20, 20)]
+
+
+def test_span_boxes_cover_the_words_a_span_touches():
+    layout = TextLayout([word("CP:", 0, 0, 1), word("28001", 40, 0, 1), word("Madrid", 100, 0, 1)])
+
+    # a span starting inside a word still redacts the whole word
+    assert [box.text for box in layout.span_boxes(5, 9)] == ["28001"]
+    assert layout.span_boxes(3, 4) == []
+
+
+def test_entity_boxes_keep_the_first_entity_of_a_box():
+    layout = TextLayout([word("DNI:", 0, 0, 1), word("12345678Z", 50, 0, 1)])
+
+    entity_boxes = layout.entity_boxes([SensitiveSpan(5, 14, "DNI"), SensitiveSpan(5, 14, "OTHER")])
+
+    assert [(box.text, entity) for box, entity in entity_boxes] == [("12345678Z", "DNI")]
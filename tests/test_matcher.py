@@ -0,0 +1,34 @@
+import pytest
+
+import ocr.matcher
+from ocr.matcher import WordMatcher
+
+
+@pytest.fixture(params=["pyahocorasick", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(ocr.matcher, "ahocorasick", None)
+    elif ocr.matcher.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    return request.param
+
+
+def test_find_all_gives_the_offsets_of_every_occurrence(backend):
+    matcher = WordMatcher(["secreto", "clave"])
+    text = "la clave es secreto, otra clave"
+
+    assert sorted(matcher.find_all(text)) == [(3, 8, "clave"), (12, 19, "secreto"), (26, 31, "clave")]
+
+
+def test_find_all_follows_the_failure_links(backend):
+    matcher = WordMatcher(["he", "she", "hers"])
+
+    found = {(start, end) for start, end, _ in matcher.find_all("ushers")}
+
+    # the pure Python automaton only gives the longest word ending at each offset
+    assert {(1, 4), (2, 6)} <= found
+
+
+def test_find_all_without_words_finds_nothing(backend):
+    assert list(WordMatcher([]).find_all("texto")) == []
+    assert list(WordMatcher(["", "x"]).find_all("abc")) == []
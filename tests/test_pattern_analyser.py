@@ -0,0 +1,29 @@
+import importlib.util
+import random
+
+import pytest
+
+from analyser.analyser import OCRAnalyser
+from benchmark.synthetic import fake_lines
+
+PATTERN_RECOGNIZERS = ["DOB", "DNI", "PHONE", "ADDRESS", "POSTAL_CODE_CITY"]
+
+
+@pytest.fixture(scope="module")
+def spacy_config():
+    model = next((name for name in ("es_core_news_md", "es_core_news_sm") if importlib.util.find_spec(name)), None)
+    if model is None:
+        pytest.skip("no Spanish spaCy model is installed")
+    return {"nlp_engine_name": "spacy", "models": [{"lang_code": "es", "model_name": model}]}
+
+
+def test_pattern_analyser_finds_the_same_spans_as_presidio(spacy_config):
+    pattern = OCRAnalyser(recognizers=PATTERN_RECOGNIZERS, cache_size=0)
+    presidio = OCRAnalyser(analyser_config=spacy_config, recognizers=PATTERN_RECOGNIZERS, cache_size=0, pattern_fast_path=False)
+    assert pattern.load_report["engine"] == "pattern"
+
+    rng = random.Random(7)
+    texts = ['\n'.join(text + value for text, value in fake_lines(rng, 3)) for _ in range(20)]
+    texts += ["Sin datos personales", "DNI 00000000A no es valido", ""]
+    for text in texts:
+        assert pattern.analyse_text_to_spans(text, "es") == presidio.analyse_text_to_spans(text, "es"), text
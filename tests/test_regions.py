@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+from ocr.layout import TextBox, TextLayout
+from ocr.regions import change_mask, dirty_rectangles, merge_text_boxes, number_blocks, rectangles_overlap, shift_boxes
+
+
+def word(text, x, y, block_num, line_num=1):
+    return TextBox(text, x, y, 10 * len(text), 20, block_num, 1, line_num)
+
+
+def test_number_blocks_keeps_the_blocks_of_each_run_apart():
+    first = [word("a", 0, 0, 1), word("b", 0, 30, 2)]
+    second = [word("c", 0, 60, 1), word("d", 0, 90, 1)]
+
+    boxes = number_blocks([first, second, []])
+
+    assert [box.block_num for box in boxes] == [1, 2, 3, 3]
+
+
+def test_merge_replaces_the_boxes_of_the_ocr_regions_in_reading_order():
+    cached = [word("Curso", 0, 0, 1), word("2023", 60, 0, 1), word("Fin", 0, 100, 2)]
+    # the region covers 2023, and a new line below the first one
+    region = (50, 0, 100, 60)
+    new = [word("2024", 60, 0, 1), word("Nuevo", 60, 40, 2)]
+
+    text_boxes = merge_text_boxes(cached, new, [region])
+
+    assert TextLayout(text_boxes).text == "Curso 2024\nNuevo\nFin"
+
+
+def test_merge_joins_new_words_to_the_line_they_align_with():
+    cached = [word("DNI:", 0, 0, 1), word("Fin", 0, 50, 2)]
+    new = [word("12345678Z", 50, 2, 1)]
+
+    text_boxes = merge_text_boxes(cached, new, [(45, 0, 100, 25)])
+
+    assert TextLayout(text_boxes).text == "DNI: 12345678Z\nFin"
+
+
+def test_dirty_regions_include_text_that_appeared_below_the_change_threshold():
+    # text that appeared after the last OCR, in a frame that was not OCR'd, and a line that appears later
+    reference = np.full((200, 400), 255, np.uint8)
+    quiet = reference.copy()
+    cv2.putText(quiet, "612345678", (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+    frame = quiet.copy()
+    cv2.putText(frame, "Resumen del equipo", (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+
+    rectangles = dirty_rectangles(change_mask(reference, frame), [])
+
+    assert any(rectangles_overlap(rectangle, (20, 35, 100, 20)) for rectangle in rectangles)
+    assert any(rectangles_overlap(rectangle, (20, 130, 250, 25)) for rectangle in rectangles)
+
+
+def test_shift_boxes_moves_copies_and_drops_the_boxes_out_of_the_frame():
+    boxes = [word("arriba", 0, 5, 1), word("abajo", 0, 100, 2)]
+
+    moved = shift_boxes(boxes, (0, -40), (200, 400))
+
+    assert [(box.text, box.y) for box in moved] == [("abajo", 60)]
+    assert boxes[1].y == 100
@@ -0,0 +1,18 @@
+from video.keyframes import KeyframeIndex
+from video.segments import plan_segments
+
+
+def test_segments_of_about_the_same_length_cover_every_frame():
+    assert plan_segments(0, 100, 4) == [(0, 25), (25, 50), (50, 75), (75, 100)]
+    assert plan_segments(30, 130, 2) == [(30, 80), (80, 130)]
+
+
+def test_short_segments_are_merged():
+    assert plan_segments(0, 25, 4, min_frames=10) == [(0, 12), (12, 25)]
+    assert plan_segments(0, 5, 3) == [(0, 5)]
+
+
+def test_boundaries_move_back_to_the_keyframe_before_them():
+    keyframe_index = KeyframeIndex("video.mp4", 100, 30.0, 2, keyframes=[0, 20, 45, 70, 90])
+
+    assert plan_segments(0, 100, 4, keyframe_index) == [(0, 20), (20, 45), (45, 70), (70, 100)]
@@ -0,0 +1,47 @@
+import multiprocessing
+import signal
+
+import main2
+import service
+from analyser.analyser import OCRAnalyser
+from video.encoder import FFmpegVideoWriter
+from video.source import FrameSource
+
+
+def test_failing_jobs_release_the_decoder_and_ffmpeg(tmp_path, monkeypatch, pipeline_settings, text_video):
+    sources, writers = [], []
+
+    class RecordingSource(FrameSource):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            sources.append(self)
+
+    class RecordingWriter(FFmpegVideoWriter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            writers.append(self)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("analysis failed")
+
+    monkeypatch.setattr(main2, "FrameSource", RecordingSource)
+    monkeypatch.setattr(main2, "FFmpegVideoWriter", RecordingWriter)
+    monkeypatch.setattr(OCRAnalyser, "analyse_text_to_spans", fail)
+    # the worker loop runs in the test process, it must keep the signal handlers of pytest
+    monkeypatch.setattr(signal, "signal", lambda *args: None)
+
+    connection, worker_connection = multiprocessing.Pipe()
+    for i in range(3):
+        connection.send(dict(input = text_video, output = str(tmp_path / f"out{i}.mp4"), options = {}))
+    connection.send(None)
+    service._serve_jobs(worker_connection, pipeline_settings)
+
+    assert connection.recv()["ready"]
+    results = [connection.recv() for _ in range(3)]
+    assert [result["status"] for result in results] == ['failed'] * 3
+    assert all("analysis failed" in result["error"] for result in results)
+    # one warm worker ran the three jobs, none of them left a decode thread or an ffmpeg process behind
+    assert len(sources) == len(writers) == 3
+    assert not any(source._thread.is_alive() for source in sources)
+    assert all(writer._process is None for writer in writers)
+    assert not list(tmp_path.glob("*.partial*"))
@@ -0,0 +1,32 @@
+import pytest
+
+from video.track import DetectionTrack
+
+
+@pytest.fixture
+def track():
+    track = DetectionTrack.for_input("video.mp4", 30.0, 640, 360, 1.5, None)
+    for frame_index in range(10):
+        detections = [(10, 20, 30, 40, "DNI")] if frame_index < 4 else [(12, 20, 30, 40, "DNI"), (50, 60, 70, 80, "PHONE")]
+        track.add(frame_index, detections)
+    track.add(12, [])
+    return track
+
+
+def test_consecutive_frames_with_the_same_detections_share_a_range(track):
+    assert [(detection_range.start, detection_range.end) for detection_range in track.ranges] == [(0, 4), (4, 10), (12, 13)]
+
+
+@pytest.mark.parametrize("name", ["track.npz", "track.json"])
+def test_save_and_load_give_the_same_track(tmp_path, track, name):
+    path = str(tmp_path / name)
+    track.save(path)
+
+    assert DetectionTrack.load(path) == track
+
+
+def test_detections_at_in_order_and_back(track):
+    assert [len(track.detections_at(frame_index)) for frame_index in range(14)] == [1] * 4 + [2] * 6 + [0, 0, 0, 0]
+    assert track.rectangles_at(2) == [(10, 20, 30, 40)]
+    assert track.detections_at(-1) == []
+    assert DetectionTrack.for_input("video.mp4", 30.0, 640, 360).detections_at(0) == []
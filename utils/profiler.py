@@ -0,0 +1,102 @@
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 5.0
+
+PERCENTILES = [50, 95, 99]
+
+
+class StageProfiler:
+    '''
+    Collects the latency of every pipeline stage and counters of a run.
+
+    Stages are timed with the stage() context manager or recorded directly,
+    e.g. with the timings measured by the worker processes.
+    '''
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counters = Counter()
+        self._durations = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._durations[name].append(time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self._durations[name].append(seconds)
+
+    def record_all(self, timings: dict[str, float]):
+        for name, seconds in timings.items():
+            self.record(name, seconds)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self, metadata: dict = None) -> dict:
+        stages = {}
+        for name, durations in self._durations.items():
+            latencies = np.array(durations) * 1000
+            stages[name] = {
+                "count": len(durations),
+                "total_seconds": round(float(latencies.sum()) / 1000, 4),
+                "mean_ms": round(float(latencies.mean()), 3),
+                **{f"p{p}_ms": round(float(value), 3) for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+            }
+
+        elapsed = self.elapsed()
+        frames = self.counters["frames"]
+        return {
+            **(metadata or {}),
+            "wall_seconds": round(elapsed, 3),
+            "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+            "counters": dict(self.counters),
+            "stages": stages,
+        }
+
+    def save(self, path: str, metadata: dict = None):
+        with open(path, "w") as report_file:
+            json.dump(self.report(metadata), report_file, indent=2)
+
+
+class ProgressLine:
+    '''
+    Prints the progress of a video to stderr every interval seconds
+    '''
+    def __init__(self, profiler: StageProfiler, total_frames: int, interval: float = PROGRESS_INTERVAL):
+        self.profiler = profiler
+        self.total_frames = total_frames
+        self.interval = interval
+        self._last = time.perf_counter()
+
+    def update(self):
+        now = time.perf_counter()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+
+        counters = self.profiler.counters
+        frames = counters["frames"]
+        elapsed = self.profiler.elapsed()
+        fps = frames / elapsed if elapsed else 0.0
+        line = f"[progress] {frames}"
+        if self.total_frames > 0:
+            eta = (self.total_frames - frames) / fps if fps else 0.0
+            line += f"/{self.total_frames} frames ({frames * 100 / self.total_frames:.1f}%), ETA {eta:.0f}s"
+        else:
+            line += " frames"
+        line += f", {fps:.1f} fps, {counters['ocr_frames']} OCR / {counters['reuse_frames']} reused"
+        print(line, file=sys.stderr, flush=True)
@@ -0,0 +1,171 @@
+import math
+
+import cv2
+import numpy as np
+
+CHANGE_METRICS = ["pixel", "block", "phash"]
+
+# Width of the grayscale copy frames are compared on, the height keeps the aspect ratio
+DETECTION_WIDTH = 320
+
+# Minimum grey level difference for a pixel to count as changed
+PIXEL_THRESHOLD = 30
+
+# Side in pixels of the blocks of the block metric, on the downsampled copy
+BLOCK_SIZE = 8
+
+# Minimum mean grey level difference for a block to count as changed
+BLOCK_THRESHOLD = 10
+
+# Side of the image the DCT of the perceptual hash runs on, and of the low frequencies it keeps
+HASH_IMAGE_SIZE = 32
+HASH_SIZE = 8
+
+
+def downsample(gray: np.ndarray, width: int = DETECTION_WIDTH) -> np.ndarray:
+    '''
+    Small copy of a grayscale frame, frames narrower than width are kept as they are
+    '''
+    height, frame_width = gray.shape[:2]
+    if frame_width <= width:
+        return gray
+    return cv2.resize(gray, (width, max(round(height * width / frame_width), 1)), interpolation=cv2.INTER_AREA)
+
+
+def shift_image(gray: np.ndarray, shift: tuple[int, int]) -> np.ndarray:
+    '''
+    Frame moved by (dx, dy) pixels, the strip uncovered at the edge repeats the edge pixels
+    '''
+    if not any(shift):
+        return gray
+    matrix = np.float32([[1, 0, shift[0]], [0, 1, shift[1]]])
+    return cv2.warpAffine(gray, matrix, (gray.shape[1], gray.shape[0]), flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_REPLICATE)
+
+
+def exposed_change(reference: np.ndarray, image: np.ndarray, shift: tuple[float, float]) -> float:
+    '''
+    Percentage of changed pixels in the strips a shift of (dx, dy) pixels uncovered at the edges,
+    the content that scrolled into view. Counted on the strips alone, a line of text coming
+    into view is a change however small it is next to the whole frame
+    '''
+    height, width = image.shape[:2]
+    dx, dy = min(math.ceil(abs(shift[0])), width), min(math.ceil(abs(shift[1])), height)
+    strips = []
+    if dy:
+        strips.append(np.s_[:dy] if shift[1] > 0 else np.s_[height - dy:])
+    if dx:
+        strips.append(np.s_[:, :dx] if shift[0] > 0 else np.s_[:, width - dx:])
+    return max((pixel_change(reference[strip], image[strip]) for strip in strips), default=0.0)
+
+
+def pixel_change(reference: np.ndarray, image: np.ndarray) -> float:
+    '''
+    Percentage of pixels whose grey level changed
+    '''
+    changed = np.count_nonzero(cv2.absdiff(reference, image) > PIXEL_THRESHOLD)
+    return changed * 100 / image.size
+
+
+def block_change(reference: np.ndarray, image: np.ndarray) -> float:
+    '''
+    Percentage of blocks whose mean grey level difference is above BLOCK_THRESHOLD,
+    isolated noisy pixels do not add up as they do with the pixel metric
+    '''
+    height, width = image.shape[:2]
+    grid = (max(width // BLOCK_SIZE, 1), max(height // BLOCK_SIZE, 1))
+    block_means = cv2.resize(cv2.absdiff(reference, image), grid, interpolation=cv2.INTER_AREA)
+    return np.count_nonzero(block_means > BLOCK_THRESHOLD) * 100 / block_means.size
+
+
+def perceptual_hash(image: np.ndarray) -> np.ndarray:
+    '''
+    pHash: signs of the lowest DCT frequencies against their median, without the DC term
+    '''
+    small = cv2.resize(image, (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    frequencies = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()[1:]
+    return frequencies > np.median(frequencies)
+
+
+def hash_change(reference: np.ndarray, image_hash: np.ndarray) -> float:
+    '''
+    Percentage of hash bits that differ
+    '''
+    return np.count_nonzero(reference != image_hash) * 100 / image_hash.size
+
+
+class ChangeDetector:
+    '''
+    Decides whether a frame changed enough since the last OCR'd frame to be OCR'd again.
+
+    Frames are compared raw, never after anonymisation, on a small grayscale copy
+    and with one of the CHANGE_METRICS. threshold is a percentage for every metric:
+    of changed pixels, of changed blocks or of differing hash bits.
+    '''
+    def __init__(self, threshold: float, metric: str = "pixel", width: int = DETECTION_WIDTH):
+        if metric not in CHANGE_METRICS:
+            raise ValueError(f"Unknown change metric {metric}, expected one of {CHANGE_METRICS}")
+        self.threshold = threshold
+        self.metric = metric
+        self.width = width
+        self._change = {"pixel": pixel_change, "block": block_change, "phash": hash_change}[metric]
+        self._reference = None
+        self._signature = None
+        # full size frame of the reference, moved along with the content by motion-compensated checks
+        self._reference_gray = None
+        self._gray = None
+
+        self.checks = 0
+        self.changed_frames = 0
+        self.total_change = 0.0
+
+    def signature(self, gray: np.ndarray) -> np.ndarray:
+        return self._image_signature(downsample(gray, self.width))
+
+    def _image_signature(self, image: np.ndarray) -> np.ndarray:
+        return perceptual_hash(image) if self.metric == "phash" else image
+
+    def check(self, gray: np.ndarray, shift: tuple[int, int] = None) -> bool:
+        '''
+        Whether the frame changed more than threshold since the reference frame,
+        there is always a change before the first reference.
+        shift is how far the content moved since the reference frame (e.g. a scroll followed by
+        the tracker): the reference is moved by it first, so only what scrolled into view counts,
+        measured on the uncovered strips on their own
+        '''
+        self._gray = gray
+        image = downsample(gray, self.width)
+        self._signature = self._image_signature(image)
+        if self._reference is None or self._reference.shape != self._signature.shape:
+            change = 100.0
+        elif shift is None or not any(shift) or self._reference_gray.shape != gray.shape:
+            change = float(self._change(self._reference, self._signature))
+        else:
+            moved = downsample(shift_image(self._reference_gray, shift), self.width)
+            scale = image.shape[1] / gray.shape[1]
+            change = max(float(self._change(self._image_signature(moved), self._signature)),
+                         exposed_change(moved, image, (shift[0] * scale, shift[1] * scale)))
+
+        changed = bool(change >= self.threshold)
+        self.checks += 1
+        self.changed_frames += changed
+        self.total_change += change
+        return changed
+
+    def set_reference(self, gray: np.ndarray = None):
+        '''
+        Compare the next frames with this one, the last checked frame by default
+        '''
+        if gray is None:
+            self._reference, self._reference_gray = self._signature, self._gray
+        else:
+            self._reference, self._reference_gray = self.signature(gray), gray
+
+    def stats(self) -> dict:
+        return {
+            "metric": self.metric,
+            "threshold": self.threshold,
+            "checks": self.checks,
+            "changed": self.changed_frames,
+            "change_rate": self.changed_frames / self.checks if self.checks else 0.0,
+            "mean_change": round(self.total_change / self.checks, 3) if self.checks else 0.0,
+        }
@@ -0,0 +1,116 @@
+import os
+from dataclasses import dataclass
+
+import ffmpeg
+import numpy as np
+
+DEFAULT_CODEC = "libx264"
+DEFAULT_PRESET = "medium"
+DEFAULT_CRF = 23
+
+# Pixel format of the encoded video, the one every player supports
+OUTPUT_PIX_FMT = "yuv420p"
+
+
+@dataclass
+class EncoderSettings:
+    codec: str = DEFAULT_CODEC
+    preset: str = DEFAULT_PRESET
+    crf: int = DEFAULT_CRF
+    # e.g. zerolatency for live output, None keeps the encoder default
+    tune: str = None
+
+
+def retrieve_ffmpeg_path() -> str:
+    '''
+    ffmpeg executable from the FFMPEG_PATH environment variable, or the one in PATH
+    '''
+    return os.getenv("FFMPEG_PATH") or "ffmpeg"
+
+
+def input_audio(input: str, start: float = None, duration: float = None) -> ffmpeg.nodes.FilterableStream:
+    '''
+    Audio stream of the input between start and start + duration (in seconds)
+    '''
+    audio_options = {}
+    if start:
+        audio_options["ss"] = start
+    if duration is not None:
+        audio_options["t"] = duration
+    # "?" keeps inputs without audio working
+    return ffmpeg.input(input, **audio_options)["a?"]
+
+
+def concat_videos(paths: list[str], output: str, input: str, start: float = None, duration: float = None):
+    '''
+    Join videos encoded with the same settings without re-encoding them (ffmpeg concat demuxer),
+    and copy the audio of the input file back in
+    '''
+    list_path = f"{output}.concat.txt"
+    with open(list_path, "w") as list_file:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        video = ffmpeg.input(list_path, format="concat", safe=0)["v"]
+        stream = ffmpeg.output(video, input_audio(input, start, duration), output, c="copy")
+        stream.overwrite_output().global_args("-loglevel", "error").run(cmd=retrieve_ffmpeg_path())
+    finally:
+        os.remove(list_path)
+
+
+class FFmpegVideoWriter:
+    '''
+    Streams raw BGR frames into a single ffmpeg process that encodes the video
+    and copies the audio of the input file, so the output is written in one pass.
+
+    It has the write/release interface of cv2.VideoWriter. When only part of the
+    input is processed, start and duration (in seconds) cut the audio to match.
+    Without audio only the video stream is written, e.g. for segments joined later.
+    format is the ffmpeg output format of outputs without a file extension (stream URLs, pipes).
+    '''
+    def __init__(self, output: str, input: str, frame_width: int, frame_height: int, frame_rate: float, settings: EncoderSettings = None,
+                 start: float = None, duration: float = None, audio: bool = True, format: str = None):
+        settings = settings or EncoderSettings()
+        self.frame_shape = (frame_height, frame_width, 3)
+
+        video = ffmpeg.input("pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{frame_width}x{frame_height}", framerate=frame_rate)
+        streams = [video, input_audio(input, start, duration)] if audio else [video]
+        output_options = {"acodec": "copy"} if audio else {}
+        if settings.tune:
+            output_options["tune"] = settings.tune
+        if format:
+            output_options["format"] = format
+        stream = ffmpeg.output(*streams, output,
+                               vcodec=settings.codec, preset=settings.preset, crf=settings.crf,
+                               pix_fmt=OUTPUT_PIX_FMT, **output_options)
+        self._process = stream.overwrite_output().global_args("-loglevel", "error").run_async(cmd=retrieve_ffmpeg_path(), pipe_stdin=True)
+
+    def write(self, frame: np.ndarray):
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame of shape {frame.shape} does not match the video shape {self.frame_shape}")
+        self._process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        return_code = self._process.wait()
+        self._process = None
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code}")
+
+    def abort(self):
+        '''
+        Kill ffmpeg without finishing the output, when the frames stop because of an error
+        '''
+        if self._process is None:
+            return
+        self._process.kill()
+        self._process.wait()
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            # frames still buffered for the killed process
+            pass
+        self._process = None
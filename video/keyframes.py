@@ -0,0 +1,122 @@
+import bisect
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+import cv2
+import numpy as np
+
+from video.source import FrameSource
+
+# Size of the grayscale thumbnail used as change signature
+SIGNATURE_SIZE = (64, 36)
+
+# Minimum grey level difference for a signature pixel to count as changed
+PIXEL_THRESHOLD = 30
+
+
+@dataclass
+class KeyframeIndex:
+    '''
+    Text keyframes of a video, every other frame reuses the detections of its keyframe
+    '''
+    input: str
+    frame_count: int
+    frame_rate: float
+    threshold: float
+    input_mtime: float = 0.0
+    keyframes: list[int] = field(default_factory=list)
+    changes: list[float] = field(default_factory=list)
+
+    def is_keyframe(self, frame_index: int) -> bool:
+        position = bisect.bisect_left(self.keyframes, frame_index)
+        return position < len(self.keyframes) and self.keyframes[position] == frame_index
+
+    def keyframe_of(self, frame_index: int) -> int:
+        '''
+        Return the keyframe whose detections apply to the given frame
+        '''
+        position = bisect.bisect_right(self.keyframes, frame_index)
+        return self.keyframes[max(position - 1, 0)]
+
+    def matches(self, input: str, threshold: float) -> bool:
+        return (self.input == os.path.abspath(input)
+                and self.input_mtime == os.path.getmtime(input)
+                and self.threshold == threshold)
+
+    def estimate(self) -> dict:
+        '''
+        Cost estimate of the main pass: OCR + analysis only runs on keyframes
+        '''
+        return {
+            "frames": self.frame_count,
+            "keyframes": len(self.keyframes),
+            "keyframe_ratio": len(self.keyframes) / self.frame_count if self.frame_count else 0.0,
+            "duration_seconds": self.frame_count / self.frame_rate if self.frame_rate else 0.0,
+        }
+
+    def save(self, path: str):
+        with open(path, "w") as index_file:
+            json.dump(asdict(self), index_file)
+
+    @classmethod
+    def load(cls, path: str) -> "KeyframeIndex":
+        with open(path) as index_file:
+            return cls(**json.load(index_file))
+
+
+def frame_signature(frame: np.ndarray) -> np.ndarray:
+    '''
+    Cheap change signature: a small grayscale thumbnail of the frame
+    '''
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def signature_change(prev_signature: np.ndarray, signature: np.ndarray) -> float:
+    '''
+    Percentage of signature pixels that changed
+    '''
+    changed = np.count_nonzero(cv2.absdiff(prev_signature, signature) > PIXEL_THRESHOLD)
+    return changed * 100 / signature.size
+
+
+def build_keyframe_index(input: str, threshold: float) -> KeyframeIndex:
+    '''
+    Fast first pass over the video that marks a keyframe whenever the frame moved
+    more than threshold percent away from the last keyframe (shot cuts, slide changes)
+    '''
+    source = FrameSource(input)
+
+    index = KeyframeIndex(
+        input = os.path.abspath(input),
+        frame_count = 0,
+        frame_rate = source.frame_rate,
+        threshold = threshold,
+        input_mtime = os.path.getmtime(input))
+    keyframe_signature = None
+    for _, frame, _ in source:
+        signature = frame_signature(frame)
+        change = 100.0 if keyframe_signature is None else signature_change(keyframe_signature, signature)
+        if change >= threshold:
+            index.keyframes.append(index.frame_count)
+            keyframe_signature = signature
+        index.changes.append(round(change, 2))
+        index.frame_count += 1
+
+    source.close()
+    return index
+
+
+def load_or_build_keyframe_index(path: str, input: str, threshold: float) -> KeyframeIndex:
+    '''
+    Reuse the index stored at path if it was built for the same input and threshold
+    '''
+    if os.path.exists(path):
+        index = KeyframeIndex.load(path)
+        if index.matches(input, threshold):
+            return index
+
+    index = build_keyframe_index(input, threshold)
+    index.save(path)
+    return index
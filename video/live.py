@@ -0,0 +1,195 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+import cv2
+import numpy as np
+
+from ocr.api import TextBox
+from utils.profiler import StageProfiler
+
+# Frames read ahead of the output path, a small buffer keeps the lag bounded
+LIVE_BUFFER_FRAMES = 4
+
+# Frame rate assumed when the stream does not report one
+DEFAULT_LIVE_FRAME_RATE = 25.0
+
+# Target end-to-end latency in milliseconds, frames written later count as late
+DEFAULT_MAX_LATENCY_MS = 500
+
+# ffmpeg output format of stream URLs by protocol, outputs that are files keep the format of their extension
+LIVE_OUTPUT_FORMATS = {"rtmp": "flv", "rtsp": "rtsp"}
+DEFAULT_LIVE_OUTPUT_FORMAT = "mpegts"
+
+# Seconds between checks of the stop flag while the buffer is full
+PUT_TIMEOUT = 0.1
+
+_END = object()
+
+
+def live_output_format(output: str) -> str:
+    '''
+    ffmpeg format of a live output: None for files, the format of the protocol for URLs and pipes
+    '''
+    if "://" not in output and not output.startswith("pipe:"):
+        return None
+    return LIVE_OUTPUT_FORMATS.get(output.split("://")[0], DEFAULT_LIVE_OUTPUT_FORMAT)
+
+
+@dataclass
+class LiveFrame:
+    index: int
+    frame: np.ndarray
+    # time.perf_counter() when the frame was read from the stream
+    captured: float
+
+
+@dataclass
+class LiveDetections:
+    '''
+    Result of the analysis of one frame, version increases with every new result
+    '''
+    version: int
+    frame_index: int
+    captured: float
+    gray: np.ndarray
+    # boxes of the sensitive spans with their entity type
+    entity_boxes: list[tuple[TextBox, str]]
+
+
+class LiveSource:
+    '''
+    Frames of a live stream (URL, pipe:0, camera index) read on a background thread.
+
+    No frame is dropped: when the output path falls behind, the buffer fills and
+    the lag shows in the latency. A file is paced at its frame rate to stand in
+    for a live feed.
+    '''
+    def __init__(self, input: str, buffer: int = LIVE_BUFFER_FRAMES):
+        self._cap = cv2.VideoCapture(int(input) if input.isdigit() else input)
+        if not self._cap.isOpened():
+            raise IOError(f"Could not open stream: {input}")
+
+        self.frame_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_rate = self._cap.get(cv2.CAP_PROP_FPS)
+        self.frame_rate = frame_rate if 0 < frame_rate < 1000 else DEFAULT_LIVE_FRAME_RATE
+        self.paced = os.path.isfile(input)
+
+        self._buffer = queue.Queue(maxsize=buffer)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        index = 0
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            if self.paced:
+                # a file is read as fast as the disk allows, wait for the time the frame would be captured
+                delay = started + index / self.frame_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            ret, frame = self._cap.read()
+            if not ret:
+                break
+            # the frame of a file was due at its scheduled time, a late read counts in the latency
+            captured = started + index / self.frame_rate if self.paced else time.perf_counter()
+            self._put(LiveFrame(index, frame, captured))
+            index += 1
+        self._put(_END)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._buffer.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[LiveFrame]:
+        while True:
+            item = self._buffer.get()
+            if item is _END:
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._cap.release()
+
+
+class LatestFrameAnalyser:
+    '''
+    Runs OCR and analysis on a background thread, always on the newest frame submitted.
+
+    A frame submitted while another one waits replaces it, so when OCR falls
+    behind frames are dropped from the analysis, never from the output. The
+    output path reads the latest result without ever waiting for it.
+    '''
+    def __init__(self, analyse: Callable[[np.ndarray], list[tuple[TextBox, str]]], profiler: StageProfiler):
+        self._analyse = analyse
+        self._profiler = profiler
+        self._condition = threading.Condition()
+        self._pending = None
+        self._latest = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def latest(self) -> LiveDetections:
+        return self._latest
+
+    def submit(self, frame_index: int, gray: np.ndarray, captured: float):
+        with self._condition:
+            if self._pending is not None:
+                self._profiler.count("dropped_analysis_frames")
+            self._pending = (frame_index, gray, captured)
+            self._condition.notify()
+
+    def wait(self, timeout: float = None) -> LiveDetections:
+        '''
+        Block until a first result is available, None when the analysis stopped before it
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self._latest is not None or self._stopped, timeout)
+            return self._latest
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._stopped)
+                if self._stopped:
+                    return
+                frame_index, gray, captured = self._pending
+                self._pending = None
+
+            try:
+                entity_boxes = self._analyse(gray)
+            except Exception:
+                traceback.print_exc()
+                self._profiler.count("analysis_errors")
+                if self._latest is None:
+                    # nothing to redact the stream with, give up instead of waiting forever
+                    self.close(join=False)
+                    return
+                # keep the last detections applied, the next frame is analysed again
+                continue
+            self._profiler.count("ocr_frames")
+            with self._condition:
+                version = self._latest.version + 1 if self._latest is not None else 1
+                self._latest = LiveDetections(version, frame_index, captured, gray, entity_boxes)
+                self._condition.notify_all()
+
+    def close(self, join: bool = True):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if join:
+            self._thread.join()
@@ -0,0 +1,179 @@
+import multiprocessing
+from multiprocessing.pool import AsyncResult
+import queue
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from analyser.analyser import OCRAnalyser
+from ocr.api import TextBox, create_ocr_api
+from ocr.cache import DEFAULT_OCR_CACHE_MB, CachedOCRAPI, OCRCache
+from ocr.layout import TextLayout
+from ocr.preprocessor import OCRPreprocessor
+from ocr.regions import recognise_regions
+from ocr.text_detector import TextRegionDetector
+from utils.profiler import StageProfiler
+
+# Frames buffered between the decode stage and the writer, per worker
+QUEUE_FRAMES_PER_WORKER = 8
+
+# Per-process state, built once by the pool initializer
+_worker = {}
+
+
+def _init_worker(ocr_backend: str, tesseract_path: str, scaling_factor: float, analyser_kwargs: dict, verbose: bool, ocr_cache_dir: str, ocr_cache_size: int, text_regions: bool):
+    _worker["preprocessor"] = OCRPreprocessor(scaling_factor=scaling_factor)
+    _worker["ocr_api"] = create_ocr_api(ocr_backend, tesseract_path=tesseract_path)
+    if ocr_cache_dir:
+        # workers share the on-disk cache through its sqlite database
+        _worker["ocr_api"] = CachedOCRAPI(_worker["ocr_api"], OCRCache(ocr_cache_dir, ocr_cache_size))
+    _worker["analyser"] = OCRAnalyser(**analyser_kwargs)
+    _worker["text_detector"] = TextRegionDetector() if text_regions else None
+    _worker["verbose"] = verbose
+
+
+def _analyse_frame(frame: np.ndarray) -> tuple[list[tuple[TextBox, str]], dict[str, float]]:
+    verbose = _worker["verbose"]
+    start = time.perf_counter()
+    preprocessed_image = _worker["preprocessor"].preprocess_image(frame)
+    preprocessed = time.perf_counter()
+    # the frames of a worker are already OCR'd in parallel, the text regions are OCR'd in order
+    rectangles = _worker["text_detector"].detect(preprocessed_image) if _worker["text_detector"] is not None else None
+    if rectangles is not None:
+        _, text_boxes = recognise_regions(_worker["ocr_api"], preprocessed_image, rectangles, lang="spa", debug=verbose)
+    else:
+        _, text_boxes = _worker["ocr_api"].recognise_text_to_data(preprocessed_image, lang="spa", debug=verbose)
+    layout = TextLayout(_worker["preprocessor"].project_boxes(text_boxes))
+    recognised = time.perf_counter()
+    spans = _worker["analyser"].analyse_text_to_spans(layout.text, "es", debug=verbose)
+    analysed = time.perf_counter()
+
+    # stage timings measured in the worker, the writer stage records them
+    timings = {"preprocess": preprocessed - start, "ocr": recognised - preprocessed, "analysis": analysed - recognised}
+    return layout.entity_boxes(spans), timings
+
+
+class OCRWorkerPool:
+    '''
+    Pool of OCR + analysis processes, each one with its own warm OCR engine and analyser
+    '''
+    def __init__(self,
+            workers: int,
+            ocr_backend: str = "pytesseract",
+            tesseract_path: str = None,
+            scaling_factor: float = None,
+            analyser_kwargs: dict = None,
+            verbose: bool = False,
+            ocr_cache_dir: str = None,
+            ocr_cache_size: int = DEFAULT_OCR_CACHE_MB,
+            text_regions: bool = False):
+        self.workers = workers
+        self._pool = multiprocessing.Pool(
+            processes = workers,
+            initializer = _init_worker,
+            initargs = (ocr_backend, tesseract_path, scaling_factor, analyser_kwargs or {}, verbose, ocr_cache_dir, ocr_cache_size, text_regions))
+
+    def submit(self, frame: np.ndarray) -> AsyncResult:
+        '''
+        Queue a frame for OCR and analysis, the result resolves to (entity_boxes, timings)
+        where entity_boxes are the boxes of the sensitive spans with their entity type
+        '''
+        return self._pool.apply_async(_analyse_frame, (frame,))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+class OrderedFrameWriter:
+    '''
+    Writer stage that emits frames in decode order once the detections of their keyframe are ready.
+
+    Frames wait in a bounded queue, so the decode stage blocks when the writer falls
+    behind and memory stays capped at max_pending frames.
+    '''
+    def __init__(self, write: Callable[[np.ndarray, list[tuple[TextBox, str]]], None], max_pending: int, profiler: StageProfiler = None):
+        self._write = write
+        self._profiler = profiler
+        self._recorded = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._aborted = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, frame: np.ndarray, detections: AsyncResult):
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put((frame, detections), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        '''
+        Stop without writing the frames still waiting, after an error of the decode stage.
+        Detections of terminated workers never arrive, so the writer stops waiting for them
+        '''
+        self._aborted.set()
+        self._thread.join()
+
+    def _next_item(self):
+        while not self._aborted.is_set():
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _detections(self, detections: AsyncResult):
+        while not self._aborted.is_set():
+            try:
+                return detections.get(timeout=0.1)
+            except multiprocessing.TimeoutError:
+                continue
+        return None
+
+    def _run(self):
+        while True:
+            item = self._next_item()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            frame, detections = item
+            try:
+                result = self._detections(detections)
+                if result is None:
+                    break
+                entity_boxes, timings = result
+                if self._profiler is not None and detections is not self._recorded:
+                    # detections are shared by the frames of a keyframe, record them once
+                    self._profiler.record_all(timings)
+                    self._recorded = detections
+                self._write(frame, entity_boxes)
+            except Exception as error:
+                self._error = error
@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from typing import Callable
+
+from video.keyframes import KeyframeIndex
+
+# Times a failed segment is run again before the job fails
+SEGMENT_RETRIES = 2
+
+# Segments shorter than this are merged into the previous one, a forced OCR per segment is not worth it
+MIN_SEGMENT_FRAMES = 10
+
+
+@dataclass
+class Segment:
+    '''
+    Frames [start_frame, end_frame) of the input, end_frame None runs to the end of the video.
+    The segment process writes its video, detection track and report to the given paths
+    '''
+    index: int
+    start_frame: int
+    end_frame: int
+    output: str = None
+    detections: str = None
+    report: str = None
+
+
+def plan_segments(start_frame: int, end_frame: int, count: int, keyframe_index: KeyframeIndex = None, min_frames: int = MIN_SEGMENT_FRAMES) -> list[tuple[int, int]]:
+    '''
+    Split the frames between start_frame and end_frame in count segments of about the same length.
+    With a keyframe index every boundary is moved back to the text keyframe before it, the first
+    frame of a segment is always OCR'd, so no extra OCR is run
+    '''
+    boundaries = [start_frame]
+    for i in range(1, count):
+        boundary = start_frame + (end_frame - start_frame) * i // count
+        if keyframe_index is not None and keyframe_index.keyframes:
+            boundary = keyframe_index.keyframe_of(boundary)
+        if boundary - boundaries[-1] >= min_frames and end_frame - boundary >= min_frames:
+            boundaries.append(boundary)
+    boundaries.append(end_frame)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def run_segments(target: Callable[[Segment], None], segments: list[Segment], workers: int, retries: int = SEGMENT_RETRIES):
+    '''
+    Run target on every segment, each one in its own process and at most workers at a time.
+
+    A segment whose process fails (an exception, or a crash of Tesseract or ffmpeg)
+    is run again alone, up to retries times, the finished segments are kept.
+    '''
+    pending = deque(segments)
+    attempts = {segment.index: 0 for segment in segments}
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                segment = pending.popleft()
+                attempts[segment.index] += 1
+                process = multiprocessing.Process(target=target, args=(segment,), name=f"segment-{segment.index}")
+                process.start()
+                running[process.sentinel] = (process, segment)
+
+            for sentinel in wait(list(running)):
+                process, segment = running.pop(sentinel)
+                process.join()
+                if process.exitcode == 0:
+                    continue
+                if attempts[segment.index] > retries:
+                    raise RuntimeError(f"Segment {segment.index} failed {attempts[segment.index]} times, last exit code {process.exitcode}")
+                print(f"Segment {segment.index} failed with exit code {process.exitcode}, retrying it")
+                pending.append(segment)
+    finally:
+        for process, _ in running.values():
+            process.terminate()
+            process.join()
+
+
+def segment_paths(directory: str, index: int) -> dict[str, str]:
+    '''
+    Files of a segment inside the job's temporary directory
+    '''
+    name = os.path.join(directory, f"segment-{index:04d}")
+    return dict(output = f"{name}.mp4", detections = f"{name}.npz", report = f"{name}.json")
@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+from utils.profiler import StageProfiler
+
+# Frames decoded ahead of the processing loop
+PREFETCH_FRAMES = 16
+
+# Seconds between checks of the stop flag while the buffer is full
+PUT_TIMEOUT = 0.1
+
+_END = object()
+
+
+class FrameSource:
+    '''
+    Video frames decoded ahead on a background thread into a bounded buffer.
+
+    Iterating yields (frame_index, frame, analyse) for every frame between start
+    and end (in seconds). frame_index counts from the beginning of the video, and
+    analyse is only True every stride frames, the other frames are still emitted
+    so they can reuse the detections of the last analysed frame.
+    '''
+    def __init__(self, input: str, start: float = None, end: float = None, stride: int = 1, prefetch: int = PREFETCH_FRAMES, profiler: StageProfiler = None):
+        if stride < 1:
+            raise ValueError(f"Stride must be at least 1, got {stride}")
+
+        self._cap = cv2.VideoCapture(input)
+        if not self._cap.isOpened():
+            raise IOError(f"Could not open video: {input}")
+
+        self.frame_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_rate = self._cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.stride = stride
+        self._profiler = profiler
+
+        self.start_frame = self._to_frame(start) or 0
+        self.end_frame = self._to_frame(end)
+        if self.start_frame:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+
+        self._buffer = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+        self._thread.start()
+
+    @property
+    def start_time(self) -> float:
+        return self.start_frame / self.frame_rate if self.frame_rate else 0.0
+
+    @property
+    def total_frames(self) -> int:
+        '''
+        Number of frames between start and end
+        '''
+        end_frame = self.frame_count if self.end_frame is None else min(self.end_frame, self.frame_count)
+        return max(end_frame - self.start_frame, 0)
+
+    @property
+    def duration(self) -> float:
+        '''
+        Seconds between start and end, or None to the end of the video
+        '''
+        if self.end_frame is None or not self.frame_rate:
+            return None
+        return (self.end_frame - self.start_frame) / self.frame_rate
+
+    def _to_frame(self, seconds: float) -> int:
+        if seconds is None:
+            return None
+        return round(seconds * self.frame_rate)
+
+    def _decode(self):
+        frame_index = self.start_frame
+        try:
+            while not self._stop.is_set() and (self.end_frame is None or frame_index < self.end_frame):
+                start = time.perf_counter()
+                ret, frame = self._cap.read()
+                if self._profiler is not None:
+                    self._profiler.record("decode", time.perf_counter() - start)
+                if not ret:
+                    break
+                analyse = (frame_index - self.start_frame) % self.stride == 0
+                if not self._put((frame_index, frame, analyse)):
+                    return
+                frame_index += 1
+        except Exception as error:
+            self._put(error)
+            return
+        self._put(_END)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._buffer.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator[tuple[int, np.ndarray, bool]]:
+        while True:
+            start = time.perf_counter()
+            item = self._buffer.get()
+            if self._profiler is not None:
+                # time the processing loop waited for the decoder
+                self._profiler.record("decode_wait", time.perf_counter() - start)
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
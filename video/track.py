@@ -0,0 +1,109 @@
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+# A redaction rectangle of a frame and the entity type of the text under it
+Detection = tuple[int, int, int, int, str]
+
+
+@dataclass
+class DetectionRange:
+    '''
+    Frames [start, end) that share the same detections
+    '''
+    start: int
+    end: int
+    detections: list[Detection] = field(default_factory=list)
+
+
+@dataclass
+class DetectionTrack:
+    '''
+    Sensitive rectangles of every analysed frame of a video, with their entity types.
+
+    Consecutive frames with the same detections are stored as one range, so the
+    track of a video is a few KB. It is saved as columnar arrays in a .npz file,
+    or as JSON (any other extension) so it can be reviewed and edited by hand.
+    '''
+    input: str
+    frame_rate: float
+    frame_width: int
+    frame_height: int
+    start_time: float = None
+    end_time: float = None
+    ranges: list[DetectionRange] = field(default_factory=list)
+
+    def __post_init__(self):
+        # range of the last lookup, the render pass asks for the frames in increasing order
+        self._position = 0
+
+    def add(self, frame_index: int, detections: list[Detection]):
+        detections = [tuple(detection) for detection in detections]
+        last = self.ranges[-1] if self.ranges else None
+        if last is not None and last.end == frame_index and last.detections == detections:
+            last.end += 1
+        else:
+            self.ranges.append(DetectionRange(frame_index, frame_index + 1, detections))
+
+    def detections_at(self, frame_index: int) -> list[Detection]:
+        if not self.ranges:
+            return []
+        position = self._position
+        if position >= len(self.ranges) or frame_index < self.ranges[position].start:
+            # going back, walk again from the first range
+            position = 0
+        while position + 1 < len(self.ranges) and self.ranges[position + 1].start <= frame_index:
+            position += 1
+        self._position = position
+
+        detection_range = self.ranges[position]
+        if frame_index < detection_range.start or frame_index >= detection_range.end:
+            return []
+        return detection_range.detections
+
+    def rectangles_at(self, frame_index: int) -> list[tuple[int, int, int, int]]:
+        return [tuple(detection[:4]) for detection in self.detections_at(frame_index)]
+
+    def save(self, path: str):
+        if not path.endswith(".npz"):
+            with open(path, "w") as track_file:
+                json.dump(asdict(self), track_file)
+            return
+
+        detections = [detection for detection_range in self.ranges for detection in detection_range.detections]
+        entities = sorted({detection[4] for detection in detections})
+        metadata = {key: value for key, value in asdict(self).items() if key != "ranges"}
+        np.savez_compressed(
+            path,
+            metadata = np.array(json.dumps(metadata)),
+            starts = np.array([detection_range.start for detection_range in self.ranges], dtype=np.int32),
+            ends = np.array([detection_range.end for detection_range in self.ranges], dtype=np.int32),
+            counts = np.array([len(detection_range.detections) for detection_range in self.ranges], dtype=np.int32),
+            rectangles = np.array([detection[:4] for detection in detections], dtype=np.int32).reshape(-1, 4),
+            entity_ids = np.array([entities.index(detection[4]) for detection in detections], dtype=np.int16),
+            entities = np.array(entities, dtype=str))
+
+    @classmethod
+    def load(cls, path: str) -> "DetectionTrack":
+        if not path.endswith(".npz"):
+            with open(path) as track_file:
+                data = json.load(track_file)
+            ranges = [DetectionRange(detection_range["start"], detection_range["end"], [tuple(detection) for detection in detection_range["detections"]])
+                      for detection_range in data.pop("ranges")]
+            return cls(**data, ranges=ranges)
+
+        with np.load(path, allow_pickle=False) as data:
+            track = cls(**json.loads(str(data["metadata"])))
+            entities = [str(entity) for entity in data["entities"]]
+            offsets = np.concatenate([[0], np.cumsum(data["counts"])])
+            rectangles, entity_ids = data["rectangles"].tolist(), data["entity_ids"].tolist()
+            for i, (start, end) in enumerate(zip(data["starts"].tolist(), data["ends"].tolist())):
+                detections = [(*rectangles[j], entities[entity_ids[j]]) for j in range(offsets[i], offsets[i + 1])]
+                track.ranges.append(DetectionRange(start, end, detections))
+        return track
+
+    @classmethod
+    def for_input(cls, input: str, frame_rate: float, frame_width: int, frame_height: int, start_time: float = None, end_time: float = None) -> "DetectionTrack":
+        return cls(os.path.abspath(input), frame_rate, frame_width, frame_height, start_time, end_time)
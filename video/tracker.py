@@ -0,0 +1,99 @@
+from dataclasses import replace
+
+import cv2
+import numpy as np
+
+from ocr.api import TextBox
+
+# Maximum displacement in pixels a box can move between two consecutive frames
+SEARCH_MARGIN = 48
+
+# Minimum normalised correlation for a box to count as tracked
+MIN_CONFIDENCE = 0.7
+
+# Templates flatter than this standard deviation cannot be matched reliably
+MIN_TEMPLATE_STD = 2.0
+
+
+def tracking_image(frame: np.ndarray, scaling_factor: float = 1.0) -> np.ndarray:
+    '''
+    Grayscale copy of the frame in the coordinates of the OCR text boxes
+    '''
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if scaling_factor != 1.0:
+        gray = cv2.resize(gray, None, fx=scaling_factor, fy=scaling_factor, interpolation=cv2.INTER_LINEAR)
+    return gray
+
+
+class TextBoxTracker:
+    '''
+    Moves the sensitive text boxes along with the content between OCR runs.
+
+    Each box is located again in the next frame with template matching inside a
+    small search window around its last position. Templates are taken from the
+    frame that was OCR'd, so the boxes do not drift over time.
+    '''
+    def __init__(self, search_margin: int = SEARCH_MARGIN, min_confidence: float = MIN_CONFIDENCE):
+        self.search_margin = search_margin
+        self.min_confidence = min_confidence
+        self.text_boxes = []
+        self.confidence = 1.0
+        self._templates = []
+        self._origins = []
+
+    def reset(self, gray: np.ndarray, text_boxes: list[TextBox]):
+        '''
+        Start tracking the sensitive boxes found on this frame, text_boxes keeps their order
+        '''
+        self.text_boxes = []
+        self._templates = []
+        self._origins = []
+        self.confidence = 1.0
+        for text_box in text_boxes:
+            template = gray[text_box.y:text_box.y+text_box.h, text_box.x:text_box.x+text_box.w]
+            if template.size == 0:
+                # kept where it is, the boxes stay aligned with the ones given
+                template = None
+            self.text_boxes.append(replace(text_box))
+            self._templates.append(template.copy() if template is not None else None)
+            self._origins.append((text_box.x, text_box.y))
+
+    def displacement(self) -> tuple[int, int]:
+        '''
+        Median move (dx, dy) of the tracked boxes since the OCR'd frame, the scroll of the content under them
+        '''
+        moves = [(box.x - x, box.y - y) for box, (x, y), template in zip(self.text_boxes, self._origins, self._templates)
+                 if template is not None and template.std() >= MIN_TEMPLATE_STD]
+        if not moves:
+            return 0, 0
+        return int(np.median([dx for dx, _ in moves])), int(np.median([dy for _, dy in moves]))
+
+    def update(self, gray: np.ndarray) -> bool:
+        '''
+        Follow every tracked box into this frame.
+        Returns False when tracking confidence dropped and the frame should be OCR'd
+        '''
+        confidences = [self._track(i, gray) for i in range(len(self.text_boxes))]
+        self.confidence = min(confidences, default=1.0)
+        return self.confidence >= self.min_confidence
+
+    def _track(self, i: int, gray: np.ndarray) -> float:
+        text_box, template = self.text_boxes[i], self._templates[i]
+        if template is None or template.std() < MIN_TEMPLATE_STD:
+            # Nothing to lock on to, keep the box where it is
+            return 1.0
+
+        x1 = max(text_box.x - self.search_margin, 0)
+        y1 = max(text_box.y - self.search_margin, 0)
+        x2 = min(text_box.x + text_box.w + self.search_margin, gray.shape[1])
+        y2 = min(text_box.y + text_box.h + self.search_margin, gray.shape[0])
+        window = gray[y1:y2, x1:x2]
+        if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            # The box left the frame
+            return 0.0
+
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, confidence, _, location = cv2.minMaxLoc(scores)
+        text_box.x = x1 + location[0]
+        text_box.y = y1 + location[1]
+        return confidence if np.isfinite(confidence) else 0.0